@@ -0,0 +1,239 @@
+#!/usr/bin/python
+
+#Benchmarks for the deflicker and metering hot paths, on synthetic sequences.
+#
+#Each benchmark runs in a fresh interpreter, so its peak memory is its own.
+#Results go to a JSON file with --save; run again with --baseline to compare
+#against it, eg. before and after a change, on the same machine:
+#    python benchmark.py --save baseline.json
+#    python benchmark.py --baseline baseline.json
+
+import os, sys, json, time, shutil, argparse, platform, subprocess, tempfile
+import numpy as np
+
+ROOT=os.path.dirname(os.path.abspath(__file__))
+
+SIZES={
+    'small':  (320, 240),
+    'medium': (1296, 972),
+    'full':   (2592, 1944),
+}
+
+#Benchmark, and the largest frame it's worth running on; the pure Python
+#pixel averaging takes minutes a frame at full size.
+BENCHMARKS=[
+    ('brightness',        None),
+    ('find_level_bounds', None),
+    ('level_adjust',      None),
+    ('pixel_average',     (320, 240)),
+    ('average_pixels',    None),
+    ('avgbrightness',     None),
+    ('deflicker',         None),
+]
+
+def synthetic(size, n=12, seed=0):
+    """
+    A deterministic timelapse sequence of `n` frames: a lit gradient scene
+    with a textured foreground, sensor noise, and flicker from both a slow
+    drift in light and a random gain on each frame.  Returns a list of
+    H x W x 3 uint8 arrays.
+    """
+    (w, h)=size
+    R=np.random.RandomState(seed)
+    y=np.linspace(0, 1, h)[:,None]
+    x=np.linspace(0, 1, w)[None,:]
+    sky=np.dstack([ 90+60*(1-y)+20*x, 110+70*(1-y)+10*x, 150+80*(1-y)+0*x ])
+    ground=np.dstack([ 60+30*x+0*y, 70+20*x+0*y, 40+10*x+0*y ])
+    texture=R.normal(0, 18, (h, w, 1))
+    scene=np.where(y[...,None]<0.6, sky, ground+texture)
+    frames=[]
+    for i in range(n):
+        gain=(1+0.2*np.sin(2*np.pi*i/n))*(1+R.normal(0, 0.06))
+        noise=R.normal(0, 4, (h, w, 3))
+        frames.append(np.clip(scene*gain+noise, 0, 255).astype(np.uint8))
+    return frames
+
+def writesequence(folder, size, n=12, infix='pipic'):
+    from PIL import Image
+    names=[]
+    for (i, a) in enumerate(synthetic(size, n)):
+        name='%s%03d.jpg' % (infix, i)
+        Image.fromarray(a).save(os.path.join(folder, name))
+        names.append(name)
+    return names
+
+def peakmemory():
+    """
+    Peak resident memory of this process, in bytes, or None.
+    """
+    try:
+        f=open('/proc/self/status')
+        status=dict([ line.split(':', 1) for line in f if ':' in line ])
+        f.close()
+        return int(status['VmHWM'].split()[0])*1024
+    except (IOError, KeyError, ValueError):
+        return None
+
+#-------------------------------------------------------------------------------
+
+class meter:
+    #Just what timelapse.avgbrightness needs of a timelapse.
+    metersite='a'
+
+def run(name, folder, mintime=1.0):
+    """
+    Run benchmark `name` on the sequence in `folder`, in this process.
+    Returns (frames per second, peak memory in bytes).
+    """
+    sys.path.insert(0, ROOT)
+    from PIL import Image
+    import deflicker
+    names=sorted([ x for x in os.listdir(folder) if x.endswith('.jpg') ])
+    os.chdir(folder)
+    if name=='deflicker':
+        out=open(os.devnull, 'w')
+        stdout=sys.stdout
+        sys.stdout=out
+        start=time.time()
+        try:
+            deflicker.main(['-o', 'mod'])
+        finally:
+            sys.stdout=stdout
+        return (len(names)/(time.time()-start), peakmemory())
+
+    images=[ deflicker.lapseimage(x) for x in names ]
+    for im in images:
+        im.image.load()
+    if name=='level_adjust':
+        bounds=[ im.find_level_bounds(0.05) for im in images ]
+    if name=='average_pixels':
+        arrays=[ np.asarray(im.image) for im in images ]
+    if name=='avgbrightness':
+        import timelapse
+        avgbrightness=timelapse.timelapse.avgbrightness.im_func
+
+    def once(i):
+        im=images[i]
+        if name=='brightness':
+            im.brightness()
+        elif name=='find_level_bounds':
+            im.find_level_bounds(0.05)
+        elif name=='level_adjust':
+            im.level_adjust(*bounds[i])
+        elif name=='pixel_average':
+            I=[ images[x].image for x in deflicker.window(i, 2, len(images)) ]
+            deflicker.lapseimage(im.filename, im.image.copy()).pixel_average(I, cutoff=16)
+        elif name=='average_pixels':
+            Q=[ arrays[x] for x in deflicker.window(i, 2, len(images)) ]
+            deflicker.average_pixels(arrays[i], Q, cutoff=16)
+        elif name=='avgbrightness':
+            avgbrightness(meter, im.image)
+
+    n=0
+    start=time.time()
+    while True:
+        once(n%len(images))
+        n+=1
+        elapsed=time.time()-start
+        if elapsed>=mintime: break
+    return (n/elapsed, peakmemory())
+
+def measure(name, folder, mintime=1.0):
+    """
+    Run benchmark `name` in a fresh interpreter.  Returns a dict of frames
+    per second and peak memory, or None if it failed.
+    """
+    p=subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run', name,
+                        folder, '--mintime', str(mintime)],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (out, err)=p.communicate()
+    if p.returncode!=0:
+        print err
+        return None
+    return json.loads(out.strip().split('\n')[-1])
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Benchmarks in `results` that are more than `tolerance` slower, or use
+    that much more memory, than in `baseline`.  Returns a list of
+    (key, what, now, then).
+    """
+    worse=[]
+    for (key, r) in sorted(results.items()):
+        b=baseline.get(key)
+        if r is None or b is None: continue
+        if r['fps']<b['fps']*(1-tolerance):
+            worse.append( (key, 'fps', r['fps'], b['fps']) )
+        if r['peak'] and b['peak'] and r['peak']>b['peak']*(1+tolerance):
+            worse.append( (key, 'peak', r['peak'], b['peak']) )
+    return worse
+
+#-------------------------------------------------------------------------------
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark deflicker and metering on synthetic sequences.')
+    parser.add_argument('-s', '--sizes', nargs='+', default=['small', 'medium'], choices=sorted(SIZES), help='Frame sizes to run at.  Default: small medium')
+    parser.add_argument('-b', '--bench', nargs='+', default=None, choices=[ x[0] for x in BENCHMARKS ], help='Benchmarks to run.  Default: all of them.')
+    parser.add_argument('-n', '--frames', default=12, type=int, help='Frames in each synthetic sequence.  Default: 12')
+    parser.add_argument('-m', '--mintime', default=1.0, type=float, help='Run each benchmark for at least this many seconds.  Default: 1')
+    parser.add_argument('--save', default=None, type=str, help='Write the results to this JSON file, as a baseline.')
+    parser.add_argument('--baseline', default=None, type=str, help='Compare against a JSON file written by --save.')
+    parser.add_argument('-t', '--tolerance', default=0.1, type=float, help='With --baseline, report anything this much slower or bigger.  Default: 0.1')
+    parser.add_argument('--run', nargs=2, default=None, metavar=('BENCH', 'FOLDER'), help=argparse.SUPPRESS)
+    args=parser.parse_args(argv)
+
+    if args.run is not None:
+        (fps, peak)=run(args.run[0], args.run[1], args.mintime)
+        print json.dumps({'fps': fps, 'peak': peak})
+        return True
+
+    baseline=None
+    if args.baseline is not None:
+        f=open(args.baseline)
+        baseline=json.load(f)['results']
+        f.close()
+
+    benches=[ x for x in BENCHMARKS if args.bench is None or x[0] in args.bench ]
+    results={}
+    print '%-26s %10s %10s %10s' % ('Benchmark', 'Frames/s', 'Peak Mb', 'Baseline')
+    for size in args.sizes:
+        (w, h)=SIZES[size]
+        folder=tempfile.mkdtemp()
+        try:
+            writesequence(folder, (w, h), args.frames)
+            for (name, limit) in benches:
+                if limit is not None and w*h>limit[0]*limit[1]: continue
+                key='%s/%dx%d' % (name, w, h)
+                r=measure(name, folder, args.mintime)
+                results[key]=r
+                if r is None:
+                    print '%-26s     failed' % key
+                    continue
+                ratio=''
+                if baseline is not None and baseline.get(key):
+                    ratio='%9.2fx' % (r['fps']/baseline[key]['fps'])
+                print '%-26s %10.2f %10.1f %10s' % (key, r['fps'], (r['peak'] or 0)/1048576.0, ratio)
+        finally:
+            shutil.rmtree(folder)
+
+    if args.save is not None:
+        f=open(args.save, 'w')
+        json.dump({'machine': platform.node(), 'platform': platform.platform(),
+                   'python': platform.python_version(), 'time': time.time(),
+                   'frames': args.frames, 'results': results}, f, indent=1, sort_keys=True)
+        f.close()
+
+    if baseline is not None:
+        worse=compare(results, baseline, args.tolerance)
+        for (key, what, now, then) in worse:
+            if what=='fps':
+                print 'Slower: %s at %.2f frames/s, was %.2f' % (key, now, then)
+            else:
+                print 'Bigger: %s peaked at %.1f Mb, was %.1f' % (key, now/1048576.0, then/1048576.0)
+        if worse: return False
+    return True
+
+#-------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+   if not main(sys.argv[1:]): sys.exit(1)
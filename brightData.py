@@ -1,15 +1,26 @@
 import Image
-import subprocess
 import random
-import os, sys, getopt
+import os, sys, getopt, time
+import io, picamera
+from fractions import Fraction
 
 usagestring="Usage: brightData.py [options]\n"
 usagestring+="Options:\n"
 usagestring+="-q      : Print this usage screen.\n"
 usagestring+="-n      : Numbe of shots to take.  Best not to mix with manual ss/iso.\n"
-usagestring+="-s 5000 : Manually set shutter speed.\n"
+usagestring+="-s 5000 : Manually set shutter speed, up to 6000000.\n"
 usagestring+="-o 100  : Manually set ISO.\n"
 
+#Longest shutter speed the camera can give, at its lowest framerate.
+MAXSS=6000000
+
+def framerate(ss):
+    """
+    A framerate slow enough not to cut short a shutter speed of `ss`
+    microseconds, up to 30fps.
+    """
+    return min(Fraction(30), Fraction(1000000, ss))
+
 def argassign(arg, typ='int'):
     #Assign integer arg to variable, or quit if it fails.
     try:
@@ -27,8 +38,8 @@ def argassign(arg, typ='int'):
 
 def main(argv):
 
-    w=str(64)
-    h=str(48)
+    w=64
+    h=48
     initialss=10000
     initialiso=100
 
@@ -55,6 +66,9 @@ def main(argv):
             nshots=argassign(arg,'int')
         elif opt=="-s":
             ss=argassign(arg,'int')
+            if not 0<ss<=MAXSS:
+                print usagestring
+                sys.exit(2)
         elif opt=="-o":
             iso=argassign(arg,'int')
 
@@ -70,31 +84,45 @@ def main(argv):
     except:
         os.mkdir('/home/pi/brdata/')
 
+    #One camera for the whole run, rather than starting raspistill twice for
+    #every sample.
+    camera=picamera.PiCamera()
+    camera.resolution=(w, h)
+    camera.hflip=True
+    camera.vflip=True
+    camera.framerate=framerate(initialss)
+    time.sleep(1)
+    camera.awb_mode='off'
+
+    def shoot(ss, iso, settle=2):
+        #The gains are only chosen, to suit the ISO, while exposure is on
+        #automatic, and are fixed once it goes off.  So set the ISO, give the
+        #gains a few frames to settle, and only then lock them.  The
+        #framerate bounds the shutter speed, and would quietly shorten a
+        #long exposure, leaving it misnamed in the training pairs.
+        camera.framerate=framerate(ss)
+        camera.exposure_mode='auto'
+        camera.iso=iso
+        #At least a couple of frames, however slow.
+        time.sleep(max(settle, 2/float(camera.framerate)))
+        camera.shutter_speed=ss
+        camera.exposure_mode='off'
+        stream=io.BytesIO()
+        camera.capture(stream, format='jpeg')
+        stream.seek(0)
+        return Image.open(stream)
+
     for i in range(nshots):
-        dtime=subprocess.check_output(['date', '+%y%m%d_%T']).strip()
-        dtime=dtime.replace(':', '.')
+        #Samples can come within a second of each other now.
+        dtime=time.strftime('%y%m%d_%H.%M.%S')+'_%04d' % i
         filename1='/home/pi/brdata/'+hostname+'_'+dtime+'_'+'base.jpg'
         filename2='/home/pi/brdata/'+hostname+'_'+dtime+'_'+str(ss)+'_'+str(iso)+'.jpg'
 
         #Take the picture with base ss and iso.
-        options='-hf -vf -awb off -n'
-        options+=' -w '+w+' -h '+h
-        options+=' -t 100'
-        options+=' -ss '+str(initialss)
-        options+=' -ISO '+str(initialiso)
-        options+=' -o new.jpg'
-        subprocess.call('raspistill '+options, shell=True)
-        im1=Image.open('new.jpg')
+        im1=shoot(initialss, initialiso)
 
         #Take the picture with new ss and iso.
-        options='-hf -vf -awb off -n'
-        options+=' -w '+w+' -h '+h
-        options+=' -t 100'
-        options+=' -ss '+str(ss)
-        options+=' -ISO '+str(iso)
-        options+=' -o new.jpg'
-        subprocess.call('raspistill '+options, shell=True)
-        im2=Image.open('new.jpg')
+        im2=shoot(ss, iso)
         histogram=im2.convert('L').histogram()
         #Ignore mostly-black and mostly-white images.
         if histogram[0]<64*16 and histogram[-1]<64*16:
@@ -104,6 +132,7 @@ def main(argv):
         ss=random.randint(minss, maxss)
         iso=random.randint(miniso, maxiso)
 
+    camera.close()
     return True
 
 #-------------------------------------------------------------------------------
@@ -0,0 +1,88 @@
+import os, json
+from time import time
+
+class checkpoint:
+    """
+    Crash-safe store for the exposure controller's state, so a timelapse can
+    carry on after a reboot without recalibrating.
+
+    Each `save` writes a complete JSON document to a temporary file and
+    renames it over the old one, so the file holds either the previous state
+    or the new one, never a torn mix.  Syncing to the card on every shot
+    would cost two synchronous writes a frame, so a save is only synced, file
+    and rename, once `syncevery` seconds have passed since the last synced
+    one.  After a power cut, the state may be up to that old, which costs a
+    few shots of smoothing, not a recalibration.  `load` only returns a
+    state saved within the last `maxage` seconds; older ones are stale, as
+    the light has likely moved on.
+
+    EXAMPLE::
+        C=checkpoint('/media/Usb-Drive/Timelapse/checkpoint.json', maxage=600)
+        C.save({'ss': 5000, 'iso': 100, 'deadline': time()+15})
+        state=C.load()
+        if state is None:
+            findinitialparams()
+    """
+    def __init__(self, filename, maxage=600, syncevery=60):
+        self.filename=filename
+        self.maxage=maxage
+        self.syncevery=syncevery
+        #When the last synced save was stamped.
+        self.synced=None
+
+    def __repr__(self):
+        return 'Checkpoint '+self.filename
+
+    def save(self, state, t=None):
+        """
+        Atomically replace the checkpoint with the dict `state`, stamped with
+        the time `t`, and sync it to disk if it's time to.  Returns True if
+        it was synced.
+        """
+        if t is None: t=time()
+        sync=(self.synced is None or not 0<=t-self.synced<self.syncevery)
+        state=dict(state)
+        state['saved']=t
+        tmp=self.filename+'.tmp'
+        f=open(tmp, 'w')
+        json.dump(state, f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+        os.rename(tmp, self.filename)
+        if not sync: return False
+        self.synced=t
+        #Make the rename itself durable.
+        try:
+            d=os.open(os.path.dirname(os.path.abspath(self.filename)), os.O_RDONLY)
+        except OSError:
+            return True
+        try:
+            os.fsync(d)
+        except OSError:
+            pass
+        os.close(d)
+        return True
+
+    def read(self):
+        """
+        The saved state, however old, or None if there isn't a readable one.
+        """
+        try:
+            f=open(self.filename)
+            state=json.load(f)
+            f.close()
+        except (IOError, ValueError):
+            return None
+        if not isinstance(state, dict) or 'saved' not in state: return None
+        return state
+
+    def load(self, t=None):
+        """
+        The saved state if it is fresh at time `t`, or None.
+        """
+        if t is None: t=time()
+        state=self.read()
+        if state is None or not 0<=t-state['saved']<=self.maxage: return None
+        return state
@@ -4,18 +4,49 @@ import Image
 import os
 import sys, argparse
 import subprocess
+import tempfile
+import shutil
 import datetime
 import random
+import time
+import numpy as np
+from framelog import framelog, matches
+from framecache import framecache
+from prefetch import stagestats, prefetcher, writebehind
+from checkpoint import checkpoint
+import histmatch
+import gaingrid
 
 def pixel_level(p,a,b):
     if p<a: return 0
     if p>b: return 255
     return (p-a)*255/(b-a)
 
+def mean_level(h, pixels):
+    #Mean of a greyscale histogram, rounded down as the levels are.
+    return sum([i*h[i] for i in range(len(h))])/pixels
+
+def level_bounds(h, pixels, thresh=0.005):
+    #Find lower boundary a.
+    a=0; t=0
+    while a<255 and t<thresh*pixels:
+        a+=1
+        t+=h[a]
+    #Find upper boundary b.
+    b=255; t=0
+    while b>0 and t<thresh*pixels:
+        b-=1
+        t+=h[b]
+    #Avoid crushing the image too much.
+    a=min(a,64)
+    b=max(b,256-64)
+    return (a,b)
+
 class lapseimage:
-    def __init__(self, filename):
+    def __init__(self, filename, image=None):
         self.filename=filename
-        self.image=Image.open(filename)
+        if image is None: image=Image.open(filename)
+        self.image=image
         self.size=self.image.size
         self.pixels=self.size[0]*self.size[1]
         self.modified=None
@@ -34,8 +65,7 @@ class lapseimage:
         return self.greyscale().histogram()
 
     def brightness(self):
-        h=self.greyhistogram()
-        return sum([i*h[i] for i in range(len(h))])/self.pixels
+        return mean_level(self.greyhistogram(), self.pixels)
 
     def variance(self):
         h=self.greyhistogram()
@@ -55,21 +85,7 @@ class lapseimage:
     #--------Auto-Levelling---------------------------------------------------------
 
     def find_level_bounds(self, thresh=0.005):
-        h=self.greyhistogram()
-        #Find lower boundary a.
-        a=0; t=0
-        while a<255 and t<thresh*self.pixels:
-            a+=1
-            t+=h[a]
-        #Find upper boundary b.
-        b=255; t=0
-        while b>0 and t<thresh*self.pixels:
-            b-=1
-            t+=h[b]
-        #Avoid crushing the image too much.
-        a=min(a,64)
-        b=max(b,256-64)
-        return (a,b)
+        return level_bounds(self.greyhistogram(), self.pixels, thresh)
 
     def level_adjust(self,a,b):
         im=self.image.copy()
@@ -112,8 +128,11 @@ class lapseimage:
         parsedate: Try to extract a timestamp from the filename and print that instead.
         gravity: Gravity option to pass to imagemagick; determines text placement position.
         """
-        self.image.save('tmp.jpg')
-        command = 'convert tmp.jpg '
+        #A scratch file of our own, as several processes may be annotating.
+        (fd, tmp)=tempfile.mkstemp(suffix='.jpg')
+        os.close(fd)
+        self.image.save(tmp)
+        command = 'convert '+tmp+' '
         command += ' -gravity '+gravity
         if parsedate:
             try:
@@ -126,9 +145,11 @@ class lapseimage:
                 ann=self.filename
         else:
             ann=self.filename
-        command+= ' -font Ubuntu-Bold -pointsize 24 -annotate 0 "'+ann+'" tmp.jpg'
+        command+= ' -font Ubuntu-Bold -pointsize 24 -annotate 0 "'+ann+'" '+tmp
         subprocess.call( command, shell=True )
-        self.image=Image.open('tmp.jpg')
+        self.image=Image.open(tmp)
+        self.image.load()
+        os.remove(tmp)
 
 #-------------------------------------------------------------------------------
 
@@ -148,6 +169,409 @@ def argassign(arg, typ='int'):
 
 #-------------------------------------------------------------------------------
 
+def find_images(infix, log=None):
+    """
+    The raw frames in the current folder, in order.  Pass the frame
+    catalogue as `log` to only read what was added to it since last time.
+    Frames are matched on their file names, so catalogued frames in
+    subfolders are found too, by their paths from the current folder.
+    """
+    #Use the frame catalogue written during the shoot if there is one.
+    if log is None and os.path.exists('frames.log'): log=framelog('.')
+    if log is not None:
+        image_list=[ x for x in log.refresh().list(infix) if matches(x, '', 'jpg') ]
+    else:
+        image_list=[ x for x in os.listdir('.') if matches(x, infix, 'jpg') ]
+    image_list.sort()
+    return image_list
+
+def window(i, n, N):
+    """
+    Indices of the frames that frame `i` of `N` is pixel averaged against,
+    with a pixel averaging width of `n`.
+    """
+    I=range(max(i-n,0), min(i+n, N))
+    I.remove(i)
+    return I
+
+#The options that decide what deflicker_frame does.
+OPTIONS=['bright', 'pixelavg', 'thresh', 'annotate', 'compare', 'infix', 'outfix']
+
+def outname(filename, args):
+    #Alongside the frame, if it's in a subfolder.
+    (folder, name)=os.path.split(filename)
+    return os.path.join(folder, args.outfix+name[len(args.infix):])
+
+def average_pixels(p, Q, cutoff=32, rows=64):
+    """
+    lapseimage.pixel_average for H x W x 3 arrays: each pixel of `p` is
+    averaged with those of the arrays in `Q` that are within `cutoff` of it
+    in every channel.  Works a few rows at a time, straight from a
+    `framecache`.
+    """
+    out=np.empty_like(p)
+    for y in range(0, p.shape[0], rows):
+        P=p[y:y+rows].astype(np.int32)
+        total=P.copy()
+        count=np.ones(P.shape[:2], dtype=np.int32)
+        for q in Q:
+            q=q[y:y+rows].astype(np.int32)
+            close=(np.abs(q-P)<cutoff).all(axis=2)
+            total+=q*close[...,None]
+            count+=close
+        out[y:y+rows]=total//count[...,None]
+    return out
+
+def deflicker_frame(image_list, i, args, load=None, cache=None, save=None, table=None, gains=None):
+    """
+    Process frame `i` of `image_list` with the options in `args`, and save
+    it.  Returns the name it was saved under.
+
+    The result depends only on the frame and its pixel averaging window, so
+    frames can be processed in any order, or on different machines.
+    Frames are opened with `load`, if given, which must return a decoded
+    image that we won't modify, or read from a `framecache`.  They are
+    saved with `save`, which defaults to `save_frame`.  A lookup `table`
+    from histmatch.tables replaces the brightness and level corrections, and
+    a grid of `gains` from gaingrid.gains the brightness correction.
+    """
+    name=image_list[i]
+    modname=outname(name, args)
+    I=[]
+    if args.pixelavg>1:
+        I=[ image_list[x] for x in window(i, args.pixelavg, len(image_list)) ]
+
+    if cache is not None:
+        #pixel average, straight from the cache.
+        if I:
+            a=average_pixels(cache.array(name), [ cache.array(x) for x in I ], cutoff=16)
+            im=lapseimage(name, Image.fromarray(a))
+        else:
+            im=lapseimage(name, cache.image(name))
+    else:
+        if load is None:
+            load=Image.open
+            im=lapseimage(name)
+        else:
+            im=lapseimage(name, load(name).copy())
+        #pixel average, against the original neighbouring frames.
+        if I:
+            im.image=im.pixel_average([ load(x) for x in I ], cutoff=16)
+
+    if table is not None:
+        #histogram matching, levels and all.
+        im.image=im.image.point(table)
+    else:
+        #brightness correction
+        bright=float(args.bright)
+        if gains is not None:
+            im.image=Image.fromarray(gaingrid.apply(np.asarray(im.image), gains))
+        elif bright>0:
+            b=im.brightness()
+            k=bright/b
+            im.image=im.image.point(lambda p: p*k)
+
+        #auto-levels
+        if args.thresh>0:
+            (a,b)=im.find_level_bounds(args.thresh)
+            im.image=im.level_adjust(a,b)
+
+    if save is None: save=save_frame
+    save(im, modname, args)
+    return modname
+
+def save_frame(im, modname, args):
+    if args.annotate==1:
+        im.annotate(parsedate=False)
+    elif args.annotate==2:
+        im.annotate(parsedate=True)
+
+    if args.compare==1:
+        im.image.save(modname)
+        command='convert '+im.filename+' '+modname+' +append '+modname
+        subprocess.call( command, shell=True )
+    else:
+        im.image.save(modname)
+
+#-------------------------------------------------------------------------------
+#Strip processing, for big frames and wide windows on a Pi's memory.
+
+def memory(field='VmHWM'):
+    """
+    This process's peak (VmHWM) or current (VmRSS) resident memory in bytes,
+    or None if unknown.
+    """
+    try:
+        f=open('/proc/self/status')
+        status=dict([ line.split(':', 1) for line in f if ':' in line ])
+        f.close()
+        return int(status[field].split()[0])*1024
+    except (IOError, KeyError, ValueError):
+        return None
+
+class rawstore:
+    """
+    Decoded frames, kept as raw pixels in scratch files, so that a band of
+    rows of any of them can be read back without the rest of the frame.
+    """
+    def __init__(self):
+        self.folder=tempfile.mkdtemp()
+        #name -> (mode, size, scratch file)
+        self.frames={}
+        self.added=0
+
+    def __repr__(self):
+        return 'Raw frame store, %d frames' % len(self.frames)
+
+    def __contains__(self, name):
+        return name in self.frames
+
+    def add(self, name, rows=64):
+        im=Image.open(name)
+        im.load()
+        (w, h)=im.size
+        filename=os.path.join(self.folder, '%d.raw' % self.added)
+        self.added+=1
+        f=open(filename, 'wb')
+        #A few rows at a time, rather than a second copy of the whole frame.
+        for y in range(0, h, rows):
+            f.write(im.crop((0, y, w, min(y+rows, h))).tobytes())
+        f.close()
+        self.frames[name]=(im.mode, im.size, filename)
+
+    def info(self, name):
+        return self.frames[name][:2]
+
+    def band(self, name, y0, y1):
+        """
+        Rows `y0` to `y1` of frame `name`, as an image.
+        """
+        (mode, (w, h), filename)=self.frames[name]
+        row=len(mode)*w
+        f=open(filename, 'rb')
+        f.seek(y0*row)
+        data=f.read((y1-y0)*row)
+        f.close()
+        return Image.frombytes(mode, (w, y1-y0), data)
+
+    def discard(self, name):
+        os.remove(self.frames.pop(name)[2])
+
+    def close(self):
+        shutil.rmtree(self.folder)
+        self.frames={}
+
+class stripprocessor:
+    """
+    Processes frames exactly as deflicker_frame does, but in horizontal
+    bands, so memory use stays within `budget` bytes however big the frames
+    or the pixel averaging window.
+
+    Each frame is decoded once, as it enters the window, into a `rawstore`.
+    For each band, the rows of every frame in the window are read back,
+    averaged, and pasted into the output frame, and its histogram summed.
+    The brightness and level corrections are then worked out from the
+    whole-frame histograms and applied band by band.  Only the output frame
+    is ever held whole.
+
+    EXAMPLE::
+        S=stripprocessor(image_list, args, budget=100*1048576)
+        for i in range(len(image_list)):
+            S.frame(i)
+        S.close()
+    """
+    def __init__(self, image_list, args, budget, minrows=8):
+        self.image_list=image_list
+        self.args=args
+        self.budget=budget
+        self.minrows=minrows
+        self.store=rawstore()
+        self.base=memory('VmRSS') or 0
+
+    def __repr__(self):
+        return 'Strip processor, %.1f Mb budget' % (self.budget/1048576.0)
+
+    def rows(self, w, h, n):
+        """
+        Band height that keeps us in budget with `n` frames in the window.
+        """
+        #PIL keeps RGB at 4 bytes a pixel.  The output frame is held whole, as
+        #is each frame, separately, while it is decoded.  Then there's a band
+        #of each frame in the window, the raw rows being read into the next,
+        #and up to three corrected copies of the averaged band.
+        spare=self.budget-self.base-4*w*h
+        return int(max(self.minrows, min(h, spare/(4*w*(n+4)))))
+
+    def bands(self, h, rows):
+        return [ (y, min(y+rows, h)) for y in range(0, h, rows) ]
+
+    def frame(self, i, table=None, gains=None):
+        """
+        Process frame `i`, and save it, with a histogram matching `table` or
+        grid of `gains` if given.  Returns the name it was saved under.
+        """
+        args=self.args
+        image_list=self.image_list
+        name=image_list[i]
+        I=[]
+        if args.pixelavg>1:
+            I=[ image_list[x] for x in window(i, args.pixelavg, len(image_list)) ]
+        for x in self.store.frames.keys():
+            if x not in I and x!=name: self.store.discard(x)
+        for x in [name]+I:
+            if x not in self.store: self.store.add(x)
+        (mode, (w, h))=self.store.info(name)
+        bands=self.bands(h, self.rows(w, h, len(I)+1))
+
+        #pixel average, band by band, into the output frame.
+        out=Image.new(mode, (w, h))
+        hist=[0]*256
+        for (y0, y1) in bands:
+            im=lapseimage(name, self.store.band(name, y0, y1))
+            if I:
+                im.image=im.pixel_average([ self.store.band(x, y0, y1) for x in I ], cutoff=16)
+            out.paste(im.image, (0, y0))
+            hist=[ x+y for (x, y) in zip(hist, im.greyhistogram()) ]
+
+        #brightness correction
+        points=[]
+        bright=float(args.bright)
+        if table is not None:
+            points.append(table)
+        elif gains is not None:
+            hist=[0]*256
+            for (y0, y1) in bands:
+                band=np.asarray(out.crop((0, y0, w, y1)))
+                band=Image.fromarray(gaingrid.apply(band, gains, y0, h))
+                out.paste(band, (0, y0))
+                hist=[ x+y for (x, y) in zip(hist, band.convert('L').histogram()) ]
+        elif bright>0:
+            b=mean_level(hist, w*h)
+            k=bright/b
+            points.append(lambda p: p*k)
+            if args.thresh>0:
+                hist=[0]*256
+                for (y0, y1) in bands:
+                    band=out.crop((0, y0, w, y1)).point(points[0])
+                    hist=[ x+y for (x, y) in zip(hist, band.convert('L').histogram()) ]
+
+        #auto-levels
+        if args.thresh>0 and table is None:
+            (a,b)=level_bounds(hist, w*h, args.thresh)
+            points.append(lambda p: pixel_level(p,a,b))
+
+        for (y0, y1) in bands:
+            band=out.crop((0, y0, w, y1))
+            for f in points:
+                band=band.point(f)
+            out.paste(band, (0, y0))
+
+        modname=outname(name, args)
+        save_frame(lapseimage(name, out), modname, args)
+        return modname
+
+    def close(self):
+        self.store.close()
+
+class watcher:
+    """
+    Deflickers frames as they arrive, a few frames behind the camera, rather
+    than in one batch after the shoot.
+
+    Each `step` looks for new frames, in the frame catalogue if there is one,
+    and processes every frame whose pixel averaging window has arrived.  The
+    frames in the window are kept decoded, so each is read only once.
+    Progress is checkpointed after every frame, so a restarted watcher
+    carries on where it left off, if the options are the same.
+
+    EXAMPLE::
+        W=watcher(args)
+        W.run(poll=5)
+    """
+    def __init__(self, args, filename='deflicker.json'):
+        self.args=args
+        self.options=dict([ (x, getattr(args, x)) for x in OPTIONS ])
+        self.checkpoint=checkpoint(filename)
+        self.log=None
+        #Decoded frames, by name, from the start of the current window.
+        self.buffer={}
+        #Last frame processed.
+        self.last=None
+        self.processed=0
+        state=self.checkpoint.read()
+        if state is not None and state.get('options')==self.options:
+            self.last=state['last']
+            self.processed=state['processed']
+
+    def __repr__(self):
+        return 'Deflicker watcher, %d frames processed' % self.processed
+
+    def load(self, name):
+        if name not in self.buffer:
+            im=Image.open(name)
+            im.load()
+            self.buffer[name]=im
+        return self.buffer[name]
+
+    def arrived(self, names):
+        """
+        Whether the frames in `names` are all readable in full.  Frames still
+        being written fail to decode, and are tried again next time.
+        """
+        for x in names:
+            try:
+                self.load(x)
+            except IOError:
+                return False
+        return True
+
+    def step(self, final=False):
+        """
+        Process every frame whose window is complete, or, if `final`, every
+        remaining frame.  Returns the number processed.
+        """
+        if self.log is None and os.path.exists('frames.log'): self.log=framelog('.')
+        image_list=find_images(self.args.infix, self.log)
+        N=len(image_list)
+        i=0
+        if self.last is not None:
+            i=len([ x for x in image_list if x<=self.last ])
+        n=0
+        p=self.args.pixelavg
+        while i<N:
+            #Frame i needs frames up to i+p-1; the sequence might not have
+            #ended yet, so wait for them.
+            if i+p>N and not final: break
+            need=min(i+p, N)
+            if not self.arrived(image_list[max(i-p, 0):need]): break
+            deflicker_frame(image_list[:need], i, self.args, load=self.load)
+            self.last=image_list[i]
+            self.processed+=1
+            n+=1
+            self.checkpoint.save({'last': self.last, 'processed': self.processed,
+                                  'options': self.options})
+            #Drop frames that have left the window.
+            for x in self.buffer.keys():
+                if x<image_list[max(i+1-p, 0)]: del self.buffer[x]
+            i+=1
+        return n
+
+    def run(self, poll=5, idle=0):
+        """
+        Process frames as they arrive, checking every `poll` seconds.  Once
+        none have arrived for `idle` seconds, finish the last few frames and
+        return; if `idle` is 0, watch forever.
+        """
+        last=time.time()
+        while True:
+            if self.step():
+                last=time.time()
+            elif idle>0 and time.time()-last>idle:
+                return self.step(final=True)
+            time.sleep(poll)
+
+#-------------------------------------------------------------------------------
+
 def main(argv):
 
     parser = argparse.ArgumentParser(description='Postprocessing for timelapse images.')
@@ -158,14 +582,30 @@ def main(argv):
     parser.add_argument( '-i', '--infix', default='pipic', type=str, help='Prefix for raw files.' )
     parser.add_argument( '-c', '--compare', default=False, type=int, help='Place original and modified images side-by-side for comparison. (0 no, 1 yes.) Default: 0' )
     parser.add_argument( '-o', '--outfix', default='mod', type=str, help='Prefix for modified files.' )
-
-    args=parser.parse_args()
-
-
-    image_list=[ x for x in os.listdir('.') if x[:len(args.infix)].lower()==args.infix and x[-3:].lower()=='jpg']
-    image_list.sort()
-    N=len(image_list)
-    print 'Number of images: ', N
+    parser.add_argument( '--coordinate', default=None, type=int, metavar='PORT', help='Hand the frames out to workers connecting on PORT, instead of processing them here.' )
+    parser.add_argument( '--workers', default=0, type=int, help='With --coordinate, also start this many workers on this machine.' )
+    parser.add_argument( '--chunk', default=10, type=int, help='With --coordinate, frames per chunk of work.  Default: 10' )
+    parser.add_argument( '--shared', action='store_true', help='With --coordinate, workers read and write this folder directly, at the same path, rather than being sent the frames.' )
+    parser.add_argument( '--budget', default=0, type=float, help='Process frames in horizontal strips, keeping memory use under this many Mb.  Default: 0, for whole frames.' )
+    parser.add_argument( '--cache', action='store_true', help='Decode the frames once into frames.npy, and read them from there on later runs.  Takes precedence over --budget.' )
+    parser.add_argument( '--cachescale', default=1, type=int, help='With --cache, decode frames at 1/CACHESCALE of their size, for quick previews.  Default: 1' )
+    parser.add_argument( '--prefetch', default=2, type=int, help='Read and decode frames this far ahead, and save them this far behind, on other threads.  Set to 0 to do everything in turn.  Default: 2' )
+    parser.add_argument( '--watch', action='store_true', help='Process new frames as they arrive, a few frames behind the camera.' )
+    parser.add_argument( '--poll', default=5, type=float, help='With --watch, seconds between looks for new frames.  Default: 5' )
+    parser.add_argument( '--idle', default=0, type=float, help='With --watch, finish once no frames have arrived for this many seconds.  Default: 0, to watch forever.' )
+    parser.add_argument( '--match', default=0, type=int, metavar='RADIUS', help='Match each frame\'s histogram to the mean of those within RADIUS frames of it, instead of correcting brightness.  Corrects shadows and highlights separately.  Default: 0, off.' )
+    parser.add_argument( '--matchrgb', action='store_true', help='With --match, match each colour channel separately, rather than greyscale.' )
+    parser.add_argument( '--tiles', default=None, type=int, nargs=2, metavar=('COLS', 'ROWS'), help='Correct the brightness of each of a grid of tiles separately, instead of the whole frame, for flicker in part of the scene.  Eg. --tiles 8 6' )
+    parser.add_argument( '--tileradius', default=10, type=int, help='With --tiles, smooth each tile\'s brightness over this many frames either side.  Default: 10' )
+    parser.add_argument( '--worker', default=None, type=str, metavar='ENDPOINT', help='Process frames for the coordinator at ENDPOINT, eg. tcp://192.168.0.1:5560.  Other options are taken from the coordinator.' )
+
+    args=parser.parse_args(argv)
+
+    if args.worker is not None:
+        from distdeflicker import worker
+        return worker(args.worker)
+
+    image_list=find_images(args.infix)
 
     print 'Running with:'
     print '\tinput      :\t',args.infix
@@ -175,61 +615,103 @@ def main(argv):
     print '\tannotate   :\t',args.annotate
     print '\tcompare    :\t',args.compare
     print '\toutput     :\t',args.outfix
+    if args.match>0:
+        print '\tmatch      :\t',args.match, '(rgb)' if args.matchrgb else '(grey)'
+    if args.tiles is not None:
+        print '\ttiles      :\t%dx%d, radius %d' % (args.tiles[0], args.tiles[1], args.tileradius)
 
     if args.outfix==args.infix:
         print 'We will not overwrite original images; choose an output prefix different from the input prefix.'
         return False
 
+    if args.match>0 and args.tiles is not None:
+        print 'Choose one of --match and --tiles.'
+        return False
+
+    if (args.match>0 or args.tiles is not None) and (args.watch or args.coordinate is not None):
+        print 'Histogram matching and tiles need the whole sequence up front; they can\'t be used with --watch or --coordinate.'
+        return False
+
+    if args.watch:
+        print 'Watching for new frames...'
+        W=watcher(args)
+        W.run(poll=args.poll, idle=args.idle)
+        print W
+        return True
+
     print 'Pre-processing...'
-    bright=[]
-    for x in image_list:
+    for x in image_list[:]:
         try:
             im=lapseimage(x)
         except:
             image_list.remove(x)
-
+    N=len(image_list)
+    print 'Number of images: ', N
 
     print 'Running image processing...'
-    #pixel average
-    if args.pixelavg>1:
-        for i in range(N):
-            I=range(max(i-args.pixelavg,0), min(i+args.pixelavg, N))
-            I.remove(i)
-            I=[Image.open(image_list[x]) for x in I]
-            im.image=im.pixel_average(I, cutoff=16)
-            modname='mod'+image_list[i][len(args.infix):]
-            im.image.save(modname)
-            image_list[i]=modname
-
-    bright=float(args.bright)
+    if args.coordinate is not None:
+        from distdeflicker import coordinator
+        C=coordinator(image_list, args, port=args.coordinate, chunksize=args.chunk,
+                      shared=args.shared)
+        return C.run(workers=args.workers)
+
+    S=None
+    C=None
+    stats=stagestats()
+    if args.cache:
+        C=framecache('.', scale=args.cachescale)
+        print 'Frame cache: decoded', C.update(image_list), 'of', N, 'frames.'
+    elif args.budget>0:
+        S=stripprocessor(image_list, args, budget=args.budget*1048576)
+    T=None
+    if args.match>0:
+        print 'Matching histograms...'
+        start=time.time()
+        T=histmatch.tables(histmatch.framehistograms(image_list, cache=C, rgb=args.matchrgb),
+                           args.match, args.thresh)
+        stats.add('analyse', time.time()-start, frames=N)
+    G=None
+    if args.tiles is not None:
+        print 'Measuring tiles...'
+        start=time.time()
+        G=gaingrid.gains(gaingrid.tilemeans(image_list, tuple(args.tiles), cache=C),
+                         args.tileradius)
+        stats.add('analyse', time.time()-start, frames=N)
+    #Overlap reading and writing frames with processing them, unless memory
+    #is tight.
+    P=None
+    W=None
+    save=None
+    if args.prefetch>0 and S is None:
+        if C is None:
+            P=prefetcher(image_list, depth=args.prefetch, stats=stats)
+        W=writebehind(depth=args.prefetch, stats=stats)
+        save=lambda im, modname, args: W.put(save_frame, im, modname, args, filename=modname)
+    p=max(args.pixelavg, 1)
     for i in range(N):
         if i%100==0: print i, '\t', image_list[i]
-        modname=args.outfix+image_list[i][len(args.infix):]
-        im=lapseimage(image_list[i])
-
-        #brightness correction
-        if bright>0:
-            b=im.brightness()
-            k=bright/b
-            im.image=im.image.point(lambda p: p*k)
-
-        #auto-levels
-        if args.thresh>0:
-            (a,b)=im.find_level_bounds(args.thresh)
-            im.image=im.level_adjust(a,b)
-
-        if args.annotate==1:
-            im.annotate(parsedate=False)
-        elif args.annotate==2:
-            im.annotate(parsedate=True)
-
-        if args.compare==1:
-            im.image.save(modname)
-            command='convert '+im.filename+' '+modname+' +append '+modname
-            subprocess.call( command, shell=True )
+        start=time.time()
+        waited=stats.busy('wait read')+stats.busy('wait write')
+        table=None
+        if T is not None: table=T[i].tolist()
+        gains=None
+        if G is not None: gains=G[i]
+        if S is not None:
+            S.frame(i, table=table, gains=gains)
+        elif P is not None:
+            P.advance(max(i-p, 0), min(i+p, N))
+            deflicker_frame(image_list, i, args, load=P.load, save=save, table=table, gains=gains)
         else:
-            im.image.save(modname)
-
+            deflicker_frame(image_list, i, args, cache=C, save=save, table=table, gains=gains)
+        waited=stats.busy('wait read')+stats.busy('wait write')-waited
+        stats.add('process', time.time()-start-waited)
+    if S is not None: S.close()
+    if P is not None: P.close()
+    if W is not None: W.close()
+    print stats.report()
+
+    peak=memory()
+    if peak is not None: print 'Peak memory: %.1f Mb' % (peak/1048576.0)
     return True
 
 #-------------------------------------------------------------------------------
@@ -0,0 +1,275 @@
+#Deflicker a sequence on several machines, or processes, at once.
+#
+#A coordinator (deflicker.py --coordinate PORT) splits the sequence into
+#chunks, and workers (deflicker.py --worker tcp://HOST:PORT) ask it for a
+#chunk over zmq whenever they are idle, so faster machines simply take more.
+#Each chunk comes with the neighbouring frames its pixel averaging needs, and
+#is processed with deflicker.deflicker_frame, exactly as a serial run would.
+
+import os, sys, json, time, socket, shutil, tempfile, argparse, subprocess, traceback
+from collections import deque
+import deflicker
+
+PORT=5560
+
+def writefile(filename, data):
+    #Write to a temporary name first, so a duplicate result can't be read half
+    #written.
+    folder=os.path.dirname(filename)
+    if folder and not os.path.isdir(folder): os.makedirs(folder)
+    f=open(filename+'.tmp', 'wb')
+    f.write(data)
+    f.close()
+    os.rename(filename+'.tmp', filename)
+
+def readfile(filename):
+    f=open(filename, 'rb')
+    data=f.read()
+    f.close()
+    return data
+
+class chunk:
+    def __init__(self, n, first, last, start, stop):
+        self.n=n
+        #Frames to process, and the frames to read for them, as slices.
+        (self.first, self.last)=(first, last)
+        (self.start, self.stop)=(start, stop)
+        self.attempts=0
+        #Workers processing this chunk, and when they started.
+        self.leases={}
+        self.done=False
+
+    def __repr__(self):
+        return 'Chunk %d, frames %d to %d' % (self.n, self.first, self.last-1)
+
+class coordinator:
+    """
+    Hands out chunks of `image_list` to workers, and collects the results.
+
+    Unless `shared`, the frames a chunk needs are sent with it and the
+    processed frames sent back; with `shared`, workers read and write the
+    folder directly, so it must be at the same path on every machine.
+
+    A chunk is handed out again if its worker reports a failure or hasn't
+    finished within `lease` seconds, up to `retries` times.  Once every chunk
+    is out, idle workers take a second copy of the oldest unfinished one, so
+    one slow worker can't hold up the end of the run; whichever copy finishes
+    first is kept.
+
+    EXAMPLE::
+        C=coordinator(image_list, args, port=5560)
+        C.run(workers=2)
+    """
+    def __init__(self, image_list, args, port=PORT, chunksize=10, lease=300,
+                 retries=3, shared=False, host='*'):
+        self.image_list=image_list
+        self.options=dict([ (x, getattr(args, x)) for x in deflicker.OPTIONS ])
+        self.port=port
+        self.host=host
+        self.lease=lease
+        self.retries=retries
+        self.shared=shared
+        self.folder=os.getcwd()
+        N=len(image_list)
+        #Pixel averaging reads up to `pixelavg` frames before each frame, and
+        #one fewer after; see deflicker.window.
+        halo=args.pixelavg if args.pixelavg>1 else 0
+        self.chunks=[]
+        for first in range(0, N, chunksize):
+            last=min(first+chunksize, N)
+            self.chunks.append(chunk(len(self.chunks), first, last,
+                                     max(first-halo, 0), min(last+max(halo-1, 0), N)))
+        self.queue=deque(self.chunks)
+        self.retried=0
+        self.doubled=0
+        self.failed=[]
+        self.workers=set()
+
+    def __repr__(self):
+        return 'Deflicker coordinator, %d chunks' % len(self.chunks)
+
+    def unfinished(self):
+        return [ c for c in self.chunks if not c.done and c not in self.failed ]
+
+    def retry(self, c, worker):
+        """
+        Give up on `worker`'s copy of `c`, and queue it again if nobody else
+        is working on it.
+        """
+        del c.leases[worker]
+        c.attempts+=1
+        if c.attempts>self.retries:
+            if not c.leases:
+                print c, 'failed', c.attempts, 'times; giving up.'
+                self.failed.append(c)
+            return
+        self.retried+=1
+        if not c.leases and c not in self.queue: self.queue.appendleft(c)
+
+    def expire(self):
+        now=time.time()
+        for c in self.unfinished():
+            for (w, t) in c.leases.items():
+                if now-t>self.lease:
+                    print w, 'took too long over', c
+                    self.retry(c, w)
+
+    def finish(self, msg, data):
+        c=self.chunks[msg['chunk']]
+        if c.done: return
+        if not self.shared:
+            for (name, d) in zip(msg['outputs'], data):
+                writefile(os.path.join(self.folder, name), d)
+        c.done=True
+        c.leases={}
+        if c in self.queue: self.queue.remove(c)
+        print c, 'done by', msg['worker']
+
+    def next(self, worker):
+        """
+        The reply to an idle `worker`: a chunk, a request to wait, or stop.
+        """
+        c=None
+        if self.queue:
+            c=self.queue.popleft()
+        else:
+            #Nothing left to hand out; double up on a straggler.
+            for x in self.unfinished():
+                if worker not in x.leases and len(x.leases)<2:
+                    c=x
+                    self.doubled+=1
+                    break
+        if c is None:
+            if self.unfinished(): return [json.dumps({'type': 'wait', 'seconds': 1})]
+            return [json.dumps({'type': 'stop'})]
+        c.leases[worker]=time.time()
+        names=self.image_list[c.start:c.stop]
+        msg={'type': 'chunk', 'chunk': c.n, 'names': names,
+             'frames': range(c.first-c.start, c.last-c.start),
+             'options': self.options, 'shared': self.shared, 'folder': self.folder}
+        if self.shared: return [json.dumps(msg)]
+        return [json.dumps(msg)]+[ readfile(os.path.join(self.folder, x)) for x in names ]
+
+    def spawn(self, n):
+        """
+        Start `n` workers on this machine.
+        """
+        script=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deflicker.py')
+        endpoint='tcp://127.0.0.1:%d' % self.port
+        return [ subprocess.Popen([sys.executable, script, '--worker', endpoint])
+                 for i in range(n) ]
+
+    def run(self, workers=0, linger=5):
+        """
+        Serve chunks until every one is done or has failed for good, and the
+        workers have been told to stop.  Returns False if any chunk failed.
+        """
+        import zmq
+        context=zmq.Context.instance()
+        sock=context.socket(zmq.REP)
+        sock.bind('tcp://%s:%d' % (self.host, self.port))
+        local=self.spawn(workers)
+        stopped=set()
+        end=None
+        while True:
+            if end is None and not self.unfinished():
+                end=time.time()+linger
+            if end is not None:
+                #Done; wait a little for the workers to ask again, so they can
+                #be told to stop.
+                alive=[ p for p in local if p.poll() is None ]
+                if (self.workers<=stopped and not alive) or time.time()>end: break
+            if not sock.poll(1000):
+                self.expire()
+                continue
+            parts=sock.recv_multipart()
+            msg=json.loads(parts[0])
+            w=msg['worker']
+            self.workers.add(w)
+            if msg['type']=='done':
+                self.finish(msg, parts[1:])
+            elif msg['type']=='failed':
+                c=self.chunks[msg['chunk']]
+                print w, 'failed on', str(c)+':', msg['error']
+                if w in c.leases: self.retry(c, w)
+            self.expire()
+            reply=self.next(w)
+            if json.loads(reply[0])['type']=='stop': stopped.add(w)
+            sock.send_multipart(reply)
+        sock.close(linger=0)
+        for p in local:
+            if p.poll() is None: p.terminate()
+            p.wait()
+        if self.failed:
+            print len(self.failed), 'chunks failed:', ', '.join([ str(c) for c in self.failed ])
+            return False
+        return True
+
+#-------------------------------------------------------------------------------
+
+def work(msg, data, scratch):
+    """
+    Process a chunk.  Returns the output names, and their contents unless
+    the coordinator's folder is shared.
+    """
+    if msg['shared']:
+        folder=msg['folder']
+    else:
+        folder=scratch
+        for (name, d) in zip(msg['names'], data):
+            writefile(os.path.join(folder, name), d)
+    args=argparse.Namespace(**msg['options'])
+    cwd=os.getcwd()
+    os.chdir(folder)
+    try:
+        outputs=[ deflicker.deflicker_frame(msg['names'], i, args) for i in msg['frames'] ]
+    finally:
+        os.chdir(cwd)
+    if msg['shared']: return (outputs, [])
+    data=[ readfile(os.path.join(folder, x)) for x in outputs ]
+    for x in os.listdir(folder):
+        path=os.path.join(folder, x)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    return (outputs, data)
+
+def worker(endpoint, name=None, patience=600):
+    """
+    Process chunks from the coordinator at `endpoint` until it says stop.
+    Returns False if it stops answering for `patience` seconds.
+    """
+    import zmq
+    if name is None: name='%s:%d' % (socket.gethostname(), os.getpid())
+    context=zmq.Context.instance()
+    sock=context.socket(zmq.REQ)
+    sock.connect(endpoint)
+    scratch=tempfile.mkdtemp()
+    ready=[json.dumps({'type': 'ready', 'worker': name})]
+    request=ready
+    try:
+        while True:
+            sock.send_multipart(request)
+            if not sock.poll(patience*1000):
+                print 'No reply from', endpoint
+                return False
+            parts=sock.recv_multipart()
+            msg=json.loads(parts[0])
+            if msg['type']=='stop':
+                return True
+            if msg['type']=='wait':
+                time.sleep(msg['seconds'])
+                request=ready
+                continue
+            try:
+                (outputs, data)=work(msg, parts[1:], scratch)
+                request=[json.dumps({'type': 'done', 'worker': name, 'chunk': msg['chunk'],
+                                     'outputs': outputs})]+data
+            except Exception, e:
+                traceback.print_exc()
+                request=[json.dumps({'type': 'failed', 'worker': name, 'chunk': msg['chunk'],
+                                     'error': str(e)})]
+    finally:
+        sock.close(linger=0)
+        shutil.rmtree(scratch)
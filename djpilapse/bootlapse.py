@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+#Minimal capture daemon for boot: carries on the timelapse straight from the
+#database and checkpoint, without waiting for the web server, Celery or the
+#message broker.  Start it from crontab with
+#    @reboot  pi  python /home/pi/pipic/djpilapse/bootlapse.py
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    launched=time.time()
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djpilapse.settings")
+    os.environ["PILAPSE_NO_CELERY"]="1"
+
+    from djpilapp.capture import boot_timelapse
+
+    boot_timelapse(launched=launched)
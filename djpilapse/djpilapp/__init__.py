@@ -0,0 +1,6 @@
+import os, sys
+
+#Shared pipic modules (thumbcache, ...) live in the repository root.
+PIPIC_ROOT=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if PIPIC_ROOT not in sys.path:
+    sys.path.append(PIPIC_ROOT)
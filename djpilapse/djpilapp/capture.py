@@ -0,0 +1,340 @@
+#The capture loop and the state it keeps between shots, free of Celery, so
+#that bootlapse.py can start shooting without loading it or numpy first.
+#tasks.py wraps these as Celery tasks for the web interface.
+from __future__ import absolute_import
+from django.conf import settings
+from djpilapp.models import timelapser
+from thumbcache import thumbcache
+from framelog import framelog
+from exposurelog import exposurelog
+from smoothing import brightnesstracker
+from solar import lightmodel
+from tracing import tracer
+from scheduler import backgroundscheduler, stopchannel, stop
+from checkpoint import checkpoint
+import ready
+import os, io, subprocess
+from time import time, sleep
+
+_thumbs=None
+def get_thumbcache():
+    """
+    The thumbnail cache, created on first use.
+    """
+    global _thumbs
+    if _thumbs is None:
+        _thumbs=thumbcache(settings.PILAPSE_THUMB_DIR,
+                           budget=settings.PILAPSE_THUMB_BUDGET)
+    return _thumbs
+
+_rejectthumbs=None
+def get_rejectthumbcache():
+    """
+    Small thumbnails of discarded shots, or None if we don't keep them.
+    """
+    global _rejectthumbs
+    if _rejectthumbs is None and settings.PILAPSE_REJECT_THUMBS:
+        _rejectthumbs=thumbcache(get_thumbcache().folder+'rejected/',
+                                 budget=settings.PILAPSE_THUMB_BUDGET/8,
+                                 sizes=['small'])
+    return _rejectthumbs
+
+_framelogs={}
+def get_framelog(folder):
+    """
+    The frame catalogue of a project folder, loaded on first use.
+    """
+    if folder not in _framelogs:
+        _framelogs[folder]=framelog(folder)
+    return _framelogs[folder].refresh()
+
+_exposurelogs={}
+def get_exposurelog(folder, writer=False):
+    """
+    The per-shot exposure log of a project folder, opened on first use.
+    Only the capture task should open it as the `writer`.
+    """
+    if (folder, writer) not in _exposurelogs:
+        _exposurelogs[(folder, writer)]=exposurelog(folder, writer=writer)
+    return _exposurelogs[(folder, writer)]
+
+def get_lightmodel():
+    """
+    Daylight model for the configured location, or None if there isn't one.
+    """
+    if settings.PILAPSE_LATITUDE is None or settings.PILAPSE_LONGITUDE is None:
+        return None
+    return lightmodel(settings.PILAPSE_LATITUDE, settings.PILAPSE_LONGITUDE)
+
+_checkpoints={}
+def get_checkpoint(proj):
+    """
+    The project's checkpoint of controller state, saved after every shot.
+    Kept between shots, so that it knows when it was last synced to disk.
+    """
+    folder=proj.folder
+    if folder[-1]!='/': folder+='/'
+    if folder not in _checkpoints:
+        _checkpoints[folder]=checkpoint(folder+'checkpoint.json',
+                                        syncevery=settings.PILAPSE_CHECKPOINT_SYNC)
+    C=_checkpoints[folder]
+    C.maxage=settings.PILAPSE_RESUME_AGE
+    return C
+
+def save_checkpoint(T, S, deadline):
+    get_checkpoint(T.project).save({
+        'ss'       : T.ss,
+        'iso'      : T.iso,
+        'smoothing': S.state(),
+        'lastbr'   : T.lastbr,
+        'avgbr'    : T.avgbr,
+        'shots'    : T.shots_taken,
+        'deadline' : deadline,
+    })
+
+def get_tracker(proj, width=20):
+    """
+    The project's brightness tracker, resumed from the last checkpoint (of
+    any age) unless the smoothing settings have changed since.  A positive
+    `proj.alpha` selects exponential smoothing; otherwise we average the last
+    `width` shots.
+    """
+    if proj.alpha>0:
+        mode='ema'
+    else:
+        mode='window'
+    state=get_checkpoint(proj).read()
+    S=None
+    if state is not None:
+        S=brightnesstracker.fromstate(state['smoothing'])
+    if S is None or S.mode!=mode or (mode=='ema' and S.alpha!=proj.alpha) or (mode=='window' and S.width!=width):
+        S=brightnesstracker(mode, width=width, alpha=proj.alpha, initial=proj.brightness)
+    return S
+
+_tracer=None
+def get_tracer():
+    """
+    Per-stage latencies of the capture task, reported every
+    PILAPSE_TRACE_EVERY shots.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer=tracer(every=settings.PILAPSE_TRACE_EVERY)
+    return _tracer
+
+_metrics=None
+def get_sysmetrics():
+    """
+    The system metrics sampler, started on first use.
+    """
+    global _metrics
+    if _metrics is None:
+        from sysmetrics import sysmetrics
+        _metrics=sysmetrics()
+        _metrics.sample()
+        _metrics.start(settings.PILAPSE_METRICS_INTERVAL)
+    return _metrics
+
+_scheduler=None
+def get_scheduler():
+    """
+    Runs thumbnails and other background work between captures.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler=backgroundscheduler(hot=settings.PILAPSE_HOT_TEMP,
+                                       critical=settings.PILAPSE_CRITICAL_TEMP)
+    return _scheduler
+
+def write_preview(data):
+    """
+    Replace the web interface's preview with the JPEG `data`, whole, so
+    that a page loading it never sees half a shot.
+    """
+    tmp=settings.PILAPSE_PREVIEW+'.tmp'
+    try:
+        f=open(tmp, 'wb')
+        f.write(data)
+        f.close()
+        os.rename(tmp, settings.PILAPSE_PREVIEW)
+    except (IOError, OSError):
+        #The preview is a nicety; don't lose the shot over it.
+        pass
+
+def add_thumbs(im, data, filename):
+    with get_tracer().stage('thumbs'):
+        get_thumbcache().add(im, data, filename)
+
+def timelapse(width=20, start=None, launched=None):
+    """
+    Shoot until deactivated.  `start` is the time of the first shot, to keep
+    to the schedule of a timelapse resumed from a checkpoint.  Once the first
+    frame is in, we signal that capture is ready, with the time it took
+    since `launched`.
+    """
+    #try:
+    T=timelapser.objects.all()[0]
+    T.set_status('Timelapse active')
+    S=get_tracker(T.project, width)
+    #A stop request (see stop_timelapse) wakes the waits between shots.
+    C=stopchannel(settings.PILAPSE_STOP_SOCKET)
+    B=get_scheduler()
+    (B.sleep, B.stopped)=(C.wait, False)
+    try:
+        if start is not None:
+            B.idle(start)
+        first=True
+        while T.active and not B.stopped:
+            loopstart=time()
+            T=timelapser.objects.all()[0]
+            proj=T.project
+            S=timelapse_shoot(S, width, deadline=loopstart+proj.interval)
+            if first and S:
+                first=False
+                if launched is None: launched=loopstart
+                ready.signal('capture', launched=launched, firstframe=time()-launched)
+            if not T.active: break
+            #Wait for the next shot, doing background work if there's time.
+            B.idle(loopstart+proj.interval)
+    finally:
+        C.close()
+        B.sleep=sleep
+    #except:
+    #    T.set_active(False)
+    #    T.set_status('idle')
+    #    return False
+    with T.batch():
+        T.set_status('idle')
+        T.set_active(False)
+    B.drain()
+    return True
+
+def stop_timelapse():
+    """
+    Wake a running timelapse and have it stop now, rather than when it next
+    checks the database.
+    """
+    return stop(settings.PILAPSE_STOP_SOCKET)
+
+def boot_timelapse(launched=None):
+    """
+    Start shooting at boot if the timelapser is set to, or was shooting when
+    the Pi went down.  Carries on from a fresh checkpoint, or recalibrates if
+    it's stale.  See bootlapse.py.
+    """
+    T=timelapser.objects.all()[0]
+    if T.boot or T.active:
+        state=get_checkpoint(T.project).load()
+        if state is None:
+            T.set_active(False)
+            T.findinitialparams()
+            start=None
+        else:
+            (T.ss, T.iso, T.lastbr, T.avgbr)=(state['ss'], state['iso'], state['lastbr'], state['avgbr'])
+            T.shots_taken=state['shots']
+            T.persist('ss', 'iso', 'lastbr', 'avgbr', 'shots_taken')
+            start=state['deadline']
+        T.set_active(True)
+        timelapse(start=start, launched=launched)
+    else:
+        T.set_active(False)
+    return True
+
+def timelapse_shoot(S=None, width=20, gamma=None, deadline=None):
+    """
+    `S` is the brightnesstracker smoothing recent image brightnesses.
+    `width` is the number of images to use in finding average brightness.
+    `deadline` is the time of the next shot, for the checkpoint.
+    """
+    T=timelapser.objects.all()[0]
+    if not T.active: return None
+    proj=T.project
+    if not S: S=get_tracker(proj, width)
+    if gamma==None: gamma=1.0/width
+    L=get_tracer()
+
+    #figure out the filename.
+    dtime=subprocess.check_output(['date', '+%y%m%d_%T']).strip()
+    dtime=dtime.replace(':', '.')
+    filename=proj.folder
+    if filename[-1]!='/': filename+='/'
+    filename+= proj.project_name + '_' + dtime + '.jpg'
+
+    #Take a picture, straight into memory.
+    options='-awb auto -n'
+    options+=' -w '+str(proj.width)+' -h '+str(proj.height)
+    options+=' -t 50'
+    options+=' -ss '+str(T.ss)
+    options+=' -ISO '+str(T.iso)
+    options+=' -o -'
+    import Image
+    try:
+        print 'raspistill ' +options
+        shottime=time()
+        with L.stage('capture'):
+            data=subprocess.check_output('raspistill '+options, shell=True)
+        with L.stage('decode'):
+            im=Image.open(io.BytesIO(data))
+            im.load()
+    except:
+        return False
+    if settings.PILAPSE_PREVIEW:
+        with L.stage('preview'):
+            write_preview(data)
+
+    #Meter the shot before deciding whether to save it.
+    (ss, iso)=(T.ss, T.iso)
+    with L.stage('meter'):
+        newbr=T.avgbrightness(im)
+        avgbr=S.add(newbr)
+    T.lastbr=newbr
+    T.avgbr=avgbr
+
+    #Dynamically adjust ss and iso, following the daylight if we can.
+    light=get_lightmodel()
+    if light is not None:
+        ff=light.change(shottime, shottime+proj.interval)
+    else:
+        ff=0.0
+    (T.ss, T.iso)=T.dynamic_adjust(target=proj.brightness,
+                                   lastbr=avgbr, gamma=gamma, ff=ff)
+    print S
+    print str(newbr)+'\t'+str(avgbr)+'\t'+str(T.ss)+'\t'+str(T.iso)
+
+    delta=proj.brightness-avgbr
+    #if abs(delta)>self.maxdelta and not (maxxedbr or minnedbr):
+    kept=abs(delta)<=proj.delta
+    with L.stage('log'):
+        get_exposurelog(proj.folder, writer=True).append(ss, iso, newbr, avgbr, kept=kept)
+    if not kept:
+        #Too far from target brightness; never written.
+        if get_rejectthumbcache() is not None:
+            with L.stage('thumbs'):
+                get_rejectthumbcache().add(im, data, filename)
+    else:
+        #Saves file without exif and raster data; reduces file size by 90%,
+        try:
+            with L.stage('encode'):
+                out=io.BytesIO()
+                im.save(out, format='jpeg')
+            with L.stage('write'):
+                f=open(filename, 'wb')
+                f.write(out.getvalue())
+                f.close()
+        except:
+            return False
+        print filename
+        T.shots_taken+=1
+        T.lastshot=filename
+        with L.stage('log'):
+            get_framelog(proj.folder).add(filename, ss=ss, iso=iso, brightness=newbr)
+        get_scheduler().submit(add_thumbs, (im, data, filename), name='thumbs')
+    T1=timelapser.objects.all()[0]
+    if not T1.active: return None
+    #One write per shot; leaves `active` alone in case we were just stopped.
+    with L.stage('db'):
+        T.persist('ss', 'iso', 'lastbr', 'avgbr', 'shots_taken', 'lastshot')
+    save_checkpoint(T, S, deadline)
+    L.shot()
+    return S
+
@@ -1,5 +1,36 @@
-from django.db import models
-import os, subprocess, Image
+from django.conf import settings
+from django.db import models, transaction
+from django.db.backends.signals import connection_created
+from contextlib import contextmanager
+from exposure import exposureplanner
+from responsemodel import responsemodel
+import os, subprocess
+
+def sqlite_pragmas(sender, connection, **kwargs):
+    """
+    Run SQLite in WAL mode, and only fsync at checkpoints rather than on every
+    commit.  The database lives on the Pi's SD card, where each fsync is slow.
+    """
+    if connection.vendor=='sqlite':
+        cursor=connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL;')
+        cursor.execute('PRAGMA synchronous=NORMAL;')
+
+connection_created.connect(sqlite_pragmas)
+
+_response=None
+def response_slope():
+    """
+    Slope of the camera response model in PILAPSE_RESPONSE_MODEL, or 1.0 if
+    there is no model yet.
+    """
+    global _response
+    if _response is None:
+        M=responsemodel.load(settings.PILAPSE_RESPONSE_MODEL)
+        if M is None:
+            return 1.0
+        _response=M
+    return _response.slope
 
 class pilapse_project(models.Model):
     #Project settings
@@ -73,6 +104,13 @@ class timelapser(models.Model):
     maxss=2000000
     miniso=100
     maxiso=800
+    #ISO is raised before shutterspeeds get longer than this.
+    blurss=1000000
+    #Largest exposure change between shots, in stops.
+    maxstep=0.5
+    #Depth of nested `batch` blocks, and the fields they have changed.
+    _batch=0
+    _dirty=None
 
     def __unicode__(self):
         return "Pilapser with prefix "+self.project.project_name
@@ -80,16 +118,52 @@ class timelapser(models.Model):
     def time_elapsed(self):
         return self.shots_taken*self.project.interval
 
+    def persist(self, *fields):
+        """
+        Write the given fields (or the whole row, if none are given) to the
+        database, or hold them until the end of the enclosing `batch` block.
+        """
+        if not fields: fields=('__all__',)
+        if self._batch:
+            self._dirty.update(fields)
+            return
+        if '__all__' in fields:
+            self.save()
+        else:
+            self.save(update_fields=fields)
+
+    @contextmanager
+    def batch(self):
+        """
+        Coalesce everything persisted inside the block into one transaction.
+
+        EXAMPLE::
+            with T.batch():
+                T.set_active(False)
+                T.set_status('idle')
+        """
+        if self._batch==0: self._dirty=set()
+        self._batch+=1
+        try:
+            yield self
+        finally:
+            self._batch-=1
+            if self._batch==0 and self._dirty:
+                fields=self._dirty
+                self._dirty=None
+                with transaction.atomic():
+                    self.persist(*fields)
+
     def set_active(self, state=True):
         """
         Set the camera's `active` variable.  Used to claim the resource.
         """
         self.active=state
-        self.save()
+        self.persist('active')
 
     def set_status(self, status):
         self.status=status
-        self.save()
+        self.persist('status')
 
     def set_start_on_boot(self, state=True):
         """
@@ -116,40 +190,28 @@ class timelapser(models.Model):
         mu0=sum([i*h[i] for i in range(len(h))])/pixels
         return mu0
 
-    def dynamic_adjust(self, target=None, lastbr=None, gamma=0.1):
+    def dynamic_adjust(self, target=None, lastbr=None, gamma=0.1, ff=0.0, limit=True):
         """
-        Applies a simple gradient descent to try to correct shutterspeed and
-        brightness to match the target brightness.
+        Moves the exposure a fraction `gamma` of the way, in stops, towards the
+        target brightness, and returns the new (ss, iso).
         `gamma` determines sensitivity of adjustment.
-        A good value is 2.5 when finding initial parameters, and 0.1 during the
+        A good value is 1.0 when finding initial parameters, and 0.1 during the
         actual timelapse.  (A high value of gamma coincident with a large
         averaging period can lead to oscillating brightness.)
+        `ff` is a predicted change in scene brightness in stops (see
+        `solar.lightmodel`), applied on top of the correction.
+        Each step is limited to `maxstep` stops unless `limit` is False.
+        ISO is kept as low as possible; it only goes up once the shutterspeed
+        reaches `blurss`.
         """
         if target==None: target=self.project.brightness
         if lastbr==None: lastbr=self.lastbr
-        delta=target-lastbr
-        Adj = lambda v: int( v*(1.0+delta*gamma/target) )
-        newss=self.ss
-        newiso=self.iso
-        if delta<0:
-            #too bright.
-            if self.iso>self.miniso:
-                #reduce iso first if possible
-                newiso=Adj(self.iso)
-                newiso=max([newiso,self.miniso])
-            else:
-                newss=Adj(self.ss)
-                newss=max([newss, self.minss])
-        elif delta>0:
-            #too dim.
-            if self.ss<self.maxss:
-                #increase ss first if possible
-                newss=Adj(self.ss)
-                newss=min([newss, self.maxss])
-            else:
-                newiso=Adj(self.iso)
-                newiso=min([newiso,self.maxiso])
-        return (newss,newiso)
+        planner=exposureplanner(minss=self.minss, maxss=self.maxss,
+                                miniso=self.miniso, maxiso=self.maxiso,
+                                blurss=self.blurss, maxstep=self.maxstep,
+                                slope=response_slope())
+        return planner.step(self.ss, self.iso, target, lastbr,
+                            gain=gamma, ff=ff, limit=limit)
 
     def maxxedbrightness(self):
         """
@@ -170,8 +232,10 @@ class timelapser(models.Model):
         """
         if self.active:
             return False
-        self.set_active(True)
-        self.set_status('Calibrating...')
+        with self.batch():
+            self.set_active(True)
+            self.set_status('Calibrating...')
+        import Image
         killtoken=False
         targetBrightness=self.project.brightness
         self.lastbr=-128
@@ -188,7 +252,7 @@ class timelapser(models.Model):
             self.avgbr=self.lastbr
 
             #Dynamically adjust ss and iso.
-            (self.ss, self.iso)=self.dynamic_adjust(gamma=2.5)
+            (self.ss, self.iso)=self.dynamic_adjust(gamma=1.0, limit=False)
             print self.ss, self.iso, self.lastbr
             #We use a killtoken so that the while loop runs one extra time before
             #deciding to quit because the max/min iso and ss have been reached.
@@ -202,9 +266,10 @@ class timelapser(models.Model):
                     break
                 else:
                     killtoken=True
-            self.save()
-        self.set_status('idle')
-        self.set_active(False)
+        with self.batch():
+            self.persist('ss', 'iso', 'lastbr', 'avgbr')
+            self.set_status('idle')
+            self.set_active(False)
         return True
 
 #-------------------------------------------------------------------------------
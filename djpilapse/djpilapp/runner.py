@@ -0,0 +1,256 @@
+#Broker-less task runner: an alternative to Celery and RabbitMQ for running
+#the app's few long-lived tasks.
+#
+#Tasks are queued as rows in a small SQLite file, and a datagram on a unix
+#socket wakes the worker as soon as one arrives.  Nothing is kept about a task
+#once it has started; our tasks report through the database themselves.
+#
+#Set PILAPSE_TASK_RUNNER to 'thread' to run tasks in a supervised thread of
+#the web server, or to 'process' and start a worker with
+#    cd /home/pi/pipic/djpilapse && python -m djpilapp.runner
+#Only one worker at a time serves a queue, whichever holds its lock; under a
+#web server with several processes, the others just queue tasks for it.
+
+import os, sys, json, socket, sqlite3, threading, traceback, importlib, fcntl
+from time import time, sleep
+from django.conf import settings
+
+class taskqueue:
+    """
+    A first in, first out queue of task calls, in an SQLite file.
+
+    EXAMPLE::
+        Q=taskqueue('/home/pi/pipic/djpilapse/queue.db')
+        Q.put('djpilapp.tasks.timelapse', kwargs={'width': 20})
+        (name, args, kwargs)=Q.get()
+    """
+    def __init__(self, filename):
+        self.filename=filename
+        self.socketname=filename+'.sock'
+        db=self.connect()
+        db.execute('CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, '
+                   'name TEXT, args TEXT, kwargs TEXT, queued REAL)')
+        db.commit()
+        db.close()
+
+    def __repr__(self):
+        return 'Task queue '+self.filename
+
+    def connect(self):
+        db=sqlite3.connect(self.filename, timeout=10, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def __len__(self):
+        db=self.connect()
+        n=db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+        db.close()
+        return n
+
+    def put(self, name, args=(), kwargs=None):
+        """
+        Queue a call of the task at dotted path `name`, and wake the worker.
+        """
+        db=self.connect()
+        db.execute('INSERT INTO tasks (name, args, kwargs, queued) VALUES (?, ?, ?, ?)',
+                   (name, json.dumps(list(args)), json.dumps(kwargs or {}), time()))
+        db.close()
+        s=socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            s.sendto('+', self.socketname)
+        except socket.error:
+            #No worker listening yet; it will find the task when it starts.
+            pass
+        s.close()
+
+    def get(self):
+        """
+        Take the oldest task off the queue, or return None if it's empty.
+        """
+        db=self.connect()
+        db.execute('BEGIN IMMEDIATE')
+        row=db.execute('SELECT id, name, args, kwargs FROM tasks ORDER BY id LIMIT 1').fetchone()
+        if row is None:
+            db.execute('COMMIT')
+            db.close()
+            return None
+        db.execute('DELETE FROM tasks WHERE id=?', (row[0],))
+        db.execute('COMMIT')
+        db.close()
+        return (row[1], json.loads(row[2]), json.loads(row[3]))
+
+    def lock(self):
+        """
+        Take the queue's lock, which the one worker serving it holds.
+        Returns the locked file, to close when done, or None if another
+        worker, maybe in another process, has it.
+        """
+        f=open(self.filename+'.lock', 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except IOError:
+            f.close()
+            return None
+        return f
+
+    def listen(self):
+        """
+        A socket to wait on for new tasks.  Binding it takes it over from
+        any earlier listener, so only the holder of the `lock` should call
+        this.
+        """
+        try:
+            os.remove(self.socketname)
+        except OSError:
+            pass
+        s=socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        s.bind(self.socketname)
+        return s
+
+def resolve(name):
+    (module, attr)=name.rsplit('.', 1)
+    return getattr(importlib.import_module(module), attr)
+
+class worker:
+    """
+    Runs tasks from a `taskqueue`, one at a time.  A task that raises is
+    logged and dropped; the worker carries on with the next one.  `close`
+    stops it once the task in hand, if any, is done.
+
+    A worker only runs once it has `claim`ed the queue; while another holds
+    it, `run` returns False straight away.
+    """
+    def __init__(self, queue, poll=30):
+        self.queue=queue
+        self.poll=poll
+        self.current=None
+        self.stopping=threading.Event()
+        self.lockfile=None
+
+    def __repr__(self):
+        return 'Task worker on '+self.queue.filename
+
+    def claim(self):
+        """
+        Make this the queue's worker, if no other worker is.  Returns True
+        if it is.
+        """
+        if self.lockfile is None:
+            self.lockfile=self.queue.lock()
+        return self.lockfile is not None
+
+    def release(self):
+        if self.lockfile is not None:
+            self.lockfile.close()
+            self.lockfile=None
+
+    def run(self):
+        if not self.claim(): return False
+        try:
+            s=self.queue.listen()
+        except:
+            self.release()
+            raise
+        s.settimeout(self.poll)
+        import ready
+        ready.signal('runner')
+        try:
+            while not self.stopping.is_set():
+                task=self.queue.get()
+                if task is None:
+                    try:
+                        s.recv(16)
+                    except socket.timeout:
+                        pass
+                    continue
+                (name, args, kwargs)=task
+                self.current=name
+                try:
+                    resolve(name)(*args, **kwargs)
+                except Exception:
+                    print 'Task', name, 'failed:'
+                    traceback.print_exc()
+                self.current=None
+        finally:
+            s.close()
+            self.release()
+        return True
+
+    def close(self):
+        self.stopping.set()
+        #Wake it, if it's waiting for a task.
+        s=socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            s.sendto('.', self.queue.socketname)
+        except socket.error:
+            pass
+        s.close()
+
+def supervise(target, name='runner', backoff=5, stop=None):
+    """
+    Run `target` in a daemon thread, restarting it if it ever dies, until
+    the event `stop` is set.
+
+    EXAMPLE::
+        W=worker(get_queue())
+        t=supervise(W.run, stop=W.stopping)
+        W.close()
+        t.join()
+    """
+    if stop is None: stop=threading.Event()
+    def loop():
+        while not stop.is_set():
+            try:
+                target()
+            except Exception:
+                traceback.print_exc()
+            if stop.is_set(): break
+            print name, 'stopped; restarting in', backoff, 's'
+            stop.wait(backoff)
+    t=threading.Thread(target=loop, name=name)
+    t.daemon=True
+    t.start()
+    return t
+
+#-------------------------------------------------------------------------------
+
+_queue=None
+_thread=None
+def get_queue():
+    global _queue
+    if _queue is None:
+        _queue=taskqueue(settings.PILAPSE_QUEUE_DB)
+    return _queue
+
+def submit(task, *args, **kwargs):
+    """
+    Run a task in the background with the configured runner: Celery's
+    `delay`, or our own queue.
+    """
+    global _thread
+    if settings.PILAPSE_TASK_RUNNER=='celery':
+        return task.delay(*args, **kwargs)
+    get_queue().put(task.name, args, kwargs)
+    if settings.PILAPSE_TASK_RUNNER=='thread' and _thread is None:
+        #Another process of the web server may already be serving the queue;
+        #if so, it was just woken, and we try again next time.
+        W=worker(get_queue())
+        if W.claim():
+            _thread=supervise(W.run, stop=W.stopping)
+    return None
+
+#-------------------------------------------------------------------------------
+
+def main(argv):
+    #A worker process, restarted by the loop below if it ever falls over.
+    #Waits its turn if another worker holds the queue.
+    while True:
+        try:
+            worker(get_queue()).run()
+        except Exception:
+            traceback.print_exc()
+        sleep(5)
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djpilapse.settings")
+    main(sys.argv[1:])
@@ -24,6 +24,41 @@
         $('#imageFrame').fadeTo('fast', 1.0);
     }
 
+    //Key of the most recent shot in the thumbnail cache.
+    lastthumb=''
+
+    function loadThumb() {
+        if (lastthumb=='') { return loadImage() };
+        $('#imageFrame').fadeTo('fast', 0.5);
+        path=baseurl()+"djpilapp/thumb/"+lastthumb+"/medium/"
+        X=$('<img src="'+ path +'" id="lastImage" class="img-responsive">')
+        $('#imageFrame').html(X);
+        $('#imageFrame').fadeTo('fast', 1.0);
+    }
+
+    //Number of recent shots skipped by the gallery, and shots per page.
+    galleryStart=0
+    galleryCount=24
+
+    function loadGallery() {
+        url=baseurl()+'djpilapp/gallery/'+galleryStart+'/'+galleryCount+'/'
+        $.ajax(
+            url=url,
+            settings={
+              dataType: "json",
+              success: function(data){
+                  X=''
+                  $.each(data['frames'], function(i, frame){
+                      X+='<a href="'+baseurl()+'djpilapp/thumb/'+frame['key']+'/medium/">'
+                      X+='<img src="'+baseurl()+'djpilapp/thumb/'+frame['key']+'/small/" title="'+frame['source']+'"></a>'
+                  });
+                  $('#galleryFrames').html(X);
+                  $('#galleryTotal').html(data['total']);
+              }
+            }
+        );
+    }
+
     function saveProjSettings() {
         vals=formvalues('#projectForm')
         $.ajax(
@@ -69,6 +104,14 @@
         $('.refreshButton').click(function(){
             functionStack.push( loadImage );
         });
+        $('.galleryNewerButton').click(function(){
+            galleryStart=Math.max(0, galleryStart-galleryCount);
+            functionStack.push( loadGallery );
+        });
+        $('.galleryOlderButton').click(function(){
+            galleryStart+=galleryCount;
+            functionStack.push( loadGallery );
+        });
         $('.projSaveButton').click(function(){
             functionStack.push( saveProjSettings );
         });
@@ -151,18 +194,24 @@
                   dataType: "json",
                   success: function(data){
                       if (data['lastshot']!=$('#pilapse_lastshot').html()){
-                          functionStack.push( loadImage );
+                          lastthumb=data['lastthumb'];
+                          functionStack.push( loadThumb );
+                          if (galleryStart==0) { functionStack.push( loadGallery ) };
                       };
                       $('#alertBox').hide()
                       $('#jsontarget').html(data['time']);
                       $('#diskfree').html(data['diskfree']);
                       $('#remaining').html(data['remaining']);
+                      $('#cpu').html(data['cpu']);
+                      $('#temp').html(data['temp']);
+                      $('#memfree').html(data['memfree']);
                       $('#pilapse_ss').html(data['ss']);
                       $('#pilapse_iso').html(data['iso']);
                       $('#pilapse_lastbr').html(data['lastbr']);
                       $('#pilapse_avgbr').html(data['avgbr']);
                       $('#pilapse_status').html(data['status']);
                       $('#pilapse_shots').html(data['shots']);
+                      $('#pilapse_rejected').html(data['rejected']);
                       $('#pilapse_lastshot').html(data['lastshot']);
                       $('#project_interval').html(data['interval']);
                       $('#project_brightness').html(data['brightness']);
@@ -14,3 +14,1237 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from djpilapp.models import pilapse_project, timelapser
+
+class TimelapserBatchTest(TestCase):
+    def setUp(self):
+        P=pilapse_project.objects.create( project_name='pipic',
+            folder='/tmp', keep_images=False,
+            brightness=128, interval=15, width=1292, height=972, maxtime=-1,
+            maxshots=-1, delta=32, alpha=0.1, listen=False)
+        self.T=timelapser.objects.create(uid=0, project=P,
+            ss=50000, iso=100, lastbr=128, avgbr=128,
+            status='idle', shots_taken=0, lastshot='', boot=True,
+            active=False)
+
+    def test_batch_coalesces_writes(self):
+        """
+        Changes made inside a batch are written in a single UPDATE.
+        """
+        T=self.T
+        with CaptureQueriesContext(connection) as queries:
+            with T.batch():
+                T.set_active(True)
+                T.set_status('Timelapse active')
+                T.set_status('Calibrating...')
+        updates=[ q for q in queries.captured_queries if 'UPDATE' in q['sql'] ]
+        self.assertEqual(len(updates), 1)
+        T=timelapser.objects.get(pk=T.pk)
+        self.assertEqual(T.active, True)
+        self.assertEqual(T.status, 'Calibrating...')
+
+    def test_persist_only_named_fields(self):
+        """
+        Persisting some fields doesn't clobber others changed elsewhere.
+        """
+        T=self.T
+        timelapser.objects.filter(pk=T.pk).update(active=True)
+        T.shots_taken=5
+        T.persist('shots_taken')
+        T=timelapser.objects.get(pk=T.pk)
+        self.assertEqual(T.active, True)
+        self.assertEqual(T.shots_taken, 5)
+
+
+import tempfile, shutil
+from djpilapp.tasks import get_tracker, get_checkpoint, save_checkpoint
+
+class BrightnessTrackerTest(TestCase):
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()
+        self.P=pilapse_project.objects.create( project_name='pipic',
+            folder=self.folder, keep_images=False,
+            brightness=128, interval=15, width=1292, height=972, maxtime=-1,
+            maxshots=-1, delta=32, alpha=0.5, listen=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_ema_honours_alpha(self):
+        S=get_tracker(self.P)
+        self.assertEqual(S.mode, 'ema')
+        self.assertEqual(S.add(64), 96.0)
+
+    def test_window(self):
+        self.P.alpha=0
+        S=get_tracker(self.P, width=3)
+        for br in (10, 20, 30, 40):
+            avgbr=S.add(br)
+        self.assertEqual(avgbr, 30.0)
+
+    def test_resume(self):
+        """
+        A restarted task picks up the saved smoothing state.
+        """
+        T=timelapser.objects.create(uid=0, project=self.P, ss=50000, iso=100,
+            lastbr=128, avgbr=128, status='idle', shots_taken=0, lastshot='',
+            boot=True, active=False)
+        S=get_tracker(self.P)
+        S.add(64)
+        save_checkpoint(T, S, deadline=0)
+        self.assertEqual(get_tracker(self.P).value, 96.0)
+        self.P.alpha=0.25
+        self.assertEqual(get_tracker(self.P).value, 128.0)
+
+
+import os
+import Image
+from exposurelog import exposurelog
+from djpilapp import capture
+from djpilapp.tasks import timelapse_shoot
+
+class ShootTest(TestCase):
+    """
+    The capture task, with raspistill stood in for by a script printing a
+    grey frame.
+    """
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()+'/'
+        self.P=pilapse_project.objects.create( project_name='pipic',
+            folder=self.folder+'shots/', keep_images=False,
+            brightness=128, interval=15, width=64, height=48, maxtime=-1,
+            maxshots=-1, delta=32, alpha=0.5, listen=False)
+        os.mkdir(self.P.folder)
+        self.T=timelapser.objects.create(uid=0, project=self.P, ss=50000,
+            iso=100, lastbr=128, avgbr=128, status='idle', shots_taken=0,
+            lastshot='', boot=False, active=True)
+        f=open(self.folder+'raspistill', 'w')
+        f.write('#!/bin/sh\ncat %sshot.jpg\n' % self.folder)
+        f.close()
+        os.chmod(self.folder+'raspistill', 0755)
+        self.path=os.environ['PATH']
+        os.environ['PATH']=self.folder+':'+self.path
+        self.override=self.settings(PILAPSE_PREVIEW=self.folder+'new.jpg',
+            PILAPSE_THUMB_DIR=self.folder+'thumbs/', PILAPSE_REJECT_THUMBS=True)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        os.environ['PATH']=self.path
+        (capture._thumbs, capture._rejectthumbs, capture._scheduler)=(None, None, None)
+        shutil.rmtree(self.folder)
+
+    def shoot(self, level):
+        Image.new('RGB', (64, 48), (level,)*3).save(self.folder+'shot.jpg')
+        return timelapse_shoot(deadline=0)
+
+    def test_rejected(self):
+        """
+        A shot too far from the target is metered and logged, and kept as a
+        reject thumbnail, but never written.
+        """
+        self.assertTrue(self.shoot(20))
+        self.assertEqual([ x for x in os.listdir(self.P.folder) if x.endswith('.jpg') ], [])
+        T=timelapser.objects.get(pk=self.T.pk)
+        self.assertEqual(T.shots_taken, 0)
+        R=exposurelog(self.P.folder).records()
+        self.assertEqual(len(R), 1)
+        self.assertEqual(R['kept'][0], 0)
+        self.assertEqual(R['lastbr'][0], T.lastbr)
+        self.assertEqual(len(capture.get_rejectthumbcache().refresh()), 1)
+        self.assertEqual(len(capture.get_thumbcache().refresh()), 0)
+        #The web interface still sees the latest shot.
+        self.assertEqual(open(self.folder+'new.jpg', 'rb').read(),
+                         open(self.folder+'shot.jpg', 'rb').read())
+
+    def test_kept(self):
+        self.assertTrue(self.shoot(128))
+        T=timelapser.objects.get(pk=self.T.pk)
+        self.assertEqual(T.shots_taken, 1)
+        self.assertTrue(os.path.exists(T.lastshot))
+        self.assertEqual(exposurelog(self.P.folder).records()['kept'][0], 1)
+        self.assertEqual(len(capture.get_rejectthumbcache().refresh()), 0)
+        self.assertTrue(os.path.exists(self.folder+'new.jpg'))
+
+
+import calendar
+from solar import lightmodel
+from smoothing import brightnesstracker
+
+class FeedForwardTest(TestCase):
+    """
+    Sunrise in Toronto on a simulated camera, whose shots get brightness
+    proportional to ss*iso and to the daylight, capped at 255.
+    """
+    def simulate(self, light, clouds=0.7):
+        model=lightmodel(43.65, -79.38)
+        T=timelapser(ss=1000000, iso=100)
+        S=brightnesstracker('ema', alpha=0.1)
+        (target, delta, interval, gamma)=(128, 32, 15, 1.0/20)
+        #From 40 minutes before sunrise to 80 minutes after.
+        t0=calendar.timegm((2014, 6, 21, 9, 0, 0))
+        k=target/(2**model.level(t0)*T.ss*T.iso)
+        rejected=0
+        for n in range(480):
+            t=t0+n*interval
+            br=min(255.0, k*clouds*2**model.level(t)*T.ss*T.iso)
+            avgbr=S.add(br)
+            if abs(target-avgbr)>delta: rejected+=1
+            if light is not None:
+                ff=light.change(t, t+interval)
+            else:
+                ff=0.0
+            (T.ss, T.iso)=T.dynamic_adjust(target=target, lastbr=avgbr,
+                                           gamma=gamma, ff=ff)
+        return rejected
+
+    def test_fewer_rejected_frames(self):
+        reactive=self.simulate(None)
+        feedforward=self.simulate(lightmodel(43.65, -79.38))
+        self.assertTrue(feedforward<reactive/4)
+
+
+from exposure import exposureplanner, replay, ev
+from exposurelog import exposurelog
+
+class ExposurePlannerTest(TestCase):
+    def test_plan_prefers_low_iso(self):
+        P=exposureplanner(blurss=100000)
+        self.assertEqual(P.plan(ev(50000, 100)), (50000, 100))
+        self.assertEqual(P.plan(ev(100000, 400)), (100000, 400))
+        self.assertEqual(P.plan(ev(8000000, 800)), (2000000, 800))
+
+    def test_maxstep(self):
+        P=exposureplanner(maxstep=0.5)
+        (ss, iso)=P.step(10000, 100, target=128, br=16)
+        self.assertAlmostEqual(ev(ss, iso)-ev(10000, 100), 0.5, places=2)
+
+    def test_replay_scene_step(self):
+        """
+        Replay a recorded log in which the scene darkens by three stops: the
+        planner settles in a few shots, without overshooting.
+        """
+        folder=tempfile.mkdtemp()
+        E=exposurelog(folder, writer=True)
+        for i in range(40):
+            if i<10:
+                E.append(10000, 100, 128, 128, t=i)
+            else:
+                E.append(10000, 100, 16, 16, t=i)
+        P=exposureplanner(maxstep=0.5)
+        out=replay(E.query(), P, target=128, gain=0.5)
+        shutil.rmtree(folder)
+        steps=out['ev'][11:]-out['ev'][10:-1]
+        self.assertTrue((steps>=-1e-6).all())
+        self.assertTrue(abs(out['br'][20]-128)<4)
+        self.assertTrue(abs(out['ss'][-1]-80000)<100)
+
+class ExposureLogTest(TestCase):
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_append_reopen(self):
+        E=exposurelog(self.folder, writer=True)
+        E.append(5000, 100, 120.5, 124.0, t=1)
+        E.append(6000, 200, 90.0, 110.0, kept=False, t=2)
+        R=exposurelog(self.folder).query()
+        self.assertEqual(list(R['ss']), [5000, 6000])
+        self.assertEqual(list(R['kept']), [1, 0])
+        self.assertEqual(len(exposurelog(self.folder).query(start=2)), 1)
+        self.assertRaises(IOError, exposurelog(self.folder).append, 5000, 100, 1, 1)
+
+    def test_partial_record(self):
+        """
+        Readers leave a record being written alone; the writer drops one
+        left by a crash.
+        """
+        E=exposurelog(self.folder, writer=True)
+        E.append(5000, 100, 120.5, 124.0, t=1)
+        f=open(E.filename, 'ab')
+        f.write('half')
+        f.close()
+        size=os.path.getsize(E.filename)
+        R=exposurelog(self.folder)
+        self.assertEqual(len(R), 1)
+        self.assertEqual(len(R.query()), 1)
+        self.assertEqual(os.path.getsize(E.filename), size)
+        E=exposurelog(self.folder, writer=True)
+        self.assertEqual(os.path.getsize(E.filename), size-4)
+        E.append(6000, 100, 120.5, 124.0, t=2)
+        self.assertEqual(list(R.query()['ss']), [5000, 6000])
+
+    def test_rejected(self):
+        E=exposurelog(self.folder, writer=True)
+        R=exposurelog(self.folder)
+        self.assertEqual(R.rejected(), 0)
+        for i in range(10):
+            E.append(5000, 100, 1, 1, kept=i%3!=0, t=i)
+        self.assertEqual(R.rejected(), 4)
+        E.append(5000, 100, 1, 1, kept=False, t=10)
+        self.assertEqual(R.rejected(), 5)
+        self.assertEqual(R.counted, 11)
+        self.assertEqual(R.rejected(start=6), 3)
+
+#-------------------------------------------------------------------------------
+
+import io, json
+import numpy
+from thumbcache import thumbcache
+import djpilapp.capture
+
+class ThumbCacheTest(TestCase):
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()+'/'
+        R=numpy.random.RandomState(0)
+        self.frames=[]
+        for i in range(8):
+            im=Image.fromarray(R.randint(0, 255, (120, 160, 3)).astype(numpy.uint8))
+            out=io.BytesIO()
+            im.save(out, format='jpeg')
+            self.frames.append( (im, out.getvalue()) )
+
+    def tearDown(self):
+        djpilapp.capture._thumbs=None
+        shutil.rmtree(self.folder)
+
+    def test_eviction(self):
+        """
+        Thumbnails and index stay in budget, and evicted frames leave the
+        index, for this process and any other.
+        """
+        C=thumbcache(self.folder, budget=40000, sizes=['small'])
+        keys=[ C.add(im, data, 'frame%d.jpg' % i) for (i, (im, data)) in enumerate(self.frames) ]
+        self.assertTrue(C.total+C.indexsize<=40000)
+        listed=[ x[0] for x in C.refresh() ]
+        self.assertTrue(0<len(listed)<8)
+        self.assertEqual(listed, keys[-len(listed):])
+        for key in listed:
+            self.assertTrue(C.get(key) is not None)
+        other=thumbcache(self.folder, budget=40000, sizes=['small'])
+        self.assertEqual([ x[0] for x in other.refresh() ], listed)
+        #Compaction rewrites the index under everyone's feet.
+        self.assertTrue(C.compact(force=True))
+        self.assertEqual(len(open(self.folder+'index.txt').readlines()), len(listed))
+        self.assertEqual([ x[0] for x in other.refresh() ], listed)
+
+    def test_gallery(self):
+        """
+        The gallery lists only frames whose thumbnails can be served.
+        """
+        C=thumbcache(self.folder, budget=40000, sizes=['small'])
+        djpilapp.capture._thumbs=C
+        for (i, (im, data)) in enumerate(self.frames):
+            C.add(im, data, 'frame%d.jpg' % i)
+        J=json.loads(self.client.get('/djpilapp/gallery/0/48/').content)
+        self.assertEqual(J['total'], len(C.refresh()))
+        self.assertEqual(J['frames'][0]['source'], 'frame7.jpg')
+        for x in J['frames']:
+            self.assertEqual(self.client.get('/djpilapp/thumb/%s/small/' % x['key']).status_code, 200)
+
+#-------------------------------------------------------------------------------
+
+from framelog import framelog
+import deflicker
+
+class FrameLogTest(TestCase):
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()+'/'
+        self.cwd=os.getcwd()
+        os.mkdir(self.folder+'2014-06-01')
+        for i in range(3):
+            Image.new('RGB', (8, 6), (40*(i+1), 40*(i+1), 40*(i+1))).save(self.folder+'2014-06-01/pipic%03d.jpg' % i)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def test_add_refresh(self):
+        """
+        Frames added by one process show up in another's catalogue.
+        """
+        A=framelog(self.folder)
+        B=framelog(self.folder)
+        A.add(self.folder+'2014-06-01/pipic000.jpg', ss=5000, iso=100, brightness=120)
+        B.add('2014-06-01/pipic001.jpg')
+        A.refresh()
+        self.assertEqual(A.list(), ['2014-06-01/pipic000.jpg', '2014-06-01/pipic001.jpg'])
+        self.assertEqual(A.list('PIPIC001'), ['2014-06-01/pipic001.jpg'])
+        self.assertEqual(A.list('2014'), [])
+        self.assertEqual(A.count, 2)
+        self.assertEqual(A.bytes, sum([ os.path.getsize(self.folder+x) for x in A.list() ]))
+
+    def test_compact(self):
+        """
+        Compaction drops deleted frames, and keeps frames another process
+        added since we last looked.
+        """
+        A=framelog(self.folder)
+        B=framelog(self.folder)
+        A.add('2014-06-01/pipic000.jpg')
+        A.add('2014-06-01/pipic001.jpg')
+        B.add('2014-06-01/pipic002.jpg')
+        A.append('-\t2014-06-01/pipic001.jpg')
+        self.assertTrue(A.compact(force=True))
+        self.assertEqual(len(open(A.filename).readlines()), 2)
+        B.refresh()
+        self.assertEqual(B.list(), ['2014-06-01/pipic000.jpg', '2014-06-01/pipic002.jpg'])
+        self.assertEqual(B.dead, 0)
+
+    def test_clear(self):
+        """
+        Only catalogued frames are deleted, until strays are adopted.
+        """
+        A=framelog(self.folder)
+        A.add('2014-06-01/pipic000.jpg')
+        #Saved before there was a catalogue.
+        Image.new('RGB', (8, 6)).save(self.folder+'pipic-old.jpg')
+        Image.new('RGB', (8, 6)).save(self.folder+'new.jpg')
+        open(self.folder+'notes.txt', 'w').write('Keep me')
+        A.clear()
+        self.assertEqual(A.count, 0)
+        self.assertEqual(sorted(os.listdir(self.folder)), ['2014-06-01', 'frames.log',
+            'frames.log.lock', 'new.jpg', 'notes.txt', 'pipic-old.jpg'])
+        self.assertEqual(A.adopt('pipic'), 1)
+        self.assertEqual(A.adopt('pipic'), 0)
+        A.clear()
+        self.assertEqual(sorted(os.listdir(self.folder)), ['2014-06-01', 'frames.log',
+            'frames.log.lock', 'new.jpg', 'notes.txt'])
+
+    def test_deflicker_lookup(self):
+        """
+        deflicker finds catalogued frames in dated subfolders, and saves its
+        output alongside them.
+        """
+        A=framelog(self.folder)
+        for i in range(3):
+            A.add('2014-06-01/pipic%03d.jpg' % i)
+        os.chdir(self.folder)
+        self.assertEqual(deflicker.find_images('pipic'), A.list())
+        self.assertTrue(deflicker.main(['-o', 'mod', '--prefetch', '0']))
+        self.assertTrue(os.path.exists('2014-06-01/mod002.jpg'))
+
+#-------------------------------------------------------------------------------
+
+import Image
+from responsemodel import responsemodel, BASESS, BASEISO
+
+class ResponseModelTest(TestCase):
+    def test_fit_and_jump(self):
+        """
+        Fit a model to synthetic brightData.py captures from a camera with a
+        known response; one full step with the fitted slope hits the target.
+        """
+        folder=tempfile.mkdtemp()
+        slope=0.6
+        for (i, (ss, iso)) in enumerate([(2500, 100), (5000, 200), (20000, 100),
+                                         (40000, 100), (10000, 400)]):
+            br=40*2**(slope*(ev(ss, iso)-ev(BASESS, BASEISO)))
+            name=folder+'/cam_140601_12.00.%02d_' % i
+            Image.new('L', (64,48), 40).save(name+'base.jpg', quality=100)
+            Image.new('L', (64,48), int(round(br))).save(
+                name+'%d_%d.jpg' % (ss, iso), quality=100)
+        M=responsemodel.fit(folder)
+        M.save(folder+'/model.json')
+        M=responsemodel.load(folder+'/model.json')
+        shutil.rmtree(folder)
+        self.assertEqual(M.samples, 5)
+        self.assertTrue(abs(M.slope-slope)<0.02)
+        P=exposureplanner(slope=M.slope)
+        (ss, iso)=P.step(BASESS, BASEISO, target=160, br=40, gain=1.0, limit=False)
+        br=40*2**(slope*(ev(ss, iso)-ev(BASESS, BASEISO)))
+        self.assertTrue(abs(br-160)<4)
+
+#-------------------------------------------------------------------------------
+
+import time
+from tracing import tracer, monotonic
+
+class TracerTest(TestCase):
+    def test_ring_and_percentiles(self):
+        L=tracer(size=100, every=0)
+        for i in range(250):
+            L.record('write', i/1000.0)
+        t=L.timings('write')
+        self.assertEqual(len(t), 100)
+        self.assertAlmostEqual(t[0], 0.150)
+        self.assertAlmostEqual(t[-1], 0.249)
+        self.assertAlmostEqual(L.percentiles('write', q=(50,))[0], 0.1995)
+        self.assertEqual(L.histogram('write', bins=4)[0].sum(), 100)
+
+    def test_overhead(self):
+        """
+        Tracing every stage of a shot costs well under 1% of the shot.
+        """
+        L=tracer(every=0)
+        stages=['capture', 'decode', 'meter', 'encode', 'write',
+                'hdr', 'merge', 'delete', 'db']
+        start=monotonic()
+        for i in range(20):
+            for name in stages:
+                with L.stage(name):
+                    time.sleep(0.005)
+            L.shot()
+        elapsed=monotonic()-start
+        self.assertTrue(L.overhead<0.01*elapsed)
+        self.assertTrue('Tracing overhead' in L.report())
+
+#-------------------------------------------------------------------------------
+
+import os
+from sysmetrics import sysmetrics
+
+def write(filename, text):
+    try:
+        os.makedirs(os.path.dirname(filename))
+    except OSError:
+        pass
+    f=open(filename, 'w')
+    f.write(text)
+    f.close()
+
+class SysMetricsTest(TestCase):
+    def setUp(self):
+        self.root=tempfile.mkdtemp()
+        write(self.root+'/proc/meminfo',
+              'MemTotal:         445640 kB\n'
+              'MemFree:           42168 kB\n'
+              'MemAvailable:     301512 kB\n'
+              'Buffers:           31176 kB\n'
+              'Cached:           244312 kB\n')
+        write(self.root+'/sys/class/thermal/thermal_zone0/temp', '48692\n')
+        self.stat(0, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def stat(self, busy, idle):
+        write(self.root+'/proc/stat',
+              'cpu  %d 0 %d %d 0 0 0 0 0 0\n'
+              'cpu0 %d 0 %d %d 0 0 0 0 0 0\n' % ((busy, busy, idle)*2))
+
+    def test_fixture_sample(self):
+        M=sysmetrics(size=4, proc=self.root+'/proc', sys=self.root+'/sys',
+                     disk=self.root)
+        M.sample(t=0)
+        #300 jiffies busy (user+system) out of 400.
+        self.stat(150, 100)
+        d=M.sample(t=5)
+        self.assertAlmostEqual(d['cpu'], 0.75)
+        self.assertAlmostEqual(d['temp'], 48.692, places=3)
+        self.assertEqual(d['memtotal'], 445640*1024)
+        self.assertEqual(d['memavail'], 301512*1024)
+        self.assertTrue(d['diskfree']>0)
+        self.assertTrue('pipic_cpu 0.75' in M.text())
+        for t in range(10, 40, 5): M.sample(t=t)
+        S=M.samples()
+        self.assertEqual(len(S), 4)
+        self.assertEqual(list(S['t']), [20, 25, 30, 35])
+
+    def test_no_thermal_zone(self):
+        shutil.rmtree(self.root+'/sys')
+        M=sysmetrics(proc=self.root+'/proc', sys=self.root+'/sys', disk=self.root)
+        self.assertEqual(M.sample()['temp'], None)
+        self.assertFalse('pipic_temp' in M.text())
+
+#-------------------------------------------------------------------------------
+
+from scheduler import backgroundscheduler
+
+class thermalsim:
+    """
+    A fake clock and a first-order thermal model: the SoC heats towards
+    35C plus 60C times the CPU load, with a one minute time constant.
+    """
+    def __init__(self):
+        self.now=0.0
+        self.temp=45.0
+        self.peak=self.temp
+
+    def run(self, seconds, load):
+        steps=max(1, int(seconds/0.05))
+        for i in range(steps):
+            self.temp+=(35+60*load-self.temp)*(seconds/steps)/60.0
+        self.peak=max(self.peak, self.temp)
+        self.now+=seconds
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.run(seconds, 0.05)
+
+    def sensor(self):
+        return (self.temp, 0.0)
+
+def hdrmerge(sim):
+    for i in range(5):
+        sim.run(0.7, 1.0)
+        yield
+
+class SchedulerTest(TestCase):
+    def simulate(self, scheduled, shots=240, interval=4.0):
+        """
+        Shoot every `interval` seconds; each shot queues 3.5s of merging and
+        0.3s of thumbnails, more than fits between shots.
+        Returns the capture jitter of each shot and the simulation.
+        """
+        sim=thermalsim()
+        S=backgroundscheduler(hot=70, critical=80, guard=0.5,
+                              clock=sim.clock, sleep=sim.sleep, sensor=sim.sensor)
+        jitter=[]
+        for i in range(shots):
+            deadline=i*interval
+            if sim.now<deadline: sim.sleep(deadline-sim.now)
+            jitter.append(sim.now-deadline)
+            sim.run(0.8, 0.6)
+            if scheduled:
+                S.submit(hdrmerge, (sim,), name='merge')
+                S.submit(sim.run, (0.3, 1.0), name='thumbs', priority=20)
+                S.idle(deadline+interval)
+            else:
+                for x in hdrmerge(sim): pass
+                sim.run(0.3, 1.0)
+        return (jitter, sim)
+
+    def test_capture_jitter_bounded(self):
+        (jitter, sim)=self.simulate(True)
+        self.assertTrue(max(jitter)<0.05)
+        #Work was throttled once the SoC got hot, well short of critical.
+        self.assertTrue(70<sim.peak<80)
+
+    def test_unscheduled_work_delays_captures(self):
+        (jitter, sim)=self.simulate(False)
+        self.assertTrue(max(jitter)>60)
+        self.assertTrue(sim.peak>85)
+
+#-------------------------------------------------------------------------------
+
+from checkpoint import checkpoint
+
+class CheckpointTest(TestCase):
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()
+        self.C=checkpoint(self.folder+'/checkpoint.json', maxage=600)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_fresh_and_stale(self):
+        self.assertEqual(self.C.load(), None)
+        self.C.save({'ss': 5000, 'iso': 100, 'deadline': 1015}, t=1000)
+        self.assertEqual(self.C.load(t=1010)['ss'], 5000)
+        self.assertEqual(self.C.load(t=1700), None)
+        self.assertEqual(self.C.read()['deadline'], 1015)
+        self.assertFalse(os.path.exists(self.C.filename+'.tmp'))
+
+    def test_torn_write(self):
+        """
+        A crash part way through writing the temporary file leaves the last
+        complete checkpoint in place.
+        """
+        self.C.save({'ss': 5000}, t=1000)
+        f=open(self.C.filename+'.tmp', 'w')
+        f.write('{"ss": 80')
+        f.close()
+        self.assertEqual(self.C.load(t=1001)['ss'], 5000)
+        f=open(self.C.filename, 'w')
+        f.write('{"ss": 80')
+        f.close()
+        self.assertEqual(self.C.load(t=1001), None)
+
+    def test_sync_every(self):
+        """
+        Saves are synced to disk only every `syncevery` seconds, but every
+        one of them is readable.
+        """
+        synced=[ self.C.save({'shots': i}, t=1000+15*i) for i in range(10) ]
+        self.assertEqual(synced, [True]+[False]*3+[True]+[False]*3+[True, False])
+        self.assertEqual(self.C.load(t=1140)['shots'], 9)
+
+#-------------------------------------------------------------------------------
+
+import socket
+import ready
+
+class ReadyTest(TestCase):
+    def test_signal_and_wait(self):
+        name='test-%d' % os.getpid()
+        self.assertEqual(ready.status(name), None)
+        self.assertFalse(ready.wait([name], timeout=0.2))
+        ready.signal(name, firstframe=1.5)
+        self.assertEqual(ready.status(name)['firstframe'], 1.5)
+        s=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('127.0.0.1', 0))
+        s.listen(1)
+        port=s.getsockname()[1]
+        self.assertTrue(ready.wait([name], [port], timeout=1))
+        s.close()
+        os.remove(ready.readyfile(name))
+
+#-------------------------------------------------------------------------------
+
+import startupbench
+
+class StartupBenchTest(TestCase):
+    def test_boot_path(self):
+        """
+        The boot path gets to its first frame without loading numpy or
+        Celery, but the check would notice if it did.
+        """
+        self.assertEqual(startupbench.bootimports(), [])
+        self.assertEqual(startupbench.bootimports(['os', 'numpy']), ['os'])
+
+#-------------------------------------------------------------------------------
+
+import threading
+from djpilapp.runner import taskqueue, worker, supervise
+
+ran=[]
+done=threading.Event()
+def record_task(*args, **kwargs):
+    ran.append( (args, kwargs) )
+    if kwargs.get('fail'): raise ValueError('Task failed on purpose.')
+    done.set()
+
+class RunnerTest(TestCase):
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()
+        self.Q=taskqueue(self.folder+'/queue.db')
+        self.W=None
+
+    def tearDown(self):
+        if self.W is not None:
+            self.W.close()
+            self.thread.join(5)
+            self.assertFalse(self.thread.is_alive())
+        shutil.rmtree(self.folder)
+
+    def test_fifo(self):
+        self.Q.put('djpilapp.tests.record_task', (1,))
+        self.Q.put('djpilapp.tests.record_task', kwargs={'x': 2})
+        self.assertEqual(len(self.Q), 2)
+        self.assertEqual(self.Q.get(), ('djpilapp.tests.record_task', [1], {}))
+        self.assertEqual(self.Q.get(), ('djpilapp.tests.record_task', [], {'x': 2}))
+        self.assertEqual(self.Q.get(), None)
+
+    def test_worker_thread(self):
+        """
+        A supervised worker thread runs queued tasks as they arrive, and
+        survives a task that raises.
+        """
+        del ran[:]
+        done.clear()
+        self.W=worker(self.Q, poll=5)
+        self.thread=supervise(self.W.run, stop=self.W.stopping)
+        self.Q.put('djpilapp.tests.record_task', kwargs={'fail': True})
+        self.Q.put('djpilapp.tests.record_task', (3,))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(ran, [((), {'fail': True}), ((3,), {})])
+
+    def test_one_worker(self):
+        """
+        Only one worker serves a queue, and so owns its wake socket, until
+        it stops.
+        """
+        self.W=worker(self.Q, poll=5)
+        self.assertTrue(self.W.claim())
+        other=worker(self.Q, poll=5)
+        self.assertFalse(other.claim())
+        self.assertEqual(other.run(), False)
+        self.W.release()
+        self.assertTrue(other.claim())
+        other.release()
+        self.W=None
+
+#-------------------------------------------------------------------------------
+
+from scheduler import stopchannel, stop
+
+class StopTest(TestCase):
+    def test_stop_wakes_idle_loop(self):
+        """
+        A stop request wakes a capture loop waiting out a 60s interval within
+        100ms.
+        """
+        path=tempfile.mktemp(suffix='.sock')
+        C=stopchannel(path)
+        B=backgroundscheduler(sleep=C.wait, sensor=lambda: (None, 0.0))
+        stopped=[]
+        def loop():
+            while not B.stopped:
+                B.idle(time.time()+60)
+            stopped.append(time.time())
+        t=threading.Thread(target=loop)
+        t.start()
+        time.sleep(0.2)
+        sent=time.time()
+        self.assertTrue(stop(path))
+        t.join(5)
+        C.close()
+        self.assertFalse(t.is_alive())
+        self.assertTrue(stopped[0]-sent<0.1)
+        self.assertFalse(stop(path))
+
+#-------------------------------------------------------------------------------
+
+from trigger import leader, follower, waituntil
+
+def freeport():
+    s=socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port=s.getsockname()[1]
+    s.close()
+    return port
+
+class TriggerTest(TestCase):
+    def test_loopback(self):
+        """
+        Followers on the loopback interface fire within a few milliseconds
+        of the leader's deadline, and the leader sees how close they came.
+        """
+        (port, replyport)=(freeport(), freeport())
+        L=leader(port, replyport, lead=0.05, host='127.0.0.1')
+        def follow(name):
+            F=follower('127.0.0.1', port, replyport, name=name)
+            while True:
+                cmd=F.next(timeout=2)
+                if cmd is None: break
+                F.fired(cmd, waituntil(cmd['local']))
+            F.close()
+        threads=[ threading.Thread(target=follow, args=(x,)) for x in ('left', 'right') ]
+        for t in threads: t.start()
+        #Followers take a moment to subscribe.
+        for i in range(20):
+            if len(L.sync(rounds=2, timeout=0.1))==2: break
+        self.assertEqual(sorted(L.offsets), ['left', 'right'])
+        for i in range(10):
+            waituntil(L.trigger(1920, 1080, 10000, 100))
+            time.sleep(0.05)
+        L.collect(timeout=0.5)
+        for t in threads: t.join(5)
+        L.close()
+        for node in ('left', 'right'):
+            self.assertEqual(len(L.skew[node]), 10)
+            self.assertTrue(max([ abs(x) for x in L.skew[node] ])<0.01)
+            self.assertTrue(abs(L.offsets[node][0])<0.005)
+
+import timelapse
+from datetime import datetime
+
+class stubcamera:
+    """
+    Stands in for picamera, taking `exposure` seconds over each capture.
+    """
+    def __init__(self, exposure=0.05):
+        self.exposure=exposure
+        (self.exposure_speed, self.framerate)=(50000, 10)
+
+    def capture(self, stream, format='jpeg'):
+        time.sleep(self.exposure)
+        Image.new('RGB', (32, 24), (90, 90, 90)).save(stream, format=format)
+
+class stubtimelapse(timelapse.timelapse):
+    def __init__(self, folder, maxshots):
+        self.camera=stubcamera()
+        (self.w, self.h)=(32, 24)
+        (self.currentss, self.iso)=(50000, 100)
+        self.folder=folder
+        self.maxshots=maxshots
+        self.tracer=tracer(every=0)
+
+class ListenTest(TestCase):
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()+'/'
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_listen(self):
+        """
+        A follower running `timelapse.listen` saves each shot under the
+        leader's time, and reports when it fired apart from how long the
+        camera then took.
+        """
+        (port, replyport)=(freeport(), freeport())
+        L=leader(port, replyport, lead=0.05, host='127.0.0.1')
+        T=stubtimelapse(self.folder, maxshots=5)
+        t=threading.Thread(target=T.listen, args=('127.0.0.1', port, replyport))
+        t.start()
+        for i in range(20):
+            if L.sync(rounds=2, timeout=0.1): break
+        deadlines=[]
+        for i in range(5):
+            deadlines.append(L.trigger(32, 24, 20000, 200))
+            time.sleep(0.2)
+        t.join(5)
+        L.collect(timeout=0.5)
+        L.close()
+        self.assertFalse(t.is_alive())
+        (node,)=L.skew.keys()
+        self.assertEqual(len(L.skew[node]), 5)
+        self.assertTrue(max([ abs(x) for x in L.skew[node] ])<0.01)
+        self.assertTrue(min(L.latency[node])>=0.05)
+        self.assertEqual((T.currentss, T.iso), (20000, 200))
+        #Shots in the same second share a name, as they would on the leader.
+        names=set([ '{:%Y-%m-%d/%Y-%m-%d-%H-%M-%S}.jpg'.format(datetime.fromtimestamp(x))
+                    for x in deadlines ])
+        saved=set([ os.path.join(d, x) for d in os.listdir(self.folder)
+                    for x in os.listdir(self.folder+d) ])
+        self.assertEqual(saved, names)
+
+#-------------------------------------------------------------------------------
+
+import json, argparse, zmq
+import numpy
+import deflicker
+from distdeflicker import coordinator
+
+def synthetic_frames(folder, n=12, size=(40, 30)):
+    """
+    A short, flickering sequence of noisy frames, pipic000.jpg onwards.
+    """
+    R=numpy.random.RandomState(0)
+    for i in range(n):
+        a=R.randint(0, 160, (size[1], size[0], 3))+R.randint(0, 90)
+        Image.fromarray(a.astype(numpy.uint8)).save(os.path.join(folder, 'pipic%03d.jpg' % i))
+
+class SequenceTest(TestCase):
+    """
+    Base for tests run in a scratch folder holding a sequence of frames,
+    `synthetic_frames` unless a subclass overrides `frames`.
+    """
+    def frames(self, folder):
+        synthetic_frames(folder)
+
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()
+        self.cwd=os.getcwd()
+        self.frames(self.folder)
+        os.chdir(self.folder)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+class DistDeflickerTest(SequenceTest):
+    def outputs(self, prefix):
+        names=sorted([ x for x in os.listdir('.') if x.startswith(prefix) ])
+        return [ open(x, 'rb').read() for x in names ]
+
+    def test_matches_serial(self):
+        """
+        Chunks processed by several worker processes, one chunk abandoned by
+        a worker that dies, come out byte for byte as a serial run.
+        """
+        self.assertTrue(deflicker.main(['-p', '2', '-o', 'ser']))
+        args=argparse.Namespace(bright=128, pixelavg=2, thresh=0.05, annotate=0,
+                                compare=0, infix='pipic', outfix='dis')
+        port=freeport()
+        C=coordinator(deflicker.find_images('pipic'), args, port=port, chunksize=3,
+                      lease=2, host='127.0.0.1')
+        result=[]
+        t=threading.Thread(target=lambda: result.append(C.run()))
+        t.start()
+        #A worker that takes a chunk and is never heard from again.
+        s=zmq.Context.instance().socket(zmq.REQ)
+        s.connect('tcp://127.0.0.1:%d' % port)
+        s.send(json.dumps({'type': 'ready', 'worker': 'dead'}))
+        self.assertEqual(json.loads(s.recv_multipart()[0])['type'], 'chunk')
+        s.close(linger=0)
+        workers=C.spawn(3)
+        t.join(60)
+        for p in workers: p.wait()
+        self.assertEqual(result, [True])
+        #The dead worker's chunk was either retried or doubled up on.
+        self.assertTrue(C.retried+C.doubled>=1)
+        serial=self.outputs('ser')
+        self.assertEqual(len(serial), 12)
+        self.assertEqual(self.outputs('dis'), serial)
+
+#-------------------------------------------------------------------------------
+
+class WatchTest(TestCase):
+    def setUp(self):
+        self.cwd=os.getcwd()
+        self.camera=tempfile.mkdtemp()
+        self.folder=tempfile.mkdtemp()
+        synthetic_frames(self.camera)
+        os.chdir(self.camera)
+        deflicker.main(['-p', '2', '-o', 'ser'])
+        os.chdir(self.folder)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.camera)
+        shutil.rmtree(self.folder)
+
+    def test_follows_capture(self):
+        """
+        Frames are processed as soon as their window has arrived, a restart
+        carries on from the checkpoint, and the result matches a batch run.
+        """
+        args=argparse.Namespace(bright=128, pixelavg=2, thresh=0.05, annotate=0,
+                                compare=0, infix='pipic', outfix='wat')
+        W=deflicker.watcher(args)
+        for i in range(12):
+            name='pipic%03d.jpg' % i
+            data=open(os.path.join(self.camera, name), 'rb').read()
+            #Still being written.
+            f=open(name, 'wb')
+            f.write(data[:len(data)/2])
+            f.close()
+            W.step()
+            self.assertEqual(W.processed, max(i-1, 0))
+            f=open(name, 'wb')
+            f.write(data)
+            f.close()
+            W.step()
+            #Frame i-1 was waiting for frame i.
+            self.assertEqual(W.processed, i)
+            self.assertTrue(len(W.buffer)<=4)
+            if i==6:
+                W=deflicker.watcher(args)
+                self.assertEqual(W.last, 'pipic005.jpg')
+        self.assertEqual(W.step(final=True), 1)
+        self.assertEqual(W.processed, 12)
+        serial=[ open(os.path.join(self.camera, 'ser%03d.jpg' % i), 'rb').read() for i in range(12) ]
+        watched=[ open('wat%03d.jpg' % i, 'rb').read() for i in range(12) ]
+        self.assertEqual(watched, serial)
+
+#-------------------------------------------------------------------------------
+
+class StripTest(SequenceTest):
+    def test_matches_whole_frames(self):
+        """
+        Processing in strips gives exactly the whole-frame result.
+        """
+        self.assertTrue(deflicker.main(['-p', '3', '-o', 'ful']))
+        #Too small a budget for anything but the smallest strips.
+        self.assertTrue(deflicker.main(['-p', '3', '-o', 'str', '--budget', '1']))
+        for i in range(12):
+            self.assertEqual(open('str%03d.jpg' % i, 'rb').read(),
+                             open('ful%03d.jpg' % i, 'rb').read())
+
+    def test_rows(self):
+        args=argparse.Namespace(pixelavg=3)
+        S=deflicker.stripprocessor([], args, budget=1)
+        self.assertEqual(S.rows(2592, 1944, 6), 8)
+        #A 2592x1944 frame and a window of 6 in 120Mb, over what we use now.
+        S.budget=S.base+120*1048576
+        rows=S.rows(2592, 1944, 6)
+        self.assertTrue(100<rows<1944)
+        self.assertTrue(S.base+4*2592*1944+rows*4*2592*10<=S.budget)
+        S.budget=S.base+1024*1048576
+        self.assertEqual(S.rows(2592, 1944, 6), 1944)
+        S.close()
+
+#-------------------------------------------------------------------------------
+
+from framecache import framecache, greyhistogram
+
+class FrameCacheTest(SequenceTest):
+    def test_update(self):
+        names=deflicker.find_images('pipic')
+        C=framecache('.')
+        self.assertEqual(C.update(names), 12)
+        self.assertEqual(C.stack.shape, (12, 30, 40, 3))
+        a=C.array('pipic003.jpg')
+        self.assertTrue(numpy.may_share_memory(a, C.stack))
+        self.assertTrue((a==numpy.asarray(Image.open('pipic003.jpg'))).all())
+        self.assertEqual(list(greyhistogram(a)),
+                         Image.open('pipic003.jpg').convert('L').histogram())
+        #Unchanged frames are not decoded again.
+        self.assertEqual(framecache('.').update(names), 0)
+        Image.new('RGB', (40, 30), (200, 10, 10)).save('pipic005.jpg')
+        os.utime('pipic005.jpg', (0, 0))
+        C=framecache('.')
+        self.assertEqual(C.update(names), 1)
+        self.assertEqual(tuple(C.array('pipic005.jpg')[0, 0]), tuple(Image.open('pipic005.jpg').getpixel((0, 0))))
+        #A different scale is a different cache.
+        C=framecache('.', scale=2)
+        self.assertEqual(C.update(names), 12)
+        self.assertEqual(C.stack.shape, (12, 15, 20, 3))
+
+    def test_matches_decoding(self):
+        self.assertTrue(deflicker.main(['-p', '3', '-o', 'dec']))
+        self.assertTrue(deflicker.main(['-p', '3', '-o', 'cac', '--cache']))
+        for i in range(12):
+            self.assertEqual(open('cac%03d.jpg' % i, 'rb').read(),
+                             open('dec%03d.jpg' % i, 'rb').read())
+
+#-------------------------------------------------------------------------------
+
+from prefetch import stagestats, prefetcher, writebehind
+
+class PrefetchTest(SequenceTest):
+    def test_matches_serial(self):
+        self.assertTrue(deflicker.main(['-p', '2', '-o', 'ser', '--prefetch', '0']))
+        self.assertTrue(deflicker.main(['-p', '2', '-o', 'pre', '--prefetch', '3']))
+        for i in range(12):
+            self.assertEqual(open('pre%03d.jpg' % i, 'rb').read(),
+                             open('ser%03d.jpg' % i, 'rb').read())
+
+    def test_window(self):
+        """
+        Frames are read ahead within `depth`, dropped behind the window, and
+        read errors surface where the frame is used.
+        """
+        open('pipic012.jpg', 'wb').write('Not a JPEG')
+        names=deflicker.find_images('pipic')
+        stats=stagestats()
+        P=prefetcher(names, depth=3, stats=stats)
+        for i in range(12):
+            P.advance(i, i+1)
+            im=P.load(names[i])
+            self.assertEqual(im.size, (40, 30))
+            self.assertTrue(len(P.images)<=4)
+            self.assertTrue(P.next<=i+4)
+        #Dropped frames are read again if asked for.
+        self.assertEqual(P.load(names[0]).size, (40, 30))
+        self.assertRaises(IOError, P.load, names[12])
+        P.close()
+        W=writebehind(depth=2, stats=stats)
+        W.put(Image.new('RGB', (4, 4)).save, 'out.jpg', filename='out.jpg')
+        W.put(Image.new('RGB', (4, 4)).save, 'nowhere/out.jpg')
+        self.assertRaises(IOError, W.close)
+        self.assertTrue(os.path.exists('out.jpg'))
+        report=stats.report()
+        for x in ('read', 'write', 'wait read', 'wall'):
+            self.assertTrue(x in report)
+
+#-------------------------------------------------------------------------------
+
+import benchmark
+
+class BenchmarkTest(TestCase):
+    def test_synthetic(self):
+        """
+        Sequences are the same every time, and flicker.
+        """
+        a=benchmark.synthetic((32, 24), n=6)
+        b=benchmark.synthetic((32, 24), n=6)
+        self.assertEqual(len(a), 6)
+        self.assertEqual(a[0].shape, (24, 32, 3))
+        for (x, y) in zip(a, b):
+            self.assertTrue((x==y).all())
+        means=[ x.mean() for x in a ]
+        self.assertTrue(max(means)-min(means)>10)
+
+    def test_compare(self):
+        baseline={'brightness/320x240': {'fps': 100.0, 'peak': 1000},
+                  'deflicker/320x240': {'fps': 10.0, 'peak': 1000}}
+        results={'brightness/320x240': {'fps': 95.0, 'peak': 1050},
+                 'deflicker/320x240': {'fps': 8.0, 'peak': 1200},
+                 'level_adjust/320x240': {'fps': 1.0, 'peak': 1000}}
+        worse=benchmark.compare(results, baseline, tolerance=0.1)
+        self.assertEqual([ x[:2] for x in worse ],
+                         [('deflicker/320x240', 'fps'), ('deflicker/320x240', 'peak')])
+
+    def test_run(self):
+        folder=tempfile.mkdtemp()
+        try:
+            benchmark.writesequence(folder, (32, 24), n=6)
+            for x in ('brightness', 'deflicker'):
+                r=benchmark.measure(x, folder, mintime=0.05)
+                self.assertTrue(r['fps']>0)
+        finally:
+            shutil.rmtree(folder)
+
+#-------------------------------------------------------------------------------
+
+import histmatch
+from smoothing import windowmean
+
+class HistMatchTest(SequenceTest):
+    def test_windowmean(self):
+        a=numpy.arange(10.0).reshape(5, 2)
+        m=windowmean(a, 1)
+        for i in range(5):
+            self.assertTrue(numpy.allclose(m[i], a[max(i-1, 0):i+2].mean(axis=0)))
+
+    def test_tables(self):
+        """
+        The vectorized tables are the usual one-frame-at-a-time histogram
+        match, and leave a steady sequence alone.
+        """
+        H=histmatch.framehistograms(deflicker.find_images('pipic'))
+        F=histmatch.cdfs(H)
+        R=windowmean(F, 3)
+        T=histmatch.matchtables(F, R)
+        for i in range(len(H)):
+            t=numpy.searchsorted(R[i,0], F[i,0]-1e-9)
+            self.assertTrue((numpy.minimum(t, 255)==T[i,0]).all())
+        H=numpy.array([H[0]]*5)
+        T=histmatch.tables(H, 2)
+        self.assertEqual(T.shape, (5, 768))
+        used=numpy.tile(H[0,0]>0, 3)
+        self.assertTrue((T[:,used]==numpy.tile(numpy.arange(256), 3)[used]).all())
+
+    def test_deflicker(self):
+        """
+        Matching evens out the flicker, the same way whether frames are
+        whole or in strips.  The cache gives full size histograms, rather
+        than reduced ones, so a slightly different match.
+        """
+        self.assertTrue(deflicker.main(['--match', '4', '-t', '0', '-o', 'hm']))
+        self.assertTrue(deflicker.main(['--match', '4', '-t', '0', '-o', 'hs', '--budget', '1']))
+        self.assertTrue(deflicker.main(['--match', '4', '-t', '0', '-o', 'hc', '--cache']))
+        before=[ deflicker.lapseimage('pipic%03d.jpg' % i).brightness() for i in range(12) ]
+        for x in ('hm', 'hc'):
+            after=[ deflicker.lapseimage(x+'%03d.jpg' % i).brightness() for i in range(12) ]
+            self.assertTrue(numpy.std(after)<numpy.std(before)/3)
+        for i in range(12):
+            self.assertTrue(open('hs%03d.jpg' % i, 'rb').read()==
+                            open('hm%03d.jpg' % i, 'rb').read())
+        self.assertFalse(deflicker.main(['--match', '4', '--watch']))
+
+#-------------------------------------------------------------------------------
+
+import gaingrid
+
+class GainGridTest(SequenceTest):
+    def frames(self, folder):
+        #A steady scene, but for flicker on its left-hand side.
+        R=numpy.random.RandomState(0)
+        scene=R.randint(60, 120, (48, 64, 3))
+        for i in range(12):
+            a=scene.copy()
+            a[:,:32]+=R.randint(0, 80)
+            Image.fromarray(a.astype(numpy.uint8)).save(os.path.join(folder, 'pipic%03d.jpg' % i))
+
+    def test_gainmap(self):
+        g=numpy.array([[1.0, 2.0], [3.0, 4.0]])
+        m=gaingrid.gainmap(g, 40, 30)
+        self.assertEqual(m.shape, (30, 40))
+        #Flat out to the edges from the tiles' centres, and in between in between.
+        self.assertAlmostEqual(m[0,0], 1.0)
+        self.assertAlmostEqual(m[-1,-1], 4.0)
+        self.assertTrue(numpy.allclose(m[23:,0], 3.0) and numpy.allclose(m[:7,-1], 2.0))
+        self.assertTrue(numpy.all(numpy.diff(m, axis=1)>=0))
+        self.assertTrue(numpy.allclose(gaingrid.gainmap(g, 40, 30, 10, 20), m[10:20]))
+        M=gaingrid.tilemean(numpy.arange(12).reshape(3, 4), (2, 3))
+        self.assertTrue(numpy.allclose(M, [[0.5, 2.5], [4.5, 6.5], [8.5, 10.5]]))
+
+    def test_deflicker(self):
+        """
+        Tiles even out flicker in part of the frame, and come out the same
+        in strips.
+        """
+        self.assertTrue(deflicker.main(['--tiles', '4', '3', '--tileradius', '4', '-t', '0', '-o', 'tg']))
+        self.assertTrue(deflicker.main(['--tiles', '4', '3', '--tileradius', '4', '-t', '0', '-o', 'ts', '--budget', '1']))
+        def left(x):
+            return [ numpy.asarray(Image.open(x+'%03d.jpg' % i))[:,:32].mean() for i in range(12) ]
+        #What's left is the slow drift of the smoothed tiles.
+        jumps=lambda x: numpy.abs(numpy.diff(x)).mean()
+        self.assertTrue(jumps(left('tg'))<jumps(left('pipic'))/3)
+        for i in range(12):
+            self.assertTrue(open('ts%03d.jpg' % i, 'rb').read()==
+                            open('tg%03d.jpg' % i, 'rb').read())
+        self.assertFalse(deflicker.main(['--tiles', '4', '3', '--match', '2']))
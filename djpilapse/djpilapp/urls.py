@@ -7,6 +7,9 @@ urlpatterns = patterns('',
     url('^shoot/(\d+)/(\d+)/$', views.shoot, name='shoot'),
     url('^findinitialparams/$', views.findinitialparams, name='findinitialparams'),
     url('^jsonupdate/$', views.jsonupdate, name='jsonupdate'),
+    url('^metrics/$', views.metrics, name='metrics'),
+    url('^thumb/([0-9a-f]{40})/(small|medium)/$', views.thumb, name='thumb'),
+    url('^gallery/(\d+)/(\d+)/$', views.gallery, name='gallery'),
     url('^newProject/$', views.newProjectSubmit, name='newProjectSubmit'),
     ## add URL for newProject view
     url('^saveproj/$', views.saveProjectSettings, name='saveProjectSettings'),
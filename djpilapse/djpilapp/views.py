@@ -2,8 +2,8 @@
 
 import subprocess, json
 from time import time, strftime
-from os import statvfs, stat
-from django.http import HttpResponse
+from os import statvfs
+from django.http import HttpResponse, Http404
 from django.template import Context
 from django.template.loader import get_template
 from django.utils import simplejson
@@ -14,6 +14,7 @@ from django.views.decorators.csrf import csrf_exempt
 
 from djpilapp.models import *
 from djpilapp.tasks import *
+from djpilapp.runner import submit
 
 
 basedir='/home/pi/pipic/djpilapse/djpilapp/'
@@ -55,8 +56,9 @@ def shoot(request, ss=50000, iso=100):
     #Check that camera is available.
     Q=timelapser.objects.all()[0]
     if Q.active: return HttpResponse(location)
-    Q.set_active(True)
-    Q.set_status('Taking manual photo')
+    with Q.batch():
+        Q.set_active(True)
+        Q.set_status('Taking manual photo')
     ss=int(ss)
     iso=int(iso)
     if ss<0: ss=0
@@ -75,8 +77,9 @@ def shoot(request, ss=50000, iso=100):
     #im=Image.open(filename)
     #im.save(filename)
     location='static/new.jpg'
-    Q.set_status('idle')
-    Q.set_active(False)
+    with Q.batch():
+        Q.set_status('idle')
+        Q.set_active(False)
     return HttpResponse(location)
 
 
@@ -112,17 +115,19 @@ def findinitialparams(request):
 
 def startlapse(request):
     Q=timelapser.objects.all()[0]
+    #Already shooting, eg. from bootlapse.py.
+    if Q.active: return HttpResponse('')
     Q.findinitialparams()
     Q.set_active(True)
-    timelapse.delay()
+    submit(timelapse)
     return HttpResponse('')
 
 def deactivate(request):
     Q=timelapser.objects.all()[0]
-    Q.set_active(False)
-    Q.set_status('idle')
-    Q.set_active(False)
-    Q.set_status('idle')
+    with Q.batch():
+        Q.set_active(False)
+        Q.set_status('idle')
+    stop_timelapse()
     return HttpResponse('')
 
 def reboot(request):
@@ -136,23 +141,38 @@ def poweroff(request):
 def deleteall(request):
     Q=timelapser.objects.all()[0]
     proj=Q.project
-    folder=proj.folder
-    if folder[-1]!='/': folder+='/'
-    subprocess.call('sudo rm '+folder+'*.jpg', shell=True)
+    get_framelog(proj.folder).clear()
     Q.shots_taken=0
-    Q.save()
+    Q.persist('shots_taken')
     return HttpResponse('')
 
-#We would like a nice way to run this at startup time....
-#Add something to crontab like `sleep(10); wget 192.168.0.5:8000/boot_timelapse/`
-def boot_timelapse():
-    T=timelapser.objects.all()[0]
-    if T.boot or T.active:
-        T.set_active(True)
-        timelapse()
-    else:
-        T.set_active(False)
-    return True
+def thumb(request, key, size):
+    """
+    Serve a cached thumbnail of a shot.
+    """
+    path=get_thumbcache().get(key, size)
+    if path is None: raise Http404
+    f=open(path, 'rb')
+    data=f.read()
+    f.close()
+    return HttpResponse(data, content_type='image/jpeg')
+
+def gallery(request, start=0, count=48):
+    """
+    List thumbnail keys of recent shots, newest first, skipping the `start` most
+    recent.
+    """
+    frames=get_thumbcache().refresh()
+    start=int(start)
+    count=int(count)
+    end=max(len(frames)-start, 0)
+    page=frames[max(end-count, 0):end]
+    page.reverse()
+    J=json.dumps({
+        'total' : len(frames),
+        'frames': [ {'key': key, 'source': source} for (key, source) in page ],
+    })
+    return HttpResponse(J)
 
 @csrf_exempt
 def jsonupdate(request):
@@ -160,23 +180,31 @@ def jsonupdate(request):
     P=Q.project
     s=statvfs('/')
     df=s.f_bsize*s.f_bavail
-    try:
-        size=stat(Q.lastshot).st_size
-        remaining=int(float(df)/size)
-    except:
-        remaining=''
+    remaining=get_framelog(P.folder).remaining(df)
+    if remaining is None: remaining=''
     free=str(df/(1024*1024))+' Mb'
+    frames=get_thumbcache().refresh()
+    if frames:
+        lastthumb=frames[-1][0]
+    else:
+        lastthumb=''
+    M=get_sysmetrics().latest()
     jsondict={
         'time'  : strftime('%H:%M:%S--%m-%d-%y'),
         'diskfree'  : free,
         'remaining' : remaining,
+        'cpu'   : round(100*M['cpu'], 1),
+        'temp'  : M['temp'],
+        'memfree' : str(M['memavail']/(1024*1024))+' Mb',
 
         'ss'    : Q.ss,
         'iso'   : Q.iso,
         'boot'  : Q.boot,
         'active': Q.active,
         'shots' : Q.shots_taken,
+        'rejected' : get_exposurelog(P.folder).rejected(),
         'lastshot': Q.lastshot,
+        'lastthumb': lastthumb,
         'lastbr': Q.lastbr,
         'status': Q.status,
         'avgbr' : Q.avgbr,
@@ -194,6 +222,12 @@ def jsonupdate(request):
     J=json.dumps(jsondict)
     return HttpResponse(J)
 
+def metrics(request):
+    """
+    The latest system metrics, as `name value` lines.
+    """
+    return HttpResponse(get_sysmetrics().text(), content_type='text/plain')
+
 @csrf_exempt
 def saveProjectSettings(request):
     vals=request.POST.dict()
@@ -1,5 +1,9 @@
 from __future__ import absolute_import
+import os
 
 # This will make sure the app is always imported when
 # Django starts so that shared_task will use this app.
-from .celery import app as celery_app
+# bootlapse.py shoots without Celery, and sets PILAPSE_NO_CELERY to keep it
+# from loading at all.
+if not os.environ.get('PILAPSE_NO_CELERY'):
+    from .celery import app as celery_app
@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import os
 
 from celery import Celery
+from celery.signals import worker_ready
 from datetime import timedelta
 
 from django.conf import settings
@@ -45,6 +46,12 @@ app.conf.update(
     CELERY_TASK_RESULT_EXPIRES=3600,
 )
 
+@worker_ready.connect
+def signal_ready(sender=None, **kwargs):
+    #Lets `ready.py --file celery` stand in for a fixed sleep at boot.
+    import ready
+    ready.signal('celery')
+
 @app.task(bind=True)
 def debug_task(self):
     print('Request: {0!r}'.format(self.request))
@@ -160,3 +160,55 @@ LOGGING = {
         },
     }
 }
+
+# Pilapse settings.
+
+# Small and medium thumbnails of every shot are kept here, in a cache limited
+# to PILAPSE_THUMB_BUDGET bytes.
+PILAPSE_THUMB_DIR = '/home/pi/pipic/djpilapse/thumbs/'
+PILAPSE_THUMB_BUDGET = 64*1024*1024
+
+# Keep small thumbnails of shots discarded for being too far from the target
+# brightness, for diagnostics.
+PILAPSE_REJECT_THUMBS = False
+
+# The latest shot, kept or not, as the web interface shows it before there
+# are any thumbnails.  None to skip the extra write.
+PILAPSE_PREVIEW = '/home/pi/pipic/djpilapse/djpilapp/static/new.jpg'
+
+# Location of the camera, in degrees (longitude east positive).  When set,
+# exposure follows the predicted change in daylight between shots.
+PILAPSE_LATITUDE = None
+PILAPSE_LONGITUDE = None
+
+# Camera response model fitted by responsemodel.py from brightData.py
+# captures.  Calibration uses it to jump to the right exposure in one step.
+PILAPSE_RESPONSE_MODEL = '/home/pi/pipic/responsemodel.json'
+
+# Print a table of per-stage capture latencies every this many shots.
+PILAPSE_TRACE_EVERY = 100
+
+# Seconds between samples of CPU, temperature, memory and disk.
+PILAPSE_METRICS_INTERVAL = 5
+
+# Background work is slowed down above PILAPSE_HOT_TEMP degrees C, and paused
+# above PILAPSE_CRITICAL_TEMP, before the Pi starts throttling captures.
+PILAPSE_HOT_TEMP = 70
+PILAPSE_CRITICAL_TEMP = 80
+
+# After a restart, a timelapse resumes from its checkpoint without
+# recalibrating if the checkpoint is at most this many seconds old.
+PILAPSE_RESUME_AGE = 600
+
+# The checkpoint is written after every shot, but only synced to the card
+# every this many seconds; after a power cut it may be up to this old.
+PILAPSE_CHECKPOINT_SYNC = 60
+
+# How to run background tasks: 'celery' needs the RabbitMQ broker; 'thread'
+# runs them in the web server, and 'process' in a worker started with
+# `python -m djpilapp.runner`, both from a queue in PILAPSE_QUEUE_DB.
+PILAPSE_TASK_RUNNER = 'celery'
+PILAPSE_QUEUE_DB = '/home/pi/pipic/djpilapse/queue.db'
+
+# A running timelapse listens here for stop requests between shots.
+PILAPSE_STOP_SOCKET = '/tmp/pipic-stop.sock'
@@ -0,0 +1,118 @@
+import math
+
+def ev(ss, iso):
+    """
+    Exposure of shutterspeed `ss` (microseconds) at `iso`, in stops relative
+    to one second at ISO 100.
+    """
+    return math.log(ss/1000000.0*iso/100.0, 2)
+
+class exposureplanner:
+    """
+    Chooses shutterspeed and ISO in EV stops.
+
+    Options:
+        `minss`, `maxss` : Shutterspeed limits, in microseconds.
+        `miniso`, `maxiso` : ISO limits.  Set them equal to fix the ISO.
+        `blurss` : Longest shutterspeed before motion blur matters.  ISO is
+            raised before going past it, and kept as low as possible otherwise.
+        `maxstep` : Largest exposure change per frame, in stops.  None for no limit.
+        `slope` : Stops of image brightness per stop of exposure.  1.0 assumes
+            a linear response; a real camera's JPEGs are usually flatter.  Fit
+            it with `responsemodel.py`; with the right slope, a step with
+            `gain=1.0` lands on the target in one go.
+
+    EXAMPLE::
+        P=exposureplanner(maxss=999000, miniso=100, maxiso=100)
+        (ss, iso)=P.step(ss, iso, target=128, br=lastbr, gain=0.2)
+    """
+    def __init__(self, minss=100, maxss=2000000, miniso=100, maxiso=800,
+                 blurss=None, maxstep=None, slope=1.0):
+        self.minss=minss
+        self.maxss=maxss
+        self.miniso=miniso
+        self.maxiso=maxiso
+        if blurss is None: blurss=maxss
+        self.blurss=min(blurss, maxss)
+        self.maxstep=maxstep
+        self.slope=slope
+
+    def __repr__(self):
+        return 'Exposure planner, %s to %s EV' % (round(self.minev(),2), round(self.maxev(),2))
+
+    def minev(self):
+        return ev(self.minss, self.miniso)
+
+    def maxev(self):
+        return ev(self.maxss, self.maxiso)
+
+    def error(self, target, br):
+        """
+        Exposure change, in stops, that would take brightness `br` to `target`.
+        """
+        return math.log(1.0*max(target,1)/max(br,1), 2)/self.slope
+
+    def plan(self, stops):
+        """
+        The (ss, iso) pair for an exposure of `stops` EV.
+        """
+        stops=max(min(stops, self.maxev()), self.minev())
+        exposure=2.0**stops*1000000*100
+        ss=exposure/self.miniso
+        if ss<=self.blurss:
+            return (int(round(max(ss, self.minss))), self.miniso)
+        iso=exposure/self.blurss
+        if iso<=self.maxiso:
+            return (int(round(self.blurss)), int(round(iso)))
+        ss=exposure/self.maxiso
+        return (int(round(min(ss, self.maxss))), self.maxiso)
+
+    def step(self, ss, iso, target, br, gain=1.0, ff=0.0, limit=True):
+        """
+        Next (ss, iso) after a shot at (`ss`, `iso`) came out with brightness
+        `br`.  `gain` is the fraction of the error corrected in this step, and
+        `ff` a predicted change in scene brightness in stops (see `solar`).
+        Set `limit` to False to ignore `maxstep`, eg. while calibrating.
+        """
+        change=gain*self.error(target, br)-ff
+        if limit and self.maxstep is not None:
+            change=max(min(change, self.maxstep), -self.maxstep)
+        return self.plan(ev(ss, iso)+change)
+
+#-------------------------------------------------------------------------------
+
+def replay(records, planner, target=128, gain=0.2, alpha=None):
+    """
+    Run a recorded exposure log (see `exposurelog`) through `planner`.
+
+    The scene brightness of each record is recovered from its exposure and
+    measured brightness, assuming the planner's response slope, and a camera
+    following that response (capped at 255) is simulated in its place.
+    `alpha`, if given, smooths the simulated brightness as the timelapse does.
+
+    Returns a dict of arrays: the simulated `ss`, `iso`, `ev` and `br` of
+    each shot.
+    """
+    import numpy as np
+    n=len(records)
+    scene=np.array([ math.log(max(r['lastbr'],1), 2)-planner.slope*ev(r['ss'], r['iso'])
+                     for r in records ])
+    out={
+        'ss' : np.zeros(n, dtype=int),
+        'iso': np.zeros(n, dtype=int),
+        'ev' : np.zeros(n),
+        'br' : np.zeros(n),
+    }
+    if n==0: return out
+    (ss, iso)=(int(records[0]['ss']), int(records[0]['iso']))
+    avgbr=None
+    for i in range(n):
+        e=ev(ss, iso)
+        br=min(255.0, 2.0**(scene[i]+planner.slope*e))
+        (out['ss'][i], out['iso'][i], out['ev'][i], out['br'][i])=(ss, iso, e, br)
+        if alpha is None or avgbr is None:
+            avgbr=br
+        else:
+            avgbr=alpha*br+(1-alpha)*avgbr
+        (ss, iso)=planner.step(ss, iso, target, avgbr, gain=gain)
+    return out
@@ -0,0 +1,122 @@
+import os, struct
+from time import time
+
+#One fixed-width record per shot.
+FIELDS=[
+    ('t', '<f8'),       #Capture time, seconds since the epoch.
+    ('ss', '<i4'),      #Shutter speed, in microseconds.
+    ('iso', '<i4'),
+    ('lastbr', '<f4'),  #Brightness of this shot.
+    ('avgbr', '<f4'),   #Smoothed brightness after this shot.
+    ('kept', 'u1'),     #0 if the shot was discarded.
+]
+#The same record for struct, so that the capture loop can append to the log
+#without importing numpy.
+FORMAT='<diiffB'
+RECORDSIZE=struct.calcsize(FORMAT)
+
+_record=None
+def recordtype():
+    """
+    The numpy dtype of a record, made on first use.
+    """
+    global _record
+    if _record is None:
+        import numpy as np
+        _record=np.dtype(FIELDS)
+    return _record
+
+class exposurelog:
+    """
+    Append-only log of per-shot exposure data.
+
+    Records are packed end to end in `folder/exposure.log` and read back
+    through a memory map, so a query over a multi-day run costs a few
+    vectorized comparisons rather than parsing text.
+
+    Only the capture process, opening the log as the `writer`, may append to
+    it.  Readers, such as the web server, never modify the file, and ignore a
+    trailing partial record, which may be one still being written.
+
+    EXAMPLE::
+        E=exposurelog('/media/Usb-Drive/Timelapse', writer=True)
+        E.append(ss=5000, iso=100, lastbr=121.5, avgbr=124.0)
+        R=E.query(start=time()-3600)
+        R['t'], R['ss'], R['lastbr']
+    """
+    def __init__(self, folder, name='exposure.log', writer=False):
+        if folder[-1]!='/': folder+='/'
+        self.filename=folder+name
+        self.writer=writer
+        #Records counted by `rejected` so far, and how many were discarded.
+        self.counted=0
+        self.discarded=0
+        if writer:
+            #Drop a partial record left behind by a crash mid-write.
+            try:
+                size=os.path.getsize(self.filename)
+            except OSError:
+                size=0
+            if size%RECORDSIZE:
+                f=open(self.filename, 'r+b')
+                f.truncate(size-size%RECORDSIZE)
+                f.close()
+
+    def __repr__(self):
+        return 'Exposure log '+self.filename
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.filename)//RECORDSIZE
+        except OSError:
+            return 0
+
+    def append(self, ss, iso, lastbr, avgbr, kept=True, t=None):
+        """
+        Record one shot.
+        """
+        if not self.writer:
+            raise IOError(self.filename+' is open read-only')
+        if t is None: t=time()
+        f=open(self.filename, 'ab')
+        f.write(struct.pack(FORMAT, t, ss, iso, lastbr, avgbr, bool(kept)))
+        f.close()
+
+    def records(self):
+        """
+        All records, as a read-only memory-mapped structured array.
+        """
+        import numpy as np
+        n=len(self)
+        if n==0: return np.zeros(0, dtype=recordtype())
+        return np.memmap(self.filename, dtype=recordtype(), mode='r', shape=(n,))
+
+    def query(self, start=None, end=None):
+        """
+        Records with `start <= t < end`, in the order they were written.
+        Index the result by column name to get plain arrays.
+        """
+        import numpy as np
+        R=self.records()
+        mask=np.ones(len(R), dtype=bool)
+        if start is not None: mask&=(R['t']>=start)
+        if end is not None: mask&=(R['t']<end)
+        return R[mask]
+
+    def rejected(self, start=None):
+        """
+        Number of shots discarded since `start`.  Over the whole log, only
+        the records added since the last call are read.
+        """
+        import numpy as np
+        if start is not None:
+            R=self.query(start=start)
+            return int(np.count_nonzero(R['kept']==0))
+        R=self.records()
+        if len(R)<self.counted:
+            #Cut short since; count again.
+            self.counted=0
+            self.discarded=0
+        self.discarded+=int(np.count_nonzero(R['kept'][self.counted:]==0))
+        self.counted=len(R)
+        return self.discarded
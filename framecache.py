@@ -0,0 +1,182 @@
+import os, json
+import numpy as np
+
+class framecache:
+    """
+    Decoded frames of a sequence, in one memory-mapped N x H x W x 3 uint8
+    array, so that repeated post-processing runs skip JPEG decoding.
+
+    The array is `folder/frames.npy`, and `folder/frames.json` lists the frame
+    each row came from, with its modification time and size when decoded.
+    `update` re-decodes only frames that have changed since; a different
+    list of frames, size or `scale` means a rebuild.  With `scale` above 1,
+    frames are decoded at reduced resolution, for quick previews.
+
+    `array` returns a view straight into the map, without copying or
+    decoding anything; the OS pages frames in as they are used, and can drop
+    them again under memory pressure.
+
+    EXAMPLE::
+        C=framecache('.')
+        C.update(image_list)
+        C.array('pipic000.jpg').mean()
+    """
+    def __init__(self, folder='.', name='frames', scale=1):
+        self.folder=folder
+        self.filename=os.path.join(folder, name+'.npy')
+        self.indexname=os.path.join(folder, name+'.json')
+        self.scale=scale
+        self.stack=None
+        self.names=[]
+        self.rows={}
+        self.decoded=0
+
+    def __repr__(self):
+        return 'Frame cache %s, %d frames' % (self.filename, len(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def stat(self, name):
+        s=os.stat(os.path.join(self.folder, name))
+        return [s.st_mtime, s.st_size]
+
+    def readindex(self):
+        try:
+            f=open(self.indexname)
+            index=json.load(f)
+            f.close()
+        except (IOError, ValueError):
+            return None
+        return index
+
+    def writeindex(self, index):
+        f=open(self.indexname+'.tmp', 'w')
+        json.dump(index, f)
+        f.close()
+        os.rename(self.indexname+'.tmp', self.indexname)
+
+    def decode(self, name, size):
+        """
+        Decode a frame at the cache's resolution, as an H x W x 3 array.
+        """
+        from PIL import Image
+        im=Image.open(os.path.join(self.folder, name))
+        #Let the JPEG decoder do most of any reduction.
+        im.draft('RGB', size)
+        im=im.convert('RGB')
+        if im.size!=size:
+            im=im.resize(size, Image.ANTIALIAS)
+        self.decoded+=1
+        return np.asarray(im)
+
+    def framesize(self, name):
+        from PIL import Image
+        (w, h)=Image.open(os.path.join(self.folder, name)).size
+        return (w/self.scale, h/self.scale)
+
+    def update(self, image_list):
+        """
+        Bring the cache up to date with the frames in `image_list`, all of
+        which must be the same size.  Returns the number of frames decoded.
+        """
+        self.decoded=0
+        self.stack=None
+        stats=[ self.stat(x) for x in image_list ]
+        index=self.readindex()
+        if (index is None or index['scale']!=self.scale or
+            [ x[0] for x in index['frames'] ]!=list(image_list) or
+            not os.path.exists(self.filename)):
+            self.build(image_list, stats)
+        else:
+            stack=np.load(self.filename, mmap_mode='r+')
+            stale=[ i for (i, x) in enumerate(index['frames']) if x[1:]!=stats[i] ]
+            if stale:
+                (h, w)=stack.shape[1:3]
+                for i in stale:
+                    stack[i]=self.decode(image_list[i], (w, h))
+                stack.flush()
+                #Only now the frames are safely written.
+                for i in stale:
+                    index['frames'][i][1:]=stats[i]
+                self.writeindex(index)
+            del stack
+        self.names=list(image_list)
+        self.rows=dict([ (x, i) for (i, x) in enumerate(self.names) ])
+        self.stack=np.load(self.filename, mmap_mode='r')
+        return self.decoded
+
+    def build(self, image_list, stats):
+        if not image_list:
+            size=(0, 0)
+        else:
+            size=self.framesize(image_list[0])
+        tmp=self.filename+'.tmp.npy'
+        stack=np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint8,
+                                        shape=(len(image_list), size[1], size[0], 3))
+        for (i, x) in enumerate(image_list):
+            a=self.decode(x, size)
+            if a.shape!=stack.shape[1:]:
+                raise ValueError('%s is not the same size as %s' % (x, image_list[0]))
+            stack[i]=a
+        stack.flush()
+        del stack
+        os.rename(tmp, self.filename)
+        self.writeindex({'scale': self.scale,
+                         'frames': [ [x]+s for (x, s) in zip(image_list, stats) ]})
+
+    def array(self, name):
+        """
+        Frame `name` as an H x W x 3 view into the cache.
+        """
+        return self.stack[self.rows[name]]
+
+    def image(self, name):
+        """
+        Frame `name` as a PIL image.  PIL keeps its own copy of the pixels.
+        """
+        from PIL import Image
+        return Image.fromarray(np.asarray(self.array(name)))
+
+    def histograms(self, names=None):
+        """
+        Greyscale histograms of frames `names`, or of them all, as an
+        N x 256 array.
+        """
+        if names is None: names=self.names
+        return np.array([ greyhistogram(self.array(x)) for x in names ])
+
+    def rgbhistograms(self, names=None):
+        """
+        Histograms of each channel of frames `names`, or of them all, as an
+        N x 768 array.
+        """
+        if names is None: names=self.names
+        return np.array([ rgbhistogram(self.array(x)) for x in names ])
+
+def greyhistogram(a, rows=256):
+    """
+    Histogram of an H x W x 3 array in greyscale, as PIL's
+    `convert('L').histogram()` gives it, a few rows at a time.
+    """
+    h=np.zeros(256, dtype=np.int64)
+    for y in range(0, a.shape[0], rows):
+        b=a[y:y+rows].astype(np.int32)
+        #ITU-R 601-2 luma, in PIL's 16 bit fixed point.
+        L=(b[...,0]*19595+b[...,1]*38470+b[...,2]*7471)>>16
+        h+=np.bincount(L.ravel(), minlength=256)
+    return h
+
+def rgbhistogram(a, rows=256):
+    """
+    Histogram of each channel of an H x W x 3 array, one after the other,
+    as PIL's `histogram()` gives it for an RGB image.
+    """
+    h=np.zeros(768, dtype=np.int64)
+    offset=np.array([0, 256, 512], dtype=np.int32)
+    for y in range(0, a.shape[0], rows):
+        h+=np.bincount((a[y:y+rows]+offset).ravel(), minlength=768)
+    return h
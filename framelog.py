@@ -0,0 +1,206 @@
+import os, fcntl
+from time import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+def matches(path, prefix, suffix=''):
+    """
+    Whether the file name of `path`, ignoring its folder and case, starts with
+    `prefix` and ends with `suffix`.
+    """
+    name=os.path.basename(path).lower()
+    return name.startswith(prefix.lower()) and name.endswith(suffix.lower())
+
+class framelog:
+    """
+    Append-only catalogue of the frames saved in a folder.
+
+    Each saved frame is recorded in `folder/frames.log` as it is written, with
+    its timestamp, size, exposure and brightness, so listing the frames, the
+    totals and the remaining capacity never need a directory scan.
+    The log has one record per line:
+
+        +<TAB>path<TAB>timestamp<TAB>size<TAB>ss<TAB>iso<TAB>brightness
+        -<TAB>path         (frame deleted)
+        *                  (all frames deleted)
+
+    Paths are relative to `folder`, and may include a subfolder, eg. one for
+    each day.  Several processes may share a log; each one replays the records
+    appended by the others in `refresh`.  Appends and compaction hold a lock
+    on `folder/frames.log.lock`, so a compaction can't lose a record.
+
+    EXAMPLE::
+        F=framelog('/media/Usb-Drive/Timelapse')
+        F.add('2014-06-01/2014-06-01-12-00-00.jpg', ss=5000, iso=100, brightness=121)
+        F.count, F.bytes, F.remaining(freebytes)
+    """
+    def __init__(self, folder, name='frames.log'):
+        if folder[-1]!='/': folder+='/'
+        self.folder=folder
+        self.filename=folder+name
+        self.reset()
+        self.refresh()
+
+    def __repr__(self):
+        return 'Frame log '+self.filename
+
+    def reset(self):
+        #path -> (timestamp, size, ss, iso, brightness), in capture order.
+        self.frames=OrderedDict()
+        self.count=0
+        self.bytes=0
+        self.dead=0
+        self.pos=0
+        self.inode=None
+
+    def refresh(self):
+        """
+        Replay records appended since we last looked.
+        """
+        try:
+            f=open(self.filename)
+        except IOError:
+            return self
+        s=os.fstat(f.fileno())
+        if s.st_ino!=self.inode or s.st_size<self.pos:
+            #The log was compacted by someone else; start over.
+            self.reset()
+            self.inode=s.st_ino
+        f.seek(self.pos)
+        for line in f:
+            if line[-1]!='\n': break
+            self.pos+=len(line)
+            self.replay(line[:-1].split('\t'))
+        f.close()
+        return self
+
+    def replay(self, record):
+        op=record[0]
+        if op=='+':
+            path=record[1]
+            if path in self.frames: self.forget(path)
+            frame=(float(record[2]), int(record[3]), int(record[4]), int(record[5]), float(record[6]))
+            self.frames[path]=frame
+            self.count+=1
+            self.bytes+=frame[1]
+        elif op=='-':
+            if record[1] in self.frames: self.forget(record[1])
+            self.dead+=1
+        elif op=='*':
+            self.dead+=len(self.frames)+1
+            self.frames=OrderedDict()
+            self.count=0
+            self.bytes=0
+
+    def forget(self, path):
+        frame=self.frames.pop(path)
+        self.count-=1
+        self.bytes-=frame[1]
+        self.dead+=1
+
+    @contextmanager
+    def lock(self):
+        f=open(self.filename+'.lock', 'a')
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            f.close()
+
+    def append(self, line):
+        with self.lock():
+            f=open(self.filename, 'a')
+            f.write(line+'\n')
+            f.close()
+        self.refresh()
+
+    def add(self, path, timestamp=None, size=None, ss=0, iso=0, brightness=0):
+        """
+        Record a frame which has just been saved at `path`.
+        """
+        if path.startswith(self.folder): path=path[len(self.folder):]
+        if timestamp is None: timestamp=time()
+        if size is None: size=os.stat(self.folder+path).st_size
+        self.append('\t'.join(['+', path, '%.3f' % timestamp, str(size),
+                               str(int(ss)), str(int(iso)), str(brightness)]))
+
+    def remove(self, path):
+        """
+        Delete a frame and record its removal.
+        """
+        if path.startswith(self.folder): path=path[len(self.folder):]
+        try:
+            os.remove(self.folder+path)
+        except OSError, e:
+            print ("Error: %s - %s." % (e.filename,e.strerror))
+        self.append('-\t'+path)
+        self.compact()
+
+    def clear(self):
+        """
+        Delete every catalogued frame.  Nothing else in the folder is
+        touched; see `adopt` for frames saved before there was a catalogue.
+        """
+        self.refresh()
+        for path in self.frames:
+            try:
+                os.remove(self.folder+path)
+            except OSError, e:
+                print ("Error: %s - %s." % (e.filename,e.strerror))
+        self.append('*')
+        self.compact(force=True)
+
+    def adopt(self, prefix):
+        """
+        Catalogue the frames named `prefix`*.jpg at the top of the folder
+        that aren't catalogued yet, such as those saved before there was a
+        catalogue, so that `clear` will delete them too.  A one-off: it scans
+        the folder.  Returns the number of frames added.
+        """
+        self.refresh()
+        names=[ x for x in os.listdir(self.folder)
+                if matches(x, prefix, '.jpg') and x not in self.frames ]
+        stats=[ os.stat(self.folder+x) for x in names ]
+        for (x, s) in sorted(zip(names, stats), key=lambda x: x[1].st_mtime):
+            self.add(x, timestamp=s.st_mtime, size=s.st_size)
+        return len(names)
+
+    def list(self, prefix=''):
+        """
+        Paths of the catalogued frames whose file names start with `prefix`,
+        in capture order.
+        """
+        return [ x for x in self.frames if matches(x, prefix) ]
+
+    def meansize(self):
+        if self.count==0: return None
+        return 1.0*self.bytes/self.count
+
+    def remaining(self, free):
+        """
+        Estimated number of frames that still fit in `free` bytes.
+        """
+        if self.count==0: return None
+        return int(free/self.meansize())
+
+    def compact(self, force=False):
+        """
+        Rewrite the log without deleted frames, once they outnumber the live ones.
+        """
+        if self.dead<=max(self.count, 64) and not force: return False
+        with self.lock():
+            #Pick up anything appended by others since we last looked.
+            self.refresh()
+            tmp=self.filename+'.tmp'
+            f=open(tmp, 'w')
+            for (path, frame) in self.frames.items():
+                f.write('\t'.join(['+', path, '%.3f' % frame[0], str(frame[1]),
+                                   str(frame[2]), str(frame[3]), str(frame[4])])+'\n')
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.rename(tmp, self.filename)
+        self.reset()
+        self.refresh()
+        return True
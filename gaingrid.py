@@ -0,0 +1,100 @@
+#Tiled flicker correction.
+#
+#A single gain for the whole frame can't correct flicker in part of it: a
+#cloud's shadow crossing the hills, or street lights coming on.  Instead,
+#each frame is divided into a coarse grid of tiles, and each tile's mean
+#brightness is followed through the sequence.  Smoothing each tile's series
+#over time gives the brightness it should have had, and so a gain for each
+#tile of each frame.
+#
+#All of this is done on small N x rows x cols arrays, for the whole sequence
+#at once.  Only when a frame is corrected is its grid of gains interpolated
+#up to full size, a band of rows at a time, and multiplied into the pixels.
+
+import numpy as np
+from smoothing import windowmean
+
+def tileedges(n, tiles):
+    #First row or column of each tile, for np.add.reduceat.
+    return (np.arange(tiles)*n)//tiles
+
+def tilemean(a, grid):
+    """
+    Mean of each of the `grid`=(cols, rows) tiles of a 2D array.
+    """
+    (cols, rows)=grid
+    (h, w)=a.shape
+    ys=tileedges(h, rows)
+    xs=tileedges(w, cols)
+    sums=np.add.reduceat(np.add.reduceat(a.astype(np.int64), ys, axis=0), xs, axis=1)
+    counts=np.outer(np.diff(np.append(ys, h)), np.diff(np.append(xs, w)))
+    return sums/counts.astype(np.float64)
+
+def tilemeans(image_list, grid=(8, 6), cache=None, scale=4):
+    """
+    Mean greyscale brightness of each tile of each frame in `image_list`,
+    as an N x rows x cols array.  Frames come from a `framecache`, if given,
+    or are decoded at 1/`scale` size, which is far quicker and makes no
+    difference to a tile's mean.
+    """
+    from PIL import Image
+    M=[]
+    for x in image_list:
+        if cache is not None:
+            im=cache.image(x)
+        else:
+            im=Image.open(x)
+            (w, ht)=im.size
+            im.draft('RGB', (w/scale, ht/scale))
+        M.append(tilemean(np.asarray(im.convert('L')), grid))
+    return np.array(M)
+
+def gains(M, radius, limit=4.0):
+    """
+    Gains taking each tile's brightness in the tile means `M` to its mean
+    over the frames within `radius`, limited to between 1/`limit` and
+    `limit` so that a black tile isn't blown out.
+    """
+    G=windowmean(M, radius)/np.maximum(M, 1.0)
+    return np.clip(G, 1.0/limit, limit)
+
+def axisweights(n, tiles):
+    """
+    For each of `n` pixels along an axis, the tiles either side of it and
+    the weight of the second, for linear interpolation between the tiles'
+    centres.
+    """
+    t=(np.arange(n)+0.5)*tiles/float(n)-0.5
+    t=np.clip(t, 0, tiles-1)
+    lo=np.floor(t).astype(int)
+    hi=np.minimum(lo+1, tiles-1)
+    return (lo, hi, (t-lo).astype(np.float32))
+
+def gainmap(g, width, height, y0=0, y1=None):
+    """
+    Rows `y0` to `y1` of the grid of gains `g`, bilinearly interpolated up
+    to a `width` x `height` frame.
+    """
+    if y1 is None: y1=height
+    g=g.astype(np.float32)
+    (xlo, xhi, fx)=axisweights(width, g.shape[1])
+    (ylo, yhi, fy)=axisweights(height, g.shape[0])
+    gx=g[:,xlo]*(1-fx)+g[:,xhi]*fx
+    fy=fy[y0:y1,None]
+    return gx[ylo[y0:y1]]*(1-fy)+gx[yhi[y0:y1]]*fy
+
+def apply(a, g, y0=0, height=None, rows=64):
+    """
+    Multiply the pixels of `a`, an H x W x 3 array, or the band of a frame
+    `height` high that starts at row `y0`, by the grid of gains `g`.
+    Returns a new uint8 array.
+    """
+    if height is None: height=a.shape[0]
+    w=a.shape[1]
+    out=np.empty(a.shape, dtype=np.uint8)
+    for y in range(0, a.shape[0], rows):
+        y1=min(y+rows, a.shape[0])
+        m=gainmap(g, w, height, y0+y, y0+y1)
+        if a.ndim==3: m=m[...,None]
+        out[y:y1]=np.minimum(a[y:y1]*m, 255)
+    return out
@@ -0,0 +1,92 @@
+#Histogram matching deflicker.
+#
+#A single brightness gain can't correct flicker where the shadows and the
+#highlights move differently.  Instead, each frame's tones are mapped onto a
+#reference: the cumulative histogram (CDF) of the frames around it, averaged
+#over a window, so the reference changes only as slowly as the light does.
+#
+#The analysis works on an N x C x 256 array of histograms, all frames at
+#once, and gives one lookup table per frame, so correcting a frame is a
+#single Image.point().
+
+import numpy as np
+from smoothing import windowmean
+
+LEVELS=256
+
+def framehistograms(image_list, cache=None, rgb=False, scale=4):
+    """
+    Histograms of the frames in `image_list`, greyscale or of each channel,
+    as an N x C x 256 array.  They come from a `framecache`, if given, or
+    are decoded at 1/`scale` size, which is far quicker and hardly changes
+    the distribution of tones.
+    """
+    from PIL import Image
+    H=[]
+    for x in image_list:
+        if cache is not None:
+            if rgb:
+                h=cache.rgbhistograms([x])[0]
+            else:
+                h=cache.histograms([x])[0]
+        else:
+            im=Image.open(x)
+            (w, ht)=im.size
+            im.draft('RGB', (w/scale, ht/scale))
+            im=im.convert('RGB' if rgb else 'L')
+            h=im.histogram()
+        H.append(h)
+    return np.array(H, dtype=np.float64).reshape(len(image_list), -1, LEVELS)
+
+def cdfs(H):
+    """
+    Cumulative histograms, as fractions of each frame's pixels.
+    """
+    F=np.cumsum(H, axis=-1)
+    return F/np.maximum(F[...,-1:], 1)
+
+def matchtables(F, R):
+    """
+    For each row of the CDFs `F`, the table taking each level to the lowest
+    level at which the reference CDF `R` is as high.
+    """
+    shape=F.shape
+    F=F.reshape(-1, LEVELS)
+    R=R.reshape(-1, LEVELS)
+    #Rows of CDFs all lie in [0, 1], so spacing them out by 2 lets one
+    #searchsorted do every row at once.
+    offset=2.0*np.arange(F.shape[0])[:,None]
+    #A little slack, so that a frame matched to itself comes out unchanged.
+    k=np.searchsorted((R+offset).ravel(), (F+offset-1e-9).ravel())
+    T=k.reshape(F.shape)-LEVELS*np.arange(F.shape[0])[:,None]
+    return np.clip(T, 0, LEVELS-1).reshape(shape)
+
+def leveltables(T, R, thresh):
+    """
+    Follow the tables `T` with auto-levelling, as level_bounds and
+    pixel_level do, but with bounds taken from the reference CDFs `R`, so
+    they don't flicker either.
+    """
+    a=np.minimum((R<thresh).sum(axis=-1), 64)[...,None]
+    b=np.maximum(LEVELS-1-(R>1-thresh).sum(axis=-1), 256-64)[...,None]
+    return np.clip((T-a)*255//(b-a), 0, 255)
+
+def tables(H, radius, thresh=0):
+    """
+    Lookup tables matching each frame with histograms `H` to the mean CDF
+    of the frames within `radius` of it, then auto-levelling with `thresh`,
+    if above 0.  Returns an N x 768 array, whose rows are ready for
+    Image.point() on RGB frames.
+
+    EXAMPLE::
+        T=tables(framehistograms(image_list), radius=10, thresh=0.05)
+        im=im.point(T[i].tolist())
+    """
+    F=cdfs(H)
+    R=windowmean(F, radius)
+    T=matchtables(F, R)
+    if thresh>0: T=leveltables(T, R, thresh)
+    if T.shape[1]==1:
+        #Greyscale matching moves all three channels alike.
+        T=np.repeat(T, 3, axis=1)
+    return T.reshape(T.shape[0], -1).astype(np.uint8)
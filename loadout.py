@@ -55,7 +55,8 @@ def main(argv):
         'photoscript.py': 'home/pi/photoscript.py',
         'timelapse.py': 'home/pi/timelapse.py',
         'deflicker.py': 'home/pi/deflicker.py',
-        'tempgauge.py': 'home/pi/tempgauge.py',
+        'config/tempgauge.py': 'home/pi/tempgauge.py',
+        'sysmetrics.py': 'home/pi/sysmetrics.py',
     }
     for f in files.keys():
         placefile(f, piroot + files[f])
@@ -0,0 +1,204 @@
+import os, time, threading, Queue
+
+class stagestats:
+    """
+    Busy time, frames and bytes for each stage of a pipeline, from any
+    thread, for reporting each stage's throughput.
+    """
+    def __init__(self):
+        self.lock=threading.Lock()
+        #stage -> [seconds, frames, bytes]
+        self.stages={}
+        self.order=[]
+        self.start=time.time()
+
+    def __repr__(self):
+        return 'Stage statistics for '+', '.join(self.order)
+
+    def add(self, stage, seconds, frames=1, nbytes=0):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage]=[0.0, 0, 0]
+                self.order.append(stage)
+            s=self.stages[stage]
+            s[0]+=seconds
+            s[1]+=frames
+            s[2]+=nbytes
+
+    def busy(self, stage):
+        with self.lock:
+            return self.stages.get(stage, [0.0])[0]
+
+    def report(self):
+        """
+        A table of each stage's busy time and throughput while busy.
+        """
+        wall=time.time()-self.start
+        lines=['%-12s %8s %9s %9s' % ('Stage', 'Busy s', 'Frames/s', 'Mb/s')]
+        with self.lock:
+            for x in self.order:
+                (seconds, frames, nbytes)=self.stages[x]
+                if x.startswith('wait'):
+                    #Time spent blocked on another stage.
+                    lines.append('%-12s %8.2f' % (x, seconds))
+                    continue
+                rate=frames/seconds if seconds>0 else 0
+                mb='' if not nbytes else '%9.1f' % (nbytes/1048576.0/max(seconds, 1e-9))
+                lines.append('%-12s %8.2f %9.2f %s' % (x, seconds, rate, mb))
+        lines.append('%-12s %8.2f' % ('wall', wall))
+        return '\n'.join(lines)
+
+class prefetcher:
+    """
+    Reads and decodes frames of `names` on background threads, ahead of
+    their use, so the drive and the CPU work at the same time.  PIL
+    releases the GIL while it decodes.
+
+    `advance(lo, hi)` says frames `lo` to `hi`-1 are wanted now: frames
+    before `lo` are dropped, and reading runs up to `depth` frames past
+    `hi`.  `load(name)` returns a decoded frame, waiting if it isn't ready.
+    Callers must not modify the frames they're given.
+
+    EXAMPLE::
+        P=prefetcher(image_list, depth=4)
+        for i in range(N):
+            P.advance(i, i+1)
+            im=P.load(image_list[i])
+        P.close()
+    """
+    def __init__(self, names, depth=4, threads=2, stats=None):
+        self.names=list(names)
+        self.index=dict([ (x, i) for (i, x) in enumerate(self.names) ])
+        self.depth=depth
+        self.stats=stats
+        self.cond=threading.Condition()
+        #name -> decoded image, or the exception decoding it raised.
+        self.images={}
+        self.next=0
+        self.lo=0
+        self.horizon=min(depth, len(self.names))
+        self.closed=False
+        self.threads=[ threading.Thread(target=self.run) for i in range(threads) ]
+        for t in self.threads:
+            t.daemon=True
+            t.start()
+
+    def __repr__(self):
+        return 'Prefetcher, %d of %d frames read' % (self.next, len(self.names))
+
+    def read(self, name):
+        from PIL import Image
+        start=time.time()
+        im=Image.open(name)
+        im.load()
+        if self.stats is not None:
+            self.stats.add('read', time.time()-start, nbytes=os.path.getsize(name))
+        return im
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.closed and self.next>=self.horizon:
+                    self.cond.wait()
+                if self.closed: return
+                i=self.next
+                self.next+=1
+            name=self.names[i]
+            try:
+                im=self.read(name)
+            except Exception, e:
+                im=e
+            with self.cond:
+                if i>=self.lo: self.images[name]=im
+                self.cond.notify_all()
+
+    def advance(self, lo, hi):
+        with self.cond:
+            self.lo=lo
+            for x in self.images.keys():
+                if self.index[x]<lo: del self.images[x]
+            if self.next<lo: self.next=lo
+            self.horizon=min(max(self.horizon, hi+self.depth), len(self.names))
+            self.cond.notify_all()
+
+    def load(self, name):
+        i=self.index[name]
+        start=time.time()
+        with self.cond:
+            if i>=self.horizon:
+                self.horizon=min(i+1, len(self.names))
+                self.cond.notify_all()
+            while name not in self.images:
+                if i<self.next and i<self.lo:
+                    #Dropped already; read it again ourselves.
+                    break
+                self.cond.wait()
+            im=self.images.get(name)
+        if im is None: im=self.read(name)
+        if self.stats is not None:
+            self.stats.add('wait read', time.time()-start)
+        if isinstance(im, Exception): raise im
+        return im
+
+    def close(self):
+        with self.cond:
+            self.closed=True
+            self.images={}
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join()
+
+class writebehind:
+    """
+    Runs saves on a background thread, up to `depth` behind the caller, so
+    encoding and writing a frame overlaps processing the next.  `close`
+    waits for them all, and raises the first error any of them raised.
+
+    EXAMPLE::
+        W=writebehind(depth=2)
+        W.put(im.save, modname)
+        W.close()
+    """
+    def __init__(self, depth=2, stats=None, stage='write'):
+        self.queue=Queue.Queue(maxsize=depth)
+        self.stats=stats
+        self.stage=stage
+        self.error=None
+        self.thread=threading.Thread(target=self.run)
+        self.thread.daemon=True
+        self.thread.start()
+
+    def __repr__(self):
+        return 'Write-behind, %d waiting' % self.queue.qsize()
+
+    def run(self):
+        while True:
+            job=self.queue.get()
+            if job is None: return
+            (fn, args, filename)=job
+            start=time.time()
+            try:
+                fn(*args)
+            except Exception, e:
+                if self.error is None: self.error=e
+                continue
+            if self.stats is not None:
+                nbytes=0
+                if filename is not None and os.path.exists(filename):
+                    nbytes=os.path.getsize(filename)
+                self.stats.add(self.stage, time.time()-start, nbytes=nbytes)
+
+    def put(self, fn, *args, **kwargs):
+        """
+        Queue `fn(*args)`, waiting if `depth` saves are queued already.
+        Pass `filename` to count the bytes it writes.
+        """
+        start=time.time()
+        self.queue.put( (fn, args, kwargs.get('filename')) )
+        if self.stats is not None:
+            self.stats.add('wait write', time.time()-start)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None: raise self.error
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+#Readiness signalling for the boot sequence, in place of fixed sleeps.
+#
+#A component that is up calls `signal(name)`, which writes a small JSON file
+#to /tmp.  Anything that depends on it runs `ready.py --file name` (or
+#`--port N` for a network service), which returns as soon as it is ready.
+#Files left over from before the last boot are ignored.
+
+import os, sys, json, socket, argparse, tempfile, time
+
+def readyfile(name):
+    return os.path.join(tempfile.gettempdir(), 'pipic-'+name+'.ready')
+
+def boottime():
+    """
+    Time the system booted, in seconds since the epoch, or 0 if unknown.
+    """
+    try:
+        f=open('/proc/uptime')
+        uptime=float(f.read().split()[0])
+        f.close()
+    except (IOError, ValueError, IndexError):
+        return 0
+    return time.time()-uptime
+
+def signal(name, **info):
+    """
+    Mark `name` as ready.  Any keyword arguments are saved with it.
+    """
+    info['pid']=os.getpid()
+    info['t']=time.time()
+    filename=readyfile(name)
+    f=open(filename+'.tmp', 'w')
+    json.dump(info, f)
+    f.close()
+    os.rename(filename+'.tmp', filename)
+
+def status(name):
+    """
+    What `name` saved when it signalled readiness this boot, or None.
+    """
+    try:
+        f=open(readyfile(name))
+        info=json.load(f)
+        f.close()
+    except (IOError, ValueError):
+        return None
+    #Allow for clock steps just after boot.
+    if info.get('t', 0)<boottime()-5: return None
+    return info
+
+def listening(port, host='127.0.0.1'):
+    s=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.settimeout(0.5)
+    try:
+        s.connect((host, port))
+    except socket.error:
+        return False
+    finally:
+        s.close()
+    return True
+
+def wait(names=(), ports=(), timeout=120, poll=0.1):
+    """
+    Wait until every name in `names` has signalled and every port in `ports`
+    accepts connections.  Returns False if that takes more than `timeout`
+    seconds.
+    """
+    end=time.time()+timeout
+    names=list(names)
+    ports=list(ports)
+    while True:
+        names=[ x for x in names if status(x) is None ]
+        ports=[ x for x in ports if not listening(x) ]
+        if not names and not ports: return True
+        if time.time()>end: return False
+        time.sleep(poll)
+
+#-------------------------------------------------------------------------------
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Wait for pipic components to be ready.')
+    parser.add_argument('-f', '--file', action='append', default=[], help='Wait for a component to signal readiness, eg. "capture" or "celery".')
+    parser.add_argument('-p', '--port', action='append', default=[], type=int, help='Wait for a local port to accept connections.')
+    parser.add_argument('-t', '--timeout', default=120, type=float, help='Give up after this many seconds.  Default: 120')
+    args=parser.parse_args(argv)
+    if not wait(args.file, args.port, args.timeout):
+        print 'Timed out waiting for', ' '.join(args.file+[ str(x) for x in args.port ])
+        sys.exit(1)
+    return True
+
+#-------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
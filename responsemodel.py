@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+import os, sys, argparse, json, math
+from exposure import ev
+
+#Exposure of the base shot in each brightData.py pair.
+BASESS=10000
+BASEISO=100
+
+class responsemodel:
+    """
+    Brightness response of a camera: how many stops the mean brightness of
+    a shot moves for each stop of exposure, fitted from brightData.py captures.
+
+    The model is a line through log2 brightness against EV,
+        log2(br/basebr) = slope*(ev-baseev) + offset,
+    so the exposure change needed to go from brightness `br` to `target` is
+    about log2(target/br)/slope.  The offset should be close to zero; it is
+    kept as a check on the fit.
+
+    EXAMPLE::
+        M=responsemodel.fit('/home/pi/brdata/')
+        M.save('responsemodel.json')
+        P=exposureplanner(slope=responsemodel.load('responsemodel.json').slope)
+    """
+    def __init__(self, slope=1.0, offset=0.0, samples=0):
+        self.slope=slope
+        self.offset=offset
+        self.samples=samples
+
+    def __repr__(self):
+        return 'Response model: slope %s, offset %s, from %s samples' % (
+            round(self.slope,3), round(self.offset,3), self.samples)
+
+    def stops(self, br, target):
+        """
+        Exposure change, in stops, predicted to take brightness `br` to `target`.
+        """
+        return math.log(1.0*max(target,1)/max(br,1), 2)/self.slope
+
+    def save(self, filename):
+        f=open(filename, 'w')
+        json.dump({'slope': self.slope, 'offset': self.offset,
+                   'samples': self.samples}, f)
+        f.close()
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read a saved model, or return None if there isn't one.
+        """
+        try:
+            f=open(filename)
+            d=json.load(f)
+            f.close()
+        except (IOError, ValueError):
+            return None
+        return cls(d['slope'], d['offset'], d['samples'])
+
+    @classmethod
+    def fit(cls, folder, lo=8, hi=240):
+        """
+        Fit a model to the pairs of shots brightData.py left in `folder`.
+        Pairs where either shot has mean brightness outside [lo, hi] are
+        clipped by the sensor or the noise floor, and are left out.
+        """
+        import numpy as np
+        (base, test, dev)=pairs(folder)
+        if len(base)==0: return None
+        levels=np.arange(256)
+        H=np.array([ histogram(x) for x in base+test ], dtype=float)
+        means=H.dot(levels)/H.sum(axis=1)
+        (mbase, mtest)=(means[:len(base)], means[len(base):])
+        ok=(mbase>lo)&(mbase<hi)&(mtest>lo)&(mtest<hi)
+        if ok.sum()<2: return None
+        A=np.vstack([dev[ok], np.ones(ok.sum())]).T
+        y=np.log2(mtest[ok]/mbase[ok])
+        ((slope, offset), _, _, _)=np.linalg.lstsq(A, y, rcond=-1)
+        return cls(float(slope), float(offset), int(ok.sum()))
+
+#-------------------------------------------------------------------------------
+
+def histogram(filename):
+    from PIL import Image
+    return Image.open(filename).convert('L').histogram()
+
+def pairs(folder):
+    """
+    Find the (base, test) shot pairs in `folder`.  Returns the two lists of
+    filenames, and an array of the test shots' exposures in stops relative
+    to their base shots.
+    """
+    import numpy as np
+    if folder[-1]!='/': folder+='/'
+    names=set(os.listdir(folder))
+    base=[]
+    test=[]
+    dev=[]
+    for x in sorted(names):
+        #Test shots are named host_date_time_ss_iso.jpg
+        parts=x[:-4].split('_')
+        if x[-4:]!='.jpg' or len(parts)<5 or parts[-1]=='base': continue
+        try:
+            (ss, iso)=(int(parts[-2]), int(parts[-1]))
+        except ValueError:
+            continue
+        b='_'.join(parts[:-2])+'_base.jpg'
+        if b not in names: continue
+        base.append(folder+b)
+        test.append(folder+x)
+        dev.append(ev(ss, iso)-ev(BASESS, BASEISO))
+    return (base, test, np.array(dev))
+
+#-------------------------------------------------------------------------------
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Fit a camera brightness response from brightData.py captures.')
+    parser.add_argument( '-d', '--data', default='/home/pi/brdata/', type=str, help='Folder of brightData.py captures.  Default: /home/pi/brdata/' )
+    parser.add_argument( '-o', '--output', default='responsemodel.json', type=str, help='Model file to write.  Default: responsemodel.json' )
+    args=parser.parse_args()
+
+    M=responsemodel.fit(args.data)
+    if M is None:
+        print 'Not enough usable captures in', args.data
+        return False
+    print M
+    M.save(args.output)
+    return True
+
+#-------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -0,0 +1,223 @@
+import os, time, socket, select
+
+class stopchannel:
+    """
+    A unix datagram socket that a sleeping capture loop listens on, so that
+    a stop request wakes it at once rather than after the interval.
+
+    EXAMPLE::
+        C=stopchannel('/tmp/pipic-stop.sock')
+        if C.wait(15): print 'Stopped'
+        ...
+        stop('/tmp/pipic-stop.sock')    #From another process.
+    """
+    def __init__(self, path):
+        self.path=path
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self.sock=socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.stopped=False
+
+    def __repr__(self):
+        return 'Stop channel '+self.path
+
+    def wait(self, seconds):
+        """
+        Sleep for up to `seconds`.  Returns True, straight away, if a stop
+        request arrives.
+        """
+        if self.stopped: return True
+        (r, w, x)=select.select([self.sock], [], [], max(seconds, 0))
+        if r:
+            self.sock.recv(16)
+            self.stopped=True
+        return self.stopped
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def stop(path):
+    """
+    Wake the capture loop listening on `path` and tell it to stop.  Returns
+    False if nothing is listening.
+    """
+    s=socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        s.sendto('stop', path)
+    except socket.error:
+        return False
+    finally:
+        s.close()
+    return True
+
+class _job:
+    def __init__(self, fn, args, name, priority, critical, order):
+        self.fn=fn
+        self.args=args
+        self.name=name
+        self.priority=priority
+        self.critical=critical
+        self.order=order
+        self.steps=None
+
+    def step(self):
+        """
+        Run one slice of the job.  Returns True when the job is finished.
+        """
+        if self.steps is None:
+            result=self.fn(*self.args)
+            if not hasattr(result, 'next'): return True
+            self.steps=result
+        try:
+            self.steps.next()
+        except StopIteration:
+            return True
+        return False
+
+class backgroundscheduler:
+    """
+    Runs background work (HDR merges, thumbnails, deflicker...) in the gaps
+    between captures, without letting it delay the next capture or overheat
+    the Pi.
+
+    The capture loop calls `idle(deadline)` instead of sleeping until its next
+    shot.  Jobs run there, lowest `priority` first, and only when the slice
+    about to run is expected to finish `guard` seconds before the deadline;
+    otherwise they wait for the next gap.  A job that returns a generator is
+    run one `next()` at a time, so long work should yield often.
+
+    Above `hot` degrees C, or `busy` CPU load, work is duty-cycled, resting
+    after each slice for longer the hotter it gets.  At `critical` degrees,
+    only jobs submitted as critical run at all.
+
+    `clock`, `sleep` and `sensor` can be replaced for simulation; `sensor`
+    returns (temperature or None, CPU load from 0 to 1).  If `sleep` returns
+    True, as `stopchannel.wait` does on a stop request, `idle` returns at
+    once and `stopped` is set.
+
+    EXAMPLE::
+        S=backgroundscheduler()
+        S.submit(MergeHDRStack, (filenames, output), name='merge')
+        S.idle(loopstart+interval)
+    """
+    def __init__(self, hot=70.0, critical=80.0, busy=0.9, guard=1.0, guess=0.5,
+                 clock=time.time, sleep=time.sleep, sensor=None):
+        self.hot=hot
+        self.critical=critical
+        self.busy=busy
+        self.guard=guard
+        self.guess=guess
+        self.clock=clock
+        self.sleep=sleep
+        if sensor is None: sensor=self.sysmetrics
+        self.sensor=sensor
+        self.jobs=[]
+        self.submitted=0
+        #Running estimate of each job's slice time, by name.
+        self.estimates={}
+        self.metrics=None
+        self.lastsample=None
+        self.stopped=False
+
+    def __repr__(self):
+        return 'Background scheduler, %d jobs waiting' % len(self.jobs)
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def sysmetrics(self):
+        """
+        Temperature and load from /proc and /sys, sampled at most once a second.
+        """
+        if self.metrics is None:
+            #Only once there's work to do, to keep numpy out of startup.
+            from sysmetrics import sysmetrics
+            self.metrics=sysmetrics(size=60)
+        now=self.clock()
+        if self.lastsample is None or now-self.lastsample[0]>=1.0:
+            d=self.metrics.sample()
+            self.lastsample=(now, d['temp'], d['cpu'])
+        return self.lastsample[1:]
+
+    def submit(self, fn, args=(), name=None, priority=10, critical=False):
+        """
+        Queue `fn(*args)` to run between captures.
+        """
+        if name is None: name=getattr(fn, '__name__', 'job')
+        self.jobs.append(_job(fn, args, name, priority, critical, self.submitted))
+        self.submitted+=1
+
+    def rest(self, seconds):
+        if self.sleep(seconds): self.stopped=True
+        return self.stopped
+
+    def estimate(self, name):
+        return self.estimates.get(name, self.guess)
+
+    def duty(self, temp, load):
+        """
+        Fraction of the time we may spend working, from 0 to 1.
+        """
+        duty=1.0
+        if temp is not None and temp>self.hot:
+            duty=max(0.0, (self.critical-temp)/(self.critical-self.hot))
+        if load>self.busy:
+            duty=min(duty, 0.5)
+        return duty
+
+    def idle(self, deadline):
+        """
+        Run background work until `deadline`, then return.  Returns the number
+        of slices run.
+        """
+        ran=0
+        while not self.stopped:
+            slack=deadline-self.clock()
+            if slack<=0: return ran
+            if not self.jobs: break
+            (temp, load)=self.sensor()
+            duty=self.duty(temp, load)
+            jobs=self.jobs
+            if duty<=0:
+                jobs=[ j for j in jobs if j.critical ]
+            job=None
+            for j in jobs:
+                if slack-self.guard<self.estimate(j.name): continue
+                if job is None or (j.priority, j.order)<(job.priority, job.order):
+                    job=j
+            if job is None:
+                #Nothing fits before the deadline, or we're too hot; cool off.
+                if duty<=0:
+                    self.rest(min(slack, 1.0))
+                    continue
+                break
+            start=self.clock()
+            done=job.step()
+            took=self.clock()-start
+            ran+=1
+            if job.name in self.estimates:
+                self.estimates[job.name]=max(took, 0.8*self.estimates[job.name]+0.2*took)
+            else:
+                self.estimates[job.name]=took
+            if done: self.jobs.remove(job)
+            if 0<duty<1:
+                rest=took*(1-duty)/duty
+                self.rest(max(0, min(rest, deadline-self.clock())))
+        if deadline!=float('inf') and not self.stopped:
+            self.rest(max(0, deadline-self.clock()))
+        return ran
+
+    def drain(self):
+        """
+        Run everything still queued, eg. when the timelapse ends, even if
+        it ended on a stop request.
+        """
+        self.stopped=False
+        return self.idle(float('inf'))
@@ -0,0 +1,117 @@
+import os, json
+
+class brightnesstracker:
+    """
+    Constant-time smoothing of shot brightness.
+
+    Options:
+        `mode` : 'ema' for an exponential moving average, or 'window' for the
+            mean of the last `width` shots.
+        `width` : Number of shots in the window.
+        `alpha` : Weight of the newest shot in the exponential average.
+        `initial` : Starting brightness.  If None, the first shot is used.
+
+    The state is a plain dict (see `state` and `fromstate`), so a restarted
+    timelapse can carry on smoothing where it left off.
+
+    EXAMPLE::
+        S=brightnesstracker('ema', alpha=0.1, initial=128)
+        avgbr=S.add(lastbr)
+        S.save('smoothing.json')
+        S=brightnesstracker.load('smoothing.json')
+    """
+    def __init__(self, mode='window', width=20, alpha=0.1, initial=None):
+        if mode not in ('ema', 'window'):
+            raise ValueError('Unknown smoothing mode: '+str(mode))
+        self.mode=mode
+        self.width=width
+        self.alpha=alpha
+        self.ring=[]
+        self.index=0
+        self.total=0.0
+        self.value=None
+        if initial is not None: self.add(initial)
+
+    def __repr__(self):
+        return 'Brightness tracker (%s): %s' % (self.mode, self.value)
+
+    def add(self, br):
+        """
+        Add the brightness of a new shot, returning the smoothed brightness.
+        """
+        if self.mode=='ema':
+            if self.value is None:
+                self.value=float(br)
+            else:
+                self.value=self.alpha*br+(1.0-self.alpha)*self.value
+            self.ring=[br]
+            return self.value
+        if len(self.ring)<self.width:
+            self.ring.append(br)
+            self.total+=br
+        else:
+            self.total+=br-self.ring[self.index]
+            self.ring[self.index]=br
+            self.index=(self.index+1)%self.width
+            #Re-sum once per lap so float error can't build up.
+            if self.index==0: self.total=float(sum(self.ring))
+        self.value=self.total/len(self.ring)
+        return self.value
+
+    def state(self):
+        return {
+            'mode'  : self.mode,
+            'width' : self.width,
+            'alpha' : self.alpha,
+            'ring'  : self.ring,
+            'index' : self.index,
+            'value' : self.value,
+        }
+
+    @classmethod
+    def fromstate(cls, state):
+        S=cls(state['mode'], width=state['width'], alpha=state['alpha'])
+        S.ring=list(state['ring'])
+        S.index=state['index']
+        S.total=float(sum(S.ring))
+        S.value=state['value']
+        return S
+
+    def save(self, filename):
+        """
+        Write the state to `filename`, atomically.
+        """
+        tmp=filename+'.tmp'
+        f=open(tmp, 'w')
+        json.dump(self.state(), f)
+        f.close()
+        os.rename(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read a tracker saved with `save`, or return None if there isn't one.
+        """
+        try:
+            f=open(filename)
+            S=cls.fromstate(json.load(f))
+            f.close()
+        except (IOError, ValueError, KeyError):
+            return None
+        return S
+
+def windowmean(a, radius):
+    """
+    Mean of each of a sequence of arrays, stacked along the first axis of
+    `a`, with up to `radius` neighbours either side, in one pass.  Windows
+    are cut short at the ends of the sequence.
+    """
+    import numpy as np
+    a=np.asarray(a, dtype=np.float64)
+    N=a.shape[0]
+    S=np.concatenate([np.zeros((1,)+a.shape[1:]), np.cumsum(a, axis=0)])
+    i=np.arange(N)
+    lo=np.maximum(i-radius, 0)
+    hi=np.minimum(i+radius+1, N)
+    count=(hi-lo).reshape((N,)+(1,)*(a.ndim-1))
+    return (S[hi]-S[lo])/count
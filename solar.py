@@ -0,0 +1,85 @@
+import math, time
+
+#Approximate illuminance (lux) on open ground against sun elevation (degrees),
+#from deep twilight to the sun overhead.
+ILLUMINANCE=[
+    (-18, 0.0007),
+    (-12, 0.008),
+    (-6, 3.4),
+    (0, 400.0),
+    (5, 4000.0),
+    (10, 10000.0),
+    (20, 25000.0),
+    (30, 45000.0),
+    (60, 90000.0),
+    (90, 110000.0),
+]
+
+def elevation(lat, lon, t=None):
+    """
+    Elevation of the sun in degrees, at latitude `lat` and longitude `lon`
+    (degrees, east positive) and unix time `t`.  Uses the NOAA fractional-year
+    approximation, which is good to a fraction of a degree.
+    """
+    if t is None: t=time.time()
+    g=time.gmtime(t)
+    hour=g.tm_hour+g.tm_min/60.0+g.tm_sec/3600.0
+    y=2*math.pi/365*(g.tm_yday-1+(hour-12)/24.0)
+    eqtime=229.18*(0.000075+0.001868*math.cos(y)-0.032077*math.sin(y)
+                   -0.014615*math.cos(2*y)-0.040849*math.sin(2*y))
+    decl=(0.006918-0.399912*math.cos(y)+0.070257*math.sin(y)
+          -0.006758*math.cos(2*y)+0.000907*math.sin(2*y)
+          -0.002697*math.cos(3*y)+0.00148*math.sin(3*y))
+    #True solar time, in minutes, and the hour angle.
+    tst=hour*60+eqtime+4*lon
+    ha=math.radians(tst/4-180)
+    phi=math.radians(lat)
+    cosz=math.sin(phi)*math.sin(decl)+math.cos(phi)*math.cos(decl)*math.cos(ha)
+    cosz=max(min(cosz,1.0),-1.0)
+    return 90-math.degrees(math.acos(cosz))
+
+def lightlevel(elev):
+    """
+    Expected scene brightness, in stops (log2 lux), for a sun elevation.
+    """
+    if elev<=ILLUMINANCE[0][0]: return math.log(ILLUMINANCE[0][1],2)
+    for i in range(1,len(ILLUMINANCE)):
+        (e1, l1)=ILLUMINANCE[i]
+        if elev<=e1:
+            (e0, l0)=ILLUMINANCE[i-1]
+            x=(elev-e0)/(e1-e0)
+            return (1-x)*math.log(l0,2)+x*math.log(l1,2)
+    return math.log(ILLUMINANCE[-1][1],2)
+
+class lightmodel:
+    """
+    Predicts how scene brightness changes over the day from the position of
+    the sun, for feed-forward exposure control.  Needs no network; only the
+    location and the clock.
+
+    EXAMPLE::
+        M=lightmodel(43.65, -79.38)
+        stops=M.change(time.time(), time.time()+interval)
+    """
+    def __init__(self, lat, lon):
+        self.lat=lat
+        self.lon=lon
+
+    def __repr__(self):
+        return 'Light model at (%s, %s)' % (self.lat, self.lon)
+
+    def level(self, t=None):
+        return lightlevel(elevation(self.lat, self.lon, t))
+
+    def change(self, t0, t1):
+        """
+        Predicted change in scene brightness, in stops, from `t0` to `t1`.
+        """
+        return self.level(t1)-self.level(t0)
+
+    def factor(self, t0, t1):
+        """
+        Factor to apply to the exposure at `t0` to keep the same image
+        brightness at `t1`.
+        """
+        return 2.0**(-self.change(t0, t1))
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+
+import os, sys, argparse, json, subprocess, tempfile, shutil, time
+import ready
+
+ROOT=os.path.dirname(os.path.abspath(__file__))
+DJANGO=os.path.join(ROOT, 'djpilapse')
+
+#Each import is timed in a fresh interpreter, so nothing is cached from the
+#one before.  Times include whatever the module imports in turn.
+IMPORTS=[
+    ('numpy',     ROOT,   'import numpy'),
+    ('PIL',       ROOT,   'from PIL import Image'),
+    ('picamera',  ROOT,   'import picamera'),
+    ('timelapse', ROOT,   'import timelapse'),
+    ('django',    DJANGO, 'from django.conf import settings; settings.INSTALLED_APPS'),
+    ('models',    DJANGO, 'import djpilapp.models'),
+    ('celery',    DJANGO, 'import celery'),
+    ('capture',   DJANGO, 'import djpilapp.capture'),
+    ('tasks',     DJANGO, 'import djpilapp.tasks'),
+    ('views',     DJANGO, 'import djpilapp.views'),
+]
+
+TIMER="""import os, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djpilapse.settings')
+t=time.time()
+%s
+print time.time()-t
+"""
+
+def importtime(cwd, statement):
+    """
+    Seconds to run `statement` in a fresh interpreter, or None if it fails.
+    """
+    p=subprocess.Popen([sys.executable, '-c', TIMER % statement], cwd=cwd,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (out, err)=p.communicate()
+    if p.returncode!=0: return None
+    return float(out.strip().split('\n')[-1])
+
+#What bootlapse.py does up to the first frame, short of the camera and the
+#database: it should get there without loading any of HEAVY.
+HEAVY=['numpy', 'celery']
+
+BOOTPATH="""import os, sys, json, tempfile, shutil
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djpilapse.settings')
+os.environ['PILAPSE_NO_CELERY']='1'
+from djpilapp import capture
+from exposure import exposureplanner
+folder=tempfile.mkdtemp()+'/'
+L=capture.get_tracer()
+with L.stage('meter'):
+    exposureplanner().step(5000, 100, 128, 100.0)
+capture.get_scheduler().idle(0)
+capture.get_framelog(folder).add(folder+'pipic.jpg', size=0, ss=5000, iso=100, brightness=100.0)
+capture.get_exposurelog(folder, writer=True).append(5000, 100, 100.0, 100.0)
+L.shot()
+shutil.rmtree(folder)
+print json.dumps([ x for x in %r if x in sys.modules ])
+"""
+
+def bootimports(heavy=HEAVY):
+    """
+    The modules of `heavy` that the boot path has loaded by the time of its
+    first frame, in a fresh interpreter, or None if it fails.
+    """
+    p=subprocess.Popen([sys.executable, '-c', BOOTPATH % (list(heavy),)], cwd=DJANGO,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (out, err)=p.communicate()
+    if p.returncode!=0: return None
+    return json.loads(out.strip().split('\n')[-1])
+
+#Background task runners: how to start each, and the name it signals
+#readiness with (see ready.py).
+RUNNERS=[
+    ('celery', DJANGO, ['celery', '-A', 'djpilapse', 'worker', '-l', 'warning'], 'celery'),
+    ('runner', DJANGO, [sys.executable, '-m', 'djpilapp.runner'], 'runner'),
+]
+
+def rss(pid):
+    """
+    Resident memory of process `pid` and all its children, in bytes.
+    """
+    procs={}
+    for x in os.listdir('/proc'):
+        if not x.isdigit(): continue
+        try:
+            f=open('/proc/'+x+'/status')
+            status=dict([ line.split(':', 1) for line in f if ':' in line ])
+            f.close()
+        except IOError:
+            continue
+        kb=int(status.get('VmRSS', '0 kB').split()[0])
+        procs[int(x)]=(int(status['PPid']), kb*1024, status['Name'].strip())
+    family=set([pid])
+    for i in range(8):
+        family|=set([ x for x in procs if procs[x][0] in family ])
+    return sum([ procs[x][1] for x in family if x in procs ])
+
+def brokerrss():
+    """
+    Resident memory of a running RabbitMQ broker, in bytes, or 0.
+    """
+    total=0
+    for x in os.listdir('/proc'):
+        if not x.isdigit(): continue
+        try:
+            f=open('/proc/'+x+'/cmdline')
+            cmd=f.read()
+            f.close()
+        except IOError:
+            continue
+        if 'rabbit' in cmd and ('beam' in cmd or 'epmd' in cmd):
+            total+=rss(int(x))
+    return total
+
+def runnertime(cwd, command, name, timeout=120):
+    """
+    Seconds for a task runner to come up, and its memory once it has, or
+    None if it doesn't start.
+    """
+    try:
+        os.remove(ready.readyfile(name))
+    except OSError:
+        pass
+    t=time.time()
+    try:
+        p=subprocess.Popen(command, cwd=cwd, stdout=open(os.devnull, 'w'),
+                           stderr=subprocess.STDOUT)
+    except OSError:
+        return None
+    up=ready.wait([name], timeout=timeout)
+    t=time.time()-t
+    memory=rss(p.pid)
+    if p.poll() is None:
+        p.terminate()
+        p.wait()
+    if not up: return None
+    return (t, memory)
+
+def timed(fn, *args):
+    t=time.time()
+    fn(*args)
+    return time.time()-t
+
+def inittimes(folder):
+    """
+    Seconds to set up each of the capture loop's components on `folder`.
+    """
+    from framelog import framelog
+    from exposurelog import exposurelog
+    from thumbcache import thumbcache
+    from checkpoint import checkpoint
+    from smoothing import brightnesstracker
+    from sysmetrics import sysmetrics
+    if folder[-1]!='/': folder+='/'
+    results=[
+        ('framelog',   timed(framelog, folder)),
+        ('exposurelog', timed(lambda: len(exposurelog(folder)))),
+        ('thumbcache', timed(thumbcache, folder+'thumbs/')),
+        ('checkpoint', timed(checkpoint(folder+'checkpoint.json').read)),
+        ('tracker',    timed(brightnesstracker, 'window')),
+        ('sysmetrics', timed(lambda: sysmetrics().sample())),
+    ]
+    try:
+        import picamera
+    except ImportError:
+        return results
+    def camera():
+        C=picamera.PiCamera()
+        C.close()
+    results.append( ('camera', timed(camera)) )
+    return results
+
+#-------------------------------------------------------------------------------
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time the startup of each pipic component.')
+    parser.add_argument('-f', '--folder', default='/media/Usb-Drive/Timelapse/', type=str, help='Timelapse folder to load the catalogues from.  A scratch folder is used if it does not exist.')
+    parser.add_argument('-r', '--runners', action='store_true', help='Also compare the start up time and memory of the Celery worker and the built-in task runner.')
+    parser.add_argument('-o', '--output', default=None, type=str, help='Also write the results to this JSON file.')
+    args=parser.parse_args(argv)
+
+    results={'import': [], 'init': []}
+    print 'Imports (fresh interpreter each):'
+    for (name, cwd, statement) in IMPORTS:
+        t=importtime(cwd, statement)
+        results['import'].append( (name, t) )
+        if t is None:
+            print '  %-12s   unavailable' % name
+        else:
+            print '  %-12s %7.3f s' % (name, t)
+
+    loaded=bootimports()
+    results['bootimports']=loaded
+    if loaded is None:
+        print 'Boot path unavailable'
+    elif loaded:
+        print 'Boot path loads', ', '.join(loaded), 'before the first frame.'
+    else:
+        print 'Boot path loads none of', ', '.join(HEAVY), 'before the first frame.'
+
+    scratch=None
+    folder=args.folder
+    if not os.path.isdir(folder):
+        scratch=folder=tempfile.mkdtemp()
+    print 'Initialisation, on', folder+':'
+    for (name, t) in inittimes(folder):
+        results['init'].append( (name, t) )
+        print '  %-12s %7.1f ms' % (name, 1000*t)
+    if scratch is not None: shutil.rmtree(scratch)
+
+    if args.runners:
+        results['runners']=[]
+        print 'Task runners, until ready:'
+        for (name, cwd, command, readyname) in RUNNERS:
+            r=runnertime(cwd, command, readyname)
+            results['runners'].append( (name, r) )
+            if r is None:
+                print '  %-12s   unavailable' % name
+            else:
+                print '  %-12s %7.3f s %7.1f Mb' % (name, r[0], r[1]/1048576.0)
+        results['broker']=brokerrss()
+        if results['broker']:
+            print '  %-12s           %7.1f Mb' % ('rabbitmq', results['broker']/1048576.0)
+
+    capture=ready.status('capture')
+    if capture is not None:
+        boot=ready.boottime()
+        results['firstframe']=capture['t']-boot
+        print 'First frame %.1f s after boot, %.1f s after the capture daemon started.' % (
+            capture['t']-boot, capture['firstframe'])
+
+    if args.output is not None:
+        f=open(args.output, 'w')
+        json.dump(results, f, indent=1)
+        f.close()
+    return True
+
+#-------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -0,0 +1,163 @@
+import os, threading
+import numpy as np
+from time import time, sleep
+
+#One sample of the system's state.
+SAMPLE=np.dtype([
+    ('t', '<f8'),           #Seconds since the epoch.
+    ('cpu', '<f4'),         #Fraction of CPU time busy since the last sample.
+    ('temp', '<f4'),        #SoC temperature in degrees C, or NaN.
+    ('memtotal', '<i8'),    #Bytes.
+    ('memavail', '<i8'),
+    ('disktotal', '<i8'),
+    ('diskfree', '<i8'),
+])
+
+class sysmetrics:
+    """
+    Samples CPU load, temperature, memory and disk space by reading the kernel's
+    files directly, rather than running `vcgencmd`, `free`, `top` and `df`.
+
+    Samples go into a ring of the last `size`.  `proc` and `sys` can point at
+    fixture trees for testing.
+
+    EXAMPLE::
+        M=sysmetrics()
+        M.start(interval=5)
+        M.latest()['temp']
+        print M.text()
+    """
+    def __init__(self, size=720, proc='/proc', sys='/sys', disk='/'):
+        self.ring=np.zeros(size, dtype=SAMPLE)
+        self.count=0
+        self.proc=proc
+        self.sys=sys
+        self.disk=disk
+        self.lastcpu=None
+        self.thread=None
+        self.lock=threading.Lock()
+
+    def __repr__(self):
+        return 'System metrics, %d samples' % min(self.count, len(self.ring))
+
+    def cpu(self):
+        """
+        Fraction of CPU time spent busy since the last call; since boot the
+        first time.
+        """
+        f=open(os.path.join(self.proc, 'stat'))
+        fields=[ int(x) for x in f.readline().split()[1:] ]
+        f.close()
+        #user nice system idle iowait irq softirq steal ...
+        idle=fields[3]+(fields[4] if len(fields)>4 else 0)
+        total=sum(fields[:8])
+        if self.lastcpu is None:
+            (lastidle, lasttotal)=(0, 0)
+        else:
+            (lastidle, lasttotal)=self.lastcpu
+        self.lastcpu=(idle, total)
+        if total==lasttotal: return 0.0
+        return 1.0-float(idle-lastidle)/(total-lasttotal)
+
+    def memory(self):
+        """
+        Total and available memory, in bytes.
+        """
+        info={}
+        f=open(os.path.join(self.proc, 'meminfo'))
+        for line in f:
+            parts=line.split()
+            if len(parts)>=2: info[parts[0].rstrip(':')]=int(parts[1])*1024
+        f.close()
+        if 'MemAvailable' in info:
+            avail=info['MemAvailable']
+        else:
+            #Older kernels don't estimate it for us.
+            avail=sum([ info.get(x, 0) for x in ('MemFree', 'Buffers', 'Cached') ])
+        return (info['MemTotal'], avail)
+
+    def temperature(self):
+        """
+        SoC temperature in degrees C, or None if there's no thermal zone.
+        """
+        try:
+            f=open(os.path.join(self.sys, 'class/thermal/thermal_zone0/temp'))
+            temp=int(f.read().strip())/1000.0
+            f.close()
+        except (IOError, ValueError):
+            return None
+        return temp
+
+    def diskspace(self):
+        """
+        Total and free bytes on the disk holding `disk`.
+        """
+        s=os.statvfs(self.disk)
+        return (s.f_frsize*s.f_blocks, s.f_frsize*s.f_bavail)
+
+    def sample(self, t=None):
+        """
+        Take a sample, store it in the ring and return it.
+        """
+        if t is None: t=time()
+        temp=self.temperature()
+        if temp is None: temp=np.nan
+        (memtotal, memavail)=self.memory()
+        (disktotal, diskfree)=self.diskspace()
+        with self.lock:
+            rec=self.ring[self.count%len(self.ring)]
+            (rec['t'], rec['cpu'], rec['temp'])=(t, self.cpu(), temp)
+            (rec['memtotal'], rec['memavail'])=(memtotal, memavail)
+            (rec['disktotal'], rec['diskfree'])=(disktotal, diskfree)
+            self.count+=1
+        return self.latest()
+
+    def samples(self):
+        """
+        The samples in the ring, oldest first.
+        """
+        with self.lock:
+            n=len(self.ring)
+            if self.count<=n: return self.ring[:self.count].copy()
+            i=self.count%n
+            return np.concatenate((self.ring[i:], self.ring[:i]))
+
+    def latest(self):
+        """
+        The newest sample as a dict, or None if there are no samples yet.
+        """
+        with self.lock:
+            if self.count==0: return None
+            rec=self.ring[(self.count-1)%len(self.ring)]
+            d=dict([ (x, rec[x].item()) for x in SAMPLE.names ])
+        if np.isnan(d['temp']): d['temp']=None
+        return d
+
+    def text(self):
+        """
+        The newest sample, and the temperature range over the ring, as
+        `name value` lines.
+        """
+        d=self.latest()
+        if d is None: return ''
+        S=self.samples()
+        lines=[ 'pipic_%s %s' % (x, d[x]) for x in SAMPLE.names if d[x] is not None ]
+        temps=S['temp'][~np.isnan(S['temp'])]
+        if len(temps):
+            lines.append('pipic_temp_min %s' % temps.min())
+            lines.append('pipic_temp_max %s' % temps.max())
+        lines.append('pipic_samples %d' % len(S))
+        return '\n'.join(lines)+'\n'
+
+    def start(self, interval=5):
+        """
+        Sample every `interval` seconds in a background thread.
+        """
+        if self.thread is not None: return
+        def run():
+            while True:
+                self.sample()
+                sleep(interval)
+        self.thread=threading.Thread(target=run)
+        self.thread.daemon=True
+        self.thread.start()
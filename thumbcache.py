@@ -0,0 +1,206 @@
+import os, fcntl, hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+#Thumbnail sizes, largest first.  Each level is made from the one before it.
+SIZES=OrderedDict([ ('medium', (640,480)), ('small', (160,120)) ])
+
+class thumbcache:
+    """
+    Content-addressed thumbnail cache.
+
+    Every frame added to the cache is reduced to a pyramid of thumbnails (see
+    `SIZES`), stored as `folder/ab/abcdef..._small.jpg`, where the key is the
+    sha1 of the frame's encoded JPEG data.  The cache, index and all, is kept
+    under `budget` bytes by evicting the least recently used thumbnails.
+
+    `index.txt` in the cache folder lists the frames in the order they were
+    added, as `key<TAB>source` lines; the gallery pages through it.  Once a
+    frame's thumbnails are all evicted, a `-<TAB>key` line drops it again,
+    and the index is rewritten when dropped frames outnumber the rest.
+
+    EXAMPLE::
+        C=thumbcache('/media/Usb-Drive/Timelapse/thumbs')
+        key=C.add(im, stream.getvalue(), filename)
+        C.get(key, 'small')
+    """
+    def __init__(self, folder, budget=64*1024*1024, quality=75, sizes=None):
+        if folder[-1]!='/': folder+='/'
+        self.folder=folder
+        self.budget=budget
+        self.quality=quality
+        if sizes is None: sizes=SIZES.keys()
+        self.sizes=[ x for x in SIZES if x in sizes ]
+        try:
+            os.listdir(self.folder)
+        except:
+            os.makedirs(self.folder)
+        #(key, size) -> (bytes, mtime), least recently used first.
+        self.lru=OrderedDict()
+        self.total=0
+        self.index=self.folder+'index.txt'
+        self.resetindex()
+        self.scan()
+        self.refresh()
+
+    def __repr__(self):
+        return 'Thumbnail cache at '+self.folder
+
+    def scan(self):
+        """
+        Build the LRU index from the files on disk.  Only done once, at startup.
+        """
+        found=[]
+        for d in os.listdir(self.folder):
+            if len(d)!=2 or not os.path.isdir(self.folder+d): continue
+            for x in os.listdir(self.folder+d):
+                if x[-4:]!='.jpg': continue
+                (key,size)=x[:-4].rsplit('_',1)
+                s=os.stat(self.folder+d+'/'+x)
+                found.append( (s.st_mtime, key, size, s.st_size) )
+        found.sort()
+        for (mtime, key, size, nbytes) in found:
+            self.lru[(key,size)]=(nbytes, mtime)
+            self.total+=nbytes
+
+    def resetindex(self):
+        #key -> source, in the order added.
+        self.sources=OrderedDict()
+        self.dropped=0
+        self.indexpos=0
+        self.indexsize=0
+        self.inode=None
+
+    def refresh(self):
+        """
+        Read any changes made to the index by another process.  Returns a
+        list of (key, source) for the frames in the cache, oldest first.
+        """
+        try:
+            f=open(self.index)
+        except IOError:
+            return []
+        s=os.fstat(f.fileno())
+        if s.st_ino!=self.inode or s.st_size<self.indexpos:
+            #Compacted by someone else; start over.
+            self.resetindex()
+            self.inode=s.st_ino
+        f.seek(self.indexpos)
+        for line in f:
+            if line[-1]!='\n': break
+            self.indexpos+=len(line)
+            (key, source)=line[:-1].split('\t',1)
+            if key=='-':
+                if self.sources.pop(source, None) is not None: self.dropped+=1
+            else:
+                self.sources[key]=source
+        f.close()
+        self.indexsize=self.indexpos
+        return self.sources.items()
+
+    @contextmanager
+    def lock(self):
+        f=open(self.index+'.lock', 'a')
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            f.close()
+
+    def appendindex(self, lines):
+        with self.lock():
+            f=open(self.index, 'a')
+            for line in lines:
+                f.write(line+'\n')
+            f.close()
+        self.refresh()
+
+    def compact(self, force=False):
+        """
+        Rewrite the index without dropped frames, once they outnumber the
+        rest.
+        """
+        if self.dropped<=max(len(self.sources), 64) and not force: return False
+        with self.lock():
+            self.refresh()
+            tmp=self.index+'.tmp'
+            f=open(tmp, 'w')
+            for (key, source) in self.sources.items():
+                f.write(key+'\t'+source+'\n')
+            f.close()
+            os.rename(tmp, self.index)
+        self.resetindex()
+        self.refresh()
+        return True
+
+    def key(self, data):
+        return hashlib.sha1(data).hexdigest()
+
+    def path(self, key, size):
+        return self.folder+key[:2]+'/'+key+'_'+size+'.jpg'
+
+    def add(self, im, data, source=''):
+        """
+        Make thumbnails of the PIL image `im`, keyed on its encoded bytes `data`.
+        Returns the key.
+        """
+        import Image
+        key=self.key(data)
+        if (key, self.sizes[-1]) in self.lru: return key
+        try:
+            os.mkdir(self.folder+key[:2])
+        except OSError:
+            pass
+        t=im
+        for size in self.sizes:
+            t=t.copy()
+            t.thumbnail(SIZES[size], Image.ANTIALIAS)
+            t.save(self.path(key,size), quality=self.quality)
+            s=os.stat(self.path(key,size))
+            self.lru[(key,size)]=(s.st_size, s.st_mtime)
+            self.total+=s.st_size
+        self.appendindex([key+'\t'+source])
+        self.evict()
+        return key
+
+    def get(self, key, size='small'):
+        """
+        Return the path of a thumbnail, or None if it isn't cached.
+        """
+        path=self.path(key,size)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        if (key,size) in self.lru:
+            (nbytes, mtime)=self.lru.pop((key,size))
+            self.lru[(key,size)]=(nbytes, os.stat(path).st_mtime)
+        return path
+
+    def evict(self):
+        """
+        Remove least recently used thumbnails until we are under budget.
+        Thumbnails touched by another process since we last saw them get a
+        second chance.
+        """
+        gone=[]
+        while self.total+self.indexsize>self.budget and len(self.lru)>1:
+            ((key,size), (nbytes, mtime))=self.lru.popitem(last=False)
+            path=self.path(key,size)
+            try:
+                newmtime=os.stat(path).st_mtime
+            except OSError:
+                newmtime=None
+            if newmtime is not None and newmtime>mtime:
+                self.lru[(key,size)]=(nbytes, newmtime)
+                continue
+            if newmtime is not None: os.remove(path)
+            self.total-=nbytes
+            if not [ x for x in self.sizes if (key, x) in self.lru ]: gone.append(key)
+        #Drop frames with no thumbnails left from the index.
+        self.refresh()
+        gone=[ x for x in gone if x in self.sources ]
+        if gone:
+            self.appendindex([ '-\t'+x for x in gone ])
+            self.compact()
@@ -1,13 +1,22 @@
 #!/usr/bin/python
 
-import Image
 import os, sys, argparse
 import subprocess
 import time
-import io, picamera
+import io
 from fractions import Fraction
 from datetime import datetime
-from MergeHDRStack import MergeHDRStack
+from thumbcache import thumbcache
+from framelog import framelog
+from exposurelog import exposurelog
+from smoothing import brightnesstracker
+from solar import lightmodel
+from exposure import exposureplanner
+from responsemodel import responsemodel
+from tracing import tracer
+from scheduler import backgroundscheduler
+from checkpoint import checkpoint
+from trigger import waituntil, PORT, REPLYPORT
 
 class timelapse:
     """
@@ -25,6 +34,24 @@ class timelapse:
             are more than `maxdelta` from `targetBrightness`.  Set to 256 to keep
             all images.
         `iso` : ISO used for all images.
+        `alpha` : Exponential smoothing constant for brightness.  Set to 0 to
+            average the last `brightwidth` shots instead.
+        `thumbs` : Folder for the thumbnail cache.  Set to None to skip thumbnails.
+        `thumbbudget` : Disk budget of the thumbnail cache, in bytes.
+        `rejectthumbs` : Keep a small thumbnail of each discarded shot, in the
+            `rejected` folder of the thumbnail cache.
+        `response` : Camera response model file written by responsemodel.py.
+            Without one, we assume brightness is linear in exposure.
+        `resume` : Carry on from the checkpoint in the timelapse folder, without
+            recalibrating, if it was saved less than `resume` seconds ago.
+            Set to 0 to always calibrate.
+        `trace` : Print a table of per-stage latencies every `trace` shots.
+            Set to 0 to turn the report off.
+        `lat`, `lon` : Location of the camera, in degrees.  If given, exposure
+            follows the predicted change in daylight between shots, and the
+            brightness feedback only corrects what the prediction misses.
+        `leader` : Broadcast each shot to follower cameras over zmq, so they
+            all fire together, and report how closely they do.
 
     Once the timelapser is initialized, use the `findinitialparams` method to find
     an initial value for shutterspeed to match the targetBrightness.
@@ -35,9 +62,10 @@ class timelapse:
         T=timelapse()
         T.timelapser()
 
-    The timelapser broadcasts zmq messages as it takes pictures.
-    The `listen` method sets up the timelapser to listen for signals from 192.168.0.1,
-    and take a shot when a signal is received.
+    With `leader` set, the timelapser broadcasts each shot as a zmq message,
+    a moment before taking it.  The `listen` method sets up the timelapser to
+    listen for signals from 192.168.0.1, and take a shot with the same settings
+    at the same moment.  See trigger.py.
 
     EXAMPLE::
         T=timelapse()
@@ -45,7 +73,13 @@ class timelapse:
     """
     def __init__(self, nodelete=False, w=1920, h=1080, interval=15, maxtime=0, maxshots=0,
                  targetBrightness=100, maxdelta=256, iso=100,
-                 colourbalance='133/64' '337/256', hdr=60):
+                 colourbalance='133/64' '337/256', hdr=60,
+                 thumbs=None, thumbbudget=64*1024*1024, alpha=0,
+                 rejectthumbs=False, lat=None, lon=None, response=None,
+                 trace=100, resume=600, leader=False):
+        #picamera, PIL and the HDR merge are imported where they're first
+        #needed, so the script gets to the camera as soon as it can.
+        import picamera
         self.camera=picamera.PiCamera()
         self.camera.framerate = 10
 
@@ -64,6 +98,31 @@ class timelapse:
         # pictures will be taken, with hdr as exposure compensation
         self.hdr=hdr
         self.nodelete = nodelete
+        #Timings of each stage of a shot.
+        self.tracer=tracer(every=trace)
+        #HDR merges and thumbnails run between shots, as the Pi's temperature
+        #allows, and never past the next capture.
+        self.scheduler=backgroundscheduler()
+        #Follower cameras, if we're leading any.
+        self.trigger=None
+        self.syncevery=20
+        if leader:
+            from trigger import leader
+            self.trigger=leader()
+        self.light=None
+        if lat is not None and lon is not None:
+            self.light=lightmodel(lat, lon)
+        # Every kept shot is catalogued in folder/frames.log.
+        self.folder='/media/Usb-Drive/Timelapse/'
+        self.frames=framelog(self.folder)
+        self.exposures=exposurelog(self.folder, writer=True)
+        self.thumbs=None
+        self.rejectthumbs=None
+        if thumbs is not None:
+            self.thumbs=thumbcache(thumbs, budget=thumbbudget)
+            if rejectthumbs:
+                self.rejectthumbs=thumbcache(self.thumbs.folder+'rejected/',
+                                             budget=thumbbudget/8, sizes=['small'])
 
         #metersite is one of 'c', 'a', 'l', or 'r', for center, all, left or right.
         #Chooses a region of the image to use for brightness measurements.
@@ -75,19 +134,57 @@ class timelapse:
         self.minss=100
         self.floatToSS = lambda x : max(min(int(self.minss+(self.maxss-self.minss)*x), self.maxss), self.minss)
         self.SSToFloat = lambda ss : max(min((float(ss)-self.minss)/(self.maxss-self.minss),1.0),0.0)
+        #Exposure steps are planned in stops, at our fixed ISO, and limited to
+        #half a stop per shot.
+        slope=1.0
+        if response is not None:
+            M=responsemodel.load(response)
+            if M is not None: slope=M.slope
+        self.planner=exposureplanner(minss=self.minss, maxss=self.maxss,
+                                     miniso=iso, maxiso=iso, maxstep=0.5,
+                                     slope=slope)
 
         #Brightness data caching.
         self.brightwidth=20
-        self.brData=[]
-        self.brindex=0
+        if alpha>0:
+            self.brData=brightnesstracker('ema', alpha=alpha)
+        else:
+            self.brData=brightnesstracker('window', width=self.brightwidth)
         self.lastbr=0
         self.avgbr=0
         self.shots_taken=0
+        self.rejected=0
+
+        #Controller state is checkpointed after every shot.
+        self.checkpoint=checkpoint(self.folder+'checkpoint.json', maxage=resume)
+        self.deadline=None
+        state=None
+        if resume>0:
+            state=self.checkpoint.load()
+            if state is not None and state['iso']!=iso: state=None
 
         print 'Finding initial SS....'
         # Give the camera's auto-exposure and auto-white-balance algorithms
         # some time to measure the scene and determine appropriate values
         time.sleep(1)
+        if state is not None:
+            self.resume(state)
+        else:
+            self.calibrate()
+        print "Set up timelapser with: "
+        print "\tmaxtime :\t", self.maxtime
+        print "\tmaxshots:\t", self.maxshots
+        print "\tinterval:\t", self.interval
+        print "\tBrightns:\t", self.targetBrightness
+        print "\tSize    :\t", self.w, 'x', self.h
+
+    def __repr__(self):
+        return 'A timelapse instance.'
+
+    def calibrate(self):
+        """
+        Find the white balance and an initial shutterspeed from scratch.
+        """
         # This capture discovers initial AWB and SS.
         self.camera.capture('try.jpg')
         self.camera.shutter_speed = self.camera.exposure_speed
@@ -109,15 +206,41 @@ class timelapse:
             self.camera.awb_gains = self.wb_gains
 
         self.findinitialparams()
-        print "Set up timelapser with: "
-        print "\tmaxtime :\t", self.maxtime
-        print "\tmaxshots:\t", self.maxshots
-        print "\tinterval:\t", self.interval
-        print "\tBrightns:\t", self.targetBrightness
-        print "\tSize    :\t", self.w, 'x', self.h
 
-    def __repr__(self):
-        return 'A timelapse instance.'
+    def resume(self, state):
+        """
+        Pick up exposure, white balance, smoothing and the shot count from a
+        checkpoint, instead of calibrating.
+        """
+        print 'Resuming from checkpoint saved', round(time.time()-state['saved']), 's ago'
+        self.currentss=state['ss']
+        self.camera.shutter_speed=self.currentss
+        self.camera.exposure_mode = 'off'
+        self.camera.awb_mode = 'off'
+        self.camera.awb_gains = tuple([ Fraction(x) for x in state['wb'] ])
+        S=brightnesstracker.fromstate(state['smoothing'])
+        if (S.mode, S.width, S.alpha)==(self.brData.mode, self.brData.width, self.brData.alpha):
+            self.brData=S
+        (self.lastbr, self.avgbr)=(state['lastbr'], state['avgbr'])
+        self.shots_taken=state['shots']
+        self.rejected=state['rejected']
+        self.deadline=state['deadline']
+
+    def save_checkpoint(self, deadline):
+        """
+        Checkpoint the controller state, with the time of the next shot.
+        """
+        self.checkpoint.save({
+            'ss'       : self.currentss,
+            'iso'      : self.iso,
+            'wb'       : [ str(Fraction(x)) for x in self.camera.awb_gains ],
+            'smoothing': self.brData.state(),
+            'lastbr'   : self.lastbr,
+            'avgbr'    : self.avgbr,
+            'shots'    : self.shots_taken,
+            'rejected' : self.rejected,
+            'deadline' : deadline,
+        })
 
     def avgbrightness(self, im):
         """
@@ -160,18 +283,19 @@ class timelapse:
             if mu0 > 255: mu0 = 255
         return round(mu0,2)
 
-    def dynamic_adjust(self, gamma=0.2):
+    def dynamic_adjust(self, gamma=0.2, shottime=None, limit=True):
         """
-        Applies a simple gradient descent to try to correct shutterspeed and
-        brightness to match the target brightness.
+        Moves the exposure a fraction `gamma` of the way, in stops, towards the
+        target brightness, by at most half a stop unless `limit` is False.
+        If we have a light model and know when the last shot was taken, the
+        exposure also follows the predicted change in daylight until the
+        next one.
         """
-        delta=self.targetBrightness-self.lastbr
-        #Adj = lambda v: math.log( math.exp(v)*(1.0+1.0*delta*gamma/self.targetBrightness) )
-        Adj = lambda v: v*(1.0+1.0*delta*gamma/self.targetBrightness)
-        x=self.SSToFloat(self.currentss)
-        if x<=0.001: x=0.01
-        x=Adj(x)
-        self.currentss=self.floatToSS(x)
+        ff=0.0
+        if self.light is not None and shottime is not None:
+            ff=self.light.change(shottime, shottime+self.interval)
+        (self.currentss, iso)=self.planner.step(self.currentss, self.iso,
+            self.targetBrightness, self.lastbr, gain=gamma, ff=ff, limit=limit)
         #Find an appropriate framerate.
         #For low shutter speeds, ths can considerably speed up the capture.
         # FR=Fraction(9*1000000,10*self.currentss)
@@ -179,22 +303,39 @@ class timelapse:
         # if FR<0.1: FR=Fraction(1,10)
         # self.camera.framerate=FR
 
-    def capture(self):
+    def capture(self, trace=True, at=None):
         """
-        Take a picture, returning a PIL image.
+        Take a picture, returning a PIL image.  The capture and decode are
+        traced, unless `trace` is False.  If `at` is given, the capture starts
+        at that time, once the camera is set up.
         """
         # Create the in-memory stream
         stream = io.BytesIO()
         self.camera.ISO=self.iso
         self.camera.shutter_speed=self.currentss
         # x=self.SSToFloat(self.currentss)
+        if at is not None: waituntil(at)
         capstart=time.time()
-        self.camera.capture(stream, format='jpeg')
+        self.lastcapture=capstart
+        if trace:
+            with self.tracer.stage('capture'):
+                self.camera.capture(stream, format='jpeg')
+        else:
+            self.camera.capture(stream, format='jpeg')
         capend=time.time()
+        #When the shot was actually taken, camera latency and all.
+        self.lastreturn=capend
         print 'Exp: %d\tFR: %f\t Capture Time: %f' % (self.camera.exposure_speed, round(float(self.camera.framerate),2), round(capend-capstart,2) )
         # "Rewind" the stream to the beginning so we can read its content
         stream.seek(0)
+        self.stream=stream
+        import Image
         image = Image.open(stream)
+        if trace:
+            with self.tracer.stage('decode'):
+                image.load()
+        else:
+            image.load()
         return image
 
     def capture_hdr(self):
@@ -206,10 +347,10 @@ class timelapse:
         print self.currentss, self.hdr/100
         self.currentss = initialss - compensation
         print self.camera.shutter_speed
-        imunder = self.capture()
+        imunder = self.capture(trace=False)
         self.currentss = initialss + compensation
         print self.camera.shutter_speed
-        imover = self.capture()
+        imover = self.capture(trace=False)
         self.currentss = initialss
         print self.camera.shutter_speed
 
@@ -229,7 +370,7 @@ class timelapse:
             self.avgbr=self.lastbr
 
             #Dynamically adjust ss and iso.
-            self.dynamic_adjust(gamma=2.5)
+            self.dynamic_adjust(gamma=1.0, limit=False)
             x=self.SSToFloat(self.currentss)
             print 'ss, x, br:\t', self.currentss, round(x,2), round(self.lastbr,2)
             if x>=1.0:
@@ -259,56 +400,100 @@ class timelapse:
         return (self.currentss==self.minss)
 
 
-    def shoot(self,filename=None,ss_adjust=True):
+    def shoot(self,filename=None,ss_adjust=True,at=None):
         """
         Take a photo and save it at a specified filename.
+        The photo is metered in memory first, and not saved at all if its
+        brightness is more than `maxdelta` from the target.
         """
-        im=self.capture()
+        im=self.capture(at=at)
+        stream=self.stream
+        ss=self.currentss
+        shottime=self.lastcapture
+
+        L=self.tracer
+        if ss_adjust:
+            with L.stage('meter'):
+                self.lastbr=self.avgbrightness(im)
+                self.avgbr=self.brData.add(self.lastbr)
+            delta=self.targetBrightness-self.lastbr
+            #if abs(delta)>self.maxdelta and not (maxxedbr or minnedbr):
+            kept=abs(delta)<=self.maxdelta
+            with L.stage('log'):
+                self.exposures.append(ss, self.iso, self.lastbr, self.avgbr, kept=kept)
+            if not kept:
+                #Too far from target brightness.
+                self.rejected+=1
+                if self.rejectthumbs is not None:
+                    with L.stage('thumbs'):
+                        self.rejectthumbs.add(im, stream.getvalue(), filename or '')
+                self.dynamic_adjust(shottime=shottime)
+                L.shot()
+                return False
+
         #Saves file without exif and raster data; reduces file size by 90%,
         if filename!=None:
-            try:
-                im.save(filename)
-            except:
-                os.mkdir('/media/Usb-Drive/Timelapse/{:%Y-%m-%d}'.format(datetime.now()))
+            #Encode in memory first, so a slow drive shows up as its own stage.
+            with L.stage('encode'):
+                out=io.BytesIO()
+                im.save(out, format='jpeg')
+            with L.stage('write'):
+                try:
+                    f=open(filename, 'wb')
+                except IOError:
+                    os.mkdir('/media/Usb-Drive/Timelapse/{:%Y-%m-%d}'.format(datetime.now()))
+                    f=open(filename, 'wb')
+                f.write(out.getvalue())
+                f.close()
         if self.hdr != 0:
-            ims = self.capture_hdr()
-            filename = filename.replace('.jpg', '')
-            ims[0].save(filename + '_under.jpg')
-            ims[1].save(filename + '_over.jpg')
+            with L.stage('hdr'):
+                ims = self.capture_hdr()
+                filename = filename.replace('.jpg', '')
+                ims[0].save(filename + '_under.jpg')
+                ims[1].save(filename + '_over.jpg')
 
             filenames = [filename + '.jpg',
                          filename + '_under.jpg',
                          filename + '_over.jpg']
 
-            MergeHDRStack(filenames, filename + '_HDR.jpg')
-            if self.nodelete is not True:
-                for x in filenames[1:]:
-                    try:
-                        os.remove(x)
-                    except OSError, e:
-                        print ("Error: %s - %s." % (e.filename,e.strerror))
+            self.scheduler.submit(self.merge_hdr, (filenames, filename + '_HDR.jpg'),
+                                  name='merge')
             filename = filename + '.jpg'
 
         if not ss_adjust: return None
 
-        self.lastbr=self.avgbrightness(im)
-        if len(self.brData)==self.brightwidth:
-            self.brData[self.brindex%self.brightwidth]=self.lastbr
-        else:
-            self.brData.append(self.lastbr)
-
         #Dynamically adjust ss and iso.
-        self.avgbr=sum(self.brData)/len(self.brData)
-        self.dynamic_adjust()
+        self.dynamic_adjust(shottime=shottime)
         self.shots_taken+=1
-        self.brindex=(self.brindex+1)%self.brightwidth
 
-        delta=self.targetBrightness-self.lastbr
-        #if abs(delta)>self.maxdelta and not (maxxedbr or minnedbr):
-        if abs(delta)>self.maxdelta:
-            #Too far from target brightness.
-            self.shots_taken-=1
-            os.remove(filename)
+        if filename!=None:
+            with L.stage('log'):
+                self.frames.add(filename, ss=ss, iso=self.iso, brightness=self.lastbr)
+            if self.thumbs is not None:
+                self.scheduler.submit(self.add_thumbs, (im, stream.getvalue(), filename),
+                                      name='thumbs', priority=20)
+        L.shot()
+        return True
+
+    def merge_hdr(self, filenames, output):
+        """
+        Merge an HDR bracket, and delete the extra exposures unless `nodelete`.
+        Runs in the background, between shots.
+        """
+        with self.tracer.stage('merge'):
+            from MergeHDRStack import MergeHDRStack
+            MergeHDRStack(filenames, output)
+        if self.nodelete is not True:
+            with self.tracer.stage('delete'):
+                for x in filenames[1:]:
+                    try:
+                        os.remove(x)
+                    except OSError, e:
+                        print ("Error: %s - %s." % (e.filename,e.strerror))
+
+    def add_thumbs(self, im, data, filename):
+        with self.tracer.stage('thumbs'):
+            self.thumbs.add(im, data, filename)
 
 
     def timelapser(self):
@@ -317,24 +502,81 @@ class timelapse:
         """
         start_time=time.time()
         elapsed=time.time()-start_time
+        #After a restart, keep to the schedule we were on.
+        if self.deadline is not None:
+            self.scheduler.idle(self.deadline)
+        #Loops, rejected shots and all, for re-measuring follower clocks.
+        loops=0
+        if self.trigger is not None: self.trigger.sync()
 
         while (elapsed<self.maxtime or self.maxtime==-1) and (self.shots_taken<self.maxshots or self.maxshots==-1):
             loopstart=time.time()
             dtime=subprocess.check_output(['date', '+%y%m%d_%T']).strip()
             dtime=dtime.replace(':', '.')
-            #Broadcast options for this picture on zmq.
-            command='0 shoot {} {} {} {}'.format(self.w, self.h, self.currentss, dtime)
+            at=None
+            if self.trigger is not None:
+                #Broadcast options for this picture on zmq, and shoot with the
+                #followers a moment later.
+                at=self.trigger.trigger(self.w, self.h, self.currentss, self.iso)
 
             #Take a picture.
-            filename='/media/Usb-Drive/Timelapse/{:%Y-%m-%d/%Y-%m-%d-%H-%M-%S}.jpg'.format(datetime.now())
-            self.shoot(filename=filename)
+            filename='/media/Usb-Drive/Timelapse/{:%Y-%m-%d/%Y-%m-%d-%H-%M-%S}.jpg'.format(datetime.fromtimestamp(at or time.time()))
+            self.shoot(filename=filename, at=at)
 
             loopend=time.time()
             x=self.SSToFloat(self.currentss)
-            print 'SS: ', self.currentss, '\tX:', round(x,2), '\tBR: ', self.lastbr, '\tShots:', self.shots_taken, '\tT:', round(loopend-loopstart,1)
-
-            #Wait for next shot.
-            time.sleep(max([0,self.interval-(loopend-loopstart)]))
+            print 'SS: ', self.currentss, '\tX:', round(x,2), '\tBR: ', self.lastbr, '\tShots:', self.shots_taken, '\tRejected:', self.rejected, '\tT:', round(loopend-loopstart,1)
+            loops+=1
+            if self.trigger is not None:
+                self.trigger.collect()
+                if loops%self.syncevery==0:
+                    print 'Trigger skew:'
+                    print self.trigger.report()
+                    #Re-measure the followers' clocks now and then, in the time
+                    #to spare before the next shot, never delaying it.
+                    spare=loopstart+self.interval-time.time()-self.trigger.lead
+                    if spare>0.5: self.trigger.sync(timeout=min(0.5, spare/10))
+
+            self.save_checkpoint(loopstart+self.interval)
+
+            #Wait for next shot, doing background work if there's time.
+            self.scheduler.idle(loopstart+self.interval)
+
+        self.scheduler.drain()
+
+    def listen(self, host='192.168.0.1', port=PORT, replyport=REPLYPORT):
+        """
+        Take pictures when the leader at `host` does, with its settings,
+        instead of on our own schedule.  Pictures are named after the leader's
+        shot time, so each camera's copy of a shot has the same name.
+        """
+        from trigger import follower
+        F=follower(host, port, replyport)
+        shots=0
+        while shots<self.maxshots or self.maxshots==-1:
+            cmd=F.next()
+            if (cmd['w'], cmd['h'])!=(self.w, self.h):
+                self.w=cmd['w']
+                self.h=cmd['h']
+                self.camera.resolution=(self.w, self.h)
+            self.currentss=cmd['ss']
+            self.iso=cmd['iso']
+            filename=self.folder+'{:%Y-%m-%d/%Y-%m-%d-%H-%M-%S}.jpg'.format(datetime.fromtimestamp(cmd['deadline']))
+            im=self.capture(at=cmd['local'])
+            #We fired when we woke for the deadline; exposure, readout and
+            #encoding after that are the camera's latency, reported apart.
+            F.fired(cmd, self.lastcapture, latency=self.lastreturn-self.lastcapture)
+            #Save it as shoot() would, without metering or adjusting exposure.
+            with self.tracer.stage('write'):
+                try:
+                    im.save(filename)
+                except IOError:
+                    os.mkdir(os.path.dirname(filename))
+                    im.save(filename)
+            self.tracer.shot()
+            shots+=1
+            print 'SS: ', self.currentss, '\tShots:', shots, '\tLate by: %.1f ms' % (1000*(self.lastcapture-cmd['local']))
+        F.close()
 
 
 #-------------------------------------------------------------------------------
@@ -355,6 +597,10 @@ def main(argv):
     parser.add_argument('-d', '--delta', default=128, type=int, help='Maximum allowed distance of photo brightness from target brightness; discards photos too far from the target.  This is useful for autmatically discarding late-night shots.\nDefault is 128; Set to 256 to keep all images.' )
     parser.add_argument('-m', '--metering', default='a', type=str, choices=['a','c','l','r'], help='Where to average brightness for brightness calculations.\n"a" measures the whole image, "c" uses a window at the center, "l" meters a strip at the left, "r" uses a strip at the right.' )
     parser.add_argument('-I', '--iso', default=100, type=int, help='Set ISO.')
+    parser.add_argument('--response', default=None, type=str, help='Camera response model written by responsemodel.py, for calibrating in one step.')
+    parser.add_argument('--lat', default=None, type=float, help='Latitude of the camera in degrees, for predicting daylight.')
+    parser.add_argument('--lon', default=None, type=float, help='Longitude of the camera in degrees, east positive, for predicting daylight.')
+    parser.add_argument('-a', '--alpha', default=0, type=float, help='Exponential smoothing constant for brightness, from 0 to 1.\nDefault is 0, which averages the last 20 shots instead.' )
     parser.add_argument('-c', '--colourbalance', nargs=2, default='133/64' '337/256',
                         type=str, help='Set white balance as red and blue. '
                                        '''\nEg. \'493/256\' '387/256\' ''')
@@ -362,6 +608,26 @@ def main(argv):
                         help='Take two additional images, one under-, one '
                                'overexposed. \n Set this from 1 to 25,'
                                'depending the desired difference in exposure')
+    parser.add_argument('--thumbs', default='/media/Usb-Drive/Timelapse/thumbs/', type=str,
+                        help='Folder for small and medium thumbnails of each shot. '
+                             'Set to "none" to skip thumbnails.')
+    parser.add_argument('--rejectthumbs', action='store_true',
+                        help='Keep a small thumbnail of each discarded shot.')
+    parser.add_argument('--thumbbudget', default=64, type=int,
+                        help='Disk budget of the thumbnail cache in Mb.  Default is 64.')
+    parser.add_argument('--resume', default=600, type=int,
+                        help='Resume without recalibrating if the last checkpoint '
+                             'is less than RESUME seconds old.  Default is 600; '
+                             'set to 0 to always calibrate.')
+    parser.add_argument('--trace', default=100, type=int,
+                        help='Print per-stage latencies every TRACE shots.  '
+                             'Default is 100; set to 0 to turn it off.')
+    parser.add_argument('--leader', action='store_true',
+                        help='Broadcast each shot, so that cameras started with '
+                             '--listen take it at the same moment.')
+    parser.add_argument('--listen', default=None, type=str, metavar='HOST',
+                        help='Take pictures when the leader at HOST does, '
+                             'instead of on our own schedule.')
 
 
     args=parser.parse_args()
@@ -374,14 +640,26 @@ def main(argv):
                    maxshots=args.maxshots, maxtime=args.maxtime,
                    targetBrightness=args.brightness, maxdelta=args.delta,
                    iso=args.iso, colourbalance=args.colourbalance,
-                   hdr=args.hdr)
+                   hdr=args.hdr,
+                   thumbs=None if args.thumbs=='none' else args.thumbs,
+                   thumbbudget=args.thumbbudget*1024*1024,
+                   alpha=args.alpha,
+                   rejectthumbs=args.rejectthumbs,
+                   lat=args.lat, lon=args.lon,
+                   response=args.response,
+                   trace=args.trace,
+                   resume=args.resume,
+                   leader=args.leader)
 
     try:
         os.listdir('/media/Usb-Drive/Timelapse/')
     except:
         os.mkdir('/media/Usb-Drive/Timelapse')
 
-    TL.timelapser()
+    if args.listen is not None:
+        TL.listen(args.listen)
+    else:
+        TL.timelapser()
 
     return True
 
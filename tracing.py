@@ -0,0 +1,151 @@
+import ctypes, ctypes.util, time, array
+from collections import OrderedDict
+
+#-------------------------------------------------------------------------------
+#A monotonic clock, so stage timings don't jump when NTP steps the wall clock.
+#Python 2 has no time.monotonic, so we call clock_gettime ourselves.
+
+CLOCK_MONOTONIC=1
+
+class timespec(ctypes.Structure):
+    _fields_=[('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+try:
+    _librt=ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1')
+    _clock_gettime=_librt.clock_gettime
+    _clock_gettime.argtypes=[ctypes.c_int, ctypes.POINTER(timespec)]
+except (OSError, AttributeError):
+    _clock_gettime=None
+_ts=timespec()
+
+def monotonic():
+    """
+    Seconds on a monotonic clock, or the wall clock if there isn't one.
+    """
+    if _clock_gettime is None or _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(_ts))!=0:
+        return time.time()
+    return _ts.tv_sec+_ts.tv_nsec*1e-9
+
+#-------------------------------------------------------------------------------
+
+class _stage:
+    """
+    Context manager timing one stage; see `tracer.stage`.
+    """
+    def __init__(self, tracer, name):
+        self.tracer=tracer
+        self.name=name
+
+    def __enter__(self):
+        self.start=monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        end=monotonic()
+        self.tracer.record(self.name, end-self.start)
+        self.tracer.overhead+=monotonic()-end
+        return False
+
+class tracer:
+    """
+    Per-stage latency tracing for the capture loop.
+
+    The last `size` timings of each stage are kept in a fixed-size ring, so
+    memory stays flat however long the timelapse runs.  Call `shot()` once per
+    shot; every `every` shots the tracer prints a percentile report.  Set
+    `every` to 0 to only report on request.
+
+    The bookkeeping is timed too (`overhead`), and reported as a share of the
+    time spent in traced stages.  Stages shouldn't nest, or that share will
+    come out low.
+
+    EXAMPLE::
+        L=tracer(every=100)
+        with L.stage('capture'):
+            im=camera.capture()
+        L.shot()
+        print L.report()
+
+    Timings are kept in plain arrays, so numpy is only imported for a report.
+    """
+    def __init__(self, size=1024, every=100):
+        self.size=size
+        self.every=every
+        #stage name -> (ring of timings in seconds, number recorded)
+        self.rings=OrderedDict()
+        self.counts={}
+        self.shots=0
+        self.traced=0.0
+        self.overhead=0.0
+
+    def __repr__(self):
+        return 'Stage tracer, %d shots' % self.shots
+
+    def stage(self, name):
+        """
+        Time the enclosed block as stage `name`.
+        """
+        return _stage(self, name)
+
+    def record(self, name, seconds):
+        """
+        Record one timing for stage `name`.
+        """
+        ring=self.rings.get(name)
+        if ring is None:
+            ring=self.rings[name]=array.array('d', [0.0])*self.size
+            self.counts[name]=0
+        n=self.counts[name]
+        ring[n%self.size]=seconds
+        self.counts[name]=n+1
+        self.traced+=seconds
+
+    def timings(self, name):
+        """
+        The timings of stage `name` still in the ring, in seconds, oldest first.
+        """
+        import numpy as np
+        if name not in self.rings: return np.zeros(0)
+        (ring, n)=(self.rings[name], self.counts[name])
+        if n<=self.size: return np.array(ring[:n])
+        i=n%self.size
+        return np.array(ring[i:]+ring[:i])
+
+    def percentiles(self, name, q=(50, 90, 99)):
+        """
+        Percentiles of stage `name`, in seconds.
+        """
+        import numpy as np
+        t=self.timings(name)
+        if len(t)==0: return [ None for x in q ]
+        return list(np.percentile(t, q))
+
+    def histogram(self, name, bins=10):
+        """
+        Histogram of stage `name`: counts and bin edges, in seconds.
+        """
+        import numpy as np
+        return np.histogram(self.timings(name), bins=bins)
+
+    def shot(self):
+        """
+        Mark the end of a shot, printing a report every `every` shots.
+        """
+        self.shots+=1
+        if self.every and self.shots%self.every==0:
+            print self.report()
+
+    def report(self):
+        """
+        A table of per-stage percentiles, in milliseconds.
+        """
+        import numpy as np
+        lines=['%-10s %6s %8s %8s %8s %8s %8s' % ('stage', 'n', 'mean', 'p50', 'p90', 'p99', 'max')]
+        for name in self.rings:
+            t=self.timings(name)*1000
+            (p50, p90, p99)=np.percentile(t, (50, 90, 99))
+            lines.append('%-10s %6d %8.1f %8.1f %8.1f %8.1f %8.1f' % (
+                name, self.counts[name], t.mean(), p50, p90, p99, t.max()))
+        if self.traced>0:
+            lines.append('Tracing overhead: %.3f%%' % (100*self.overhead/self.traced))
+        return '\n'.join(lines)
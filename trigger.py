@@ -0,0 +1,208 @@
+import json, socket, time
+from collections import deque
+
+#Leader and follower ports: shot commands go out on one, replies come back on
+#the other.
+PORT=5556
+REPLYPORT=5557
+
+def waituntil(t):
+    """
+    Sleep until time `t`, finishing with a short spin so we wake within a
+    fraction of a millisecond of it.  Returns the time we actually woke.
+    """
+    while True:
+        now=time.time()
+        left=t-now
+        if left<=0: return now
+        if left>0.002: time.sleep(left-0.0015)
+
+class leader:
+    """
+    Broadcasts shot commands to follower cameras over zmq, so they all fire
+    at a shared deadline, and measures how far each one misses it.
+
+    Every command carries a deadline `lead` seconds ahead, in the leader's
+    clock.  `sync` measures each follower's clock offset with a round trip,
+    and sends it back, so followers convert the deadline to their own clock.
+    Followers reply with the time they actually fired; `skew` keeps the last
+    `history` misses of each, in seconds.  Followers that also report how
+    long their captures took have the last `history` of those in `latency`.
+
+    EXAMPLE::
+        L=leader()
+        L.sync()
+        deadline=L.trigger(1920, 1080, ss, iso)
+        waituntil(deadline)
+        camera.capture(...)
+        L.collect()
+        print L.report()
+    """
+    def __init__(self, port=PORT, replyport=REPLYPORT, lead=0.2, history=100, host='*'):
+        import zmq
+        self.context=zmq.Context.instance()
+        self.pub=self.context.socket(zmq.PUB)
+        self.pub.bind('tcp://%s:%d' % (host, port))
+        self.pull=self.context.socket(zmq.PULL)
+        self.pull.bind('tcp://%s:%d' % (host, replyport))
+        self.lead=lead
+        self.history=history
+        self.seq=0
+        self.offsets={}
+        self.skew={}
+        self.latency={}
+
+    def __repr__(self):
+        return 'Trigger leader, %d followers' % len(self.offsets)
+
+    def send(self, topic, msg):
+        self.pub.send_multipart([topic, json.dumps(msg)])
+
+    def replies(self, timeout):
+        """
+        Yield replies from followers until none arrive for `timeout` seconds.
+        """
+        while self.pull.poll(int(timeout*1000)):
+            yield json.loads(self.pull.recv())
+
+    def sync(self, rounds=5, timeout=0.5):
+        """
+        Estimate each follower's clock offset from the leader by timing ping
+        round trips, keeping the one with the shortest trip, and tell the
+        followers.  Returns {follower: (offset, roundtrip)}.
+        """
+        best={}
+        for i in range(rounds):
+            self.send('ping', {'t0': time.time()})
+            for r in self.replies(timeout):
+                if r['type']=='pong':
+                    t2=time.time()
+                    rtt=t2-r['t0']
+                    offset=r['t1']-(r['t0']+t2)/2
+                    if r['node'] not in best or rtt<best[r['node']][1]:
+                        best[r['node']]=(offset, rtt)
+                else:
+                    self.record(r)
+        self.offsets.update(best)
+        self.send('offsets', dict([ (n, o[0]) for (n, o) in self.offsets.items() ]))
+        return best
+
+    def trigger(self, w, h, ss, iso, deadline=None):
+        """
+        Broadcast a shot command.  Returns the deadline, in our clock.
+        """
+        if deadline is None: deadline=time.time()+self.lead
+        self.seq+=1
+        self.send('shoot', {'seq': self.seq, 'w': w, 'h': h, 'ss': ss,
+                            'iso': iso, 'deadline': deadline})
+        return deadline
+
+    def record(self, r):
+        if r['type']!='fired': return
+        if r['node'] not in self.skew:
+            self.skew[r['node']]=deque(maxlen=self.history)
+        self.skew[r['node']].append(r['fired']-r['deadline'])
+        if 'latency' in r:
+            if r['node'] not in self.latency:
+                self.latency[r['node']]=deque(maxlen=self.history)
+            self.latency[r['node']].append(r['latency'])
+
+    def collect(self, timeout=0):
+        """
+        Record any replies that have come in.
+        """
+        for r in self.replies(timeout):
+            self.record(r)
+
+    def report(self):
+        """
+        Per-follower trigger skew: mean and worst, in milliseconds, and the
+        mean capture latency, where followers report it.
+        """
+        lines=[]
+        for node in sorted(self.skew):
+            s=[ 1000*x for x in self.skew[node] ]
+            if not s: continue
+            line='%-12s n=%d  mean %.2f ms  worst %.2f ms  offset %.2f ms' % (
+                node, len(s), sum(s)/len(s), max([ abs(x) for x in s ]),
+                1000*self.offsets.get(node, (0,))[0])
+            c=self.latency.get(node)
+            if c: line+='  capture %.1f ms' % (1000*sum(c)/len(c))
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def close(self):
+        self.pub.close(linger=0)
+        self.pull.close(linger=0)
+
+class follower:
+    """
+    Receives shot commands from a `leader`, answers its clock pings, and
+    reports when it fired.
+
+    EXAMPLE::
+        F=follower('192.168.0.1')
+        while True:
+            cmd=F.next()
+            fired=waituntil(cmd['local'])
+            camera.capture(...)
+            F.fired(cmd, fired, latency=time.time()-fired)
+    """
+    def __init__(self, host='192.168.0.1', port=PORT, replyport=REPLYPORT, name=None):
+        import zmq
+        self.context=zmq.Context.instance()
+        self.sub=self.context.socket(zmq.SUB)
+        self.sub.setsockopt(zmq.SUBSCRIBE, b'')
+        self.sub.connect('tcp://%s:%d' % (host, port))
+        self.push=self.context.socket(zmq.PUSH)
+        self.push.connect('tcp://%s:%d' % (host, replyport))
+        if name is None: name=socket.gethostname()
+        self.name=name
+        #Our clock minus the leader's.
+        self.offset=0.0
+
+    def __repr__(self):
+        return 'Trigger follower '+self.name
+
+    def reply(self, msg):
+        msg['node']=self.name
+        self.push.send(json.dumps(msg))
+
+    def next(self, timeout=None):
+        """
+        Wait for the next shot command, handling clock sync on the way.
+        Returns the command with its deadline in our clock as `local`, or
+        None if `timeout` seconds pass first.
+        """
+        end=None
+        if timeout is not None: end=time.time()+timeout
+        while True:
+            wait=-1
+            if end is not None:
+                wait=max(0, int(1000*(end-time.time())))
+            if not self.sub.poll(wait): return None
+            (topic, msg)=self.sub.recv_multipart()
+            msg=json.loads(msg)
+            if topic=='ping':
+                msg['t1']=time.time()
+                msg['type']='pong'
+                self.reply(msg)
+            elif topic=='offsets':
+                self.offset=msg.get(self.name, self.offset)
+            elif topic=='shoot':
+                msg['local']=msg['deadline']+self.offset
+                return msg
+
+    def fired(self, cmd, t, latency=None):
+        """
+        Report that we fired for `cmd` at time `t`, in our clock, and how
+        many seconds the capture then took, if known.
+        """
+        msg={'type': 'fired', 'seq': cmd['seq'],
+             'deadline': cmd['deadline'], 'fired': t-self.offset}
+        if latency is not None: msg['latency']=latency
+        self.reply(msg)
+
+    def close(self):
+        self.sub.close(linger=0)
+        self.push.close(linger=0)